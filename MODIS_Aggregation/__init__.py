@@ -8,19 +8,107 @@ __version__ = '0.1.0'
 from .cloud_fraction_aggregate import *
 from .baseline_series import *
 from .checkaddition import *
+from .mpi_aggregation import *
+from .granule_index import *
+from .file_discovery import *
+from .accumulator import *
+from .checkpoint import *
+from .rollup import *
+from .level3_writer import *
+from .moments import *
+from .synthetic import *
+from .profiling import *
+from .index_cache import *
+from .cloud_mask import *
+from .granule_cache import *
+from .pyramid import *
+from .sparse import *
+from .planner import *
+from .fused import *
+from .periods import *
 
 # if somebody does "from Sample import *", this is what they will
 # be able to access:
 __all__ = [
     'aggregateOneFileData'
+    ,'countCloudPixels'
+    ,'gridShape'
     ,'displayOutput'
+    ,'aggregateOneFileMask'
+    ,'calculateCloudMaskFractions'
+    ,'decode_cloud_mask'
+    ,'count_cloud_mask'
+    ,'aggregateOneFilePartial'
+    ,'readOneFile'
     ,'calculateCloudFraction'
+    ,'gridIndex'
+    ,'lazyOneFileCounts'
+    ,'calculateCloudFractionLazy'
     ,'getInputDirectories'
     ,'read_filelist'
+    ,'granule_key'
+    ,'scan_granules'
+    ,'pair_granules'
     ,'readEntry'
+    ,'read_sampled'
+    ,'read_MOD06'
     ,'read_MODIS'
+    ,'init_grid_data'
+    ,'GridAccumulator'
+    ,'SparseHistogram'
     ,'cal_stats'
     ,'run_modis_aggre'
+    ,'run_modis_aggre_periods'
+    ,'period_bounds'
+    ,'period_label'
+    ,'Period'
+    ,'aggre_granule_legacy'
+    ,'aggre_granule'
+    ,'fused_aggre_granule'
+    ,'merge_granule'
+    ,'merge_grid_data'
+    ,'cell_moments'
+    ,'merge_moments'
+    ,'MOMENT_ATTRS'
+    ,'finalize'
+    ,'aggre_file'
+    ,'try_aggre_file'
+    ,'locate_grid_index'
+    ,'GridIndexCache'
+    ,'GranuleCache'
+    ,'preprocess_granules'
     ,'addGridEntry'
+    ,'write_level3'
+    ,'write_grid_entry'
+    ,'write_sparse_entry'
+    ,'read_sparse_entry'
+    ,'choose_chunks'
+    ,'save_checkpoint'
+    ,'load_checkpoint'
+    ,'run_config'
+    ,'save_accumulators'
+    ,'load_accumulators'
+    ,'merge_accumulators'
+    ,'rollup_product'
+    ,'coarsen_grid_data'
+    ,'build_pyramid'
+    ,'write_pyramid'
+    ,'plan_run'
+    ,'format_plan'
+    ,'allocate_grid_data'
+    ,'get_mpi_comm'
+    ,'reduce_grid_data'
+    ,'run_modis_aggre_mpi'
+    ,'parse_granule_time'
+    ,'build_granule_index'
+    ,'load_granule_index'
+    ,'query_granule_index'
+    ,'prune_granules'
+    ,'write_synthetic_granule'
+    ,'write_synthetic_granules'
+    ,'Profile'
+    ,'get_profile'
+    ,'enable_profile'
+    ,'disable_profile'
     ,'addition'
 ]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Compact, contiguous storage of the level-3 accumulators.
+
+Instead of one float64 array per 'key_statistic' string, GridAccumulator
+keeps each statistic of all variables in one preallocated block with a
+suitable type: integer pixel and histogram counts, float64 (or float32)
+values. The slot of every grid_data key inside its block is computed once,
+and the accumulator is a read-only mapping from the usual grid_data keys to
+views into the blocks, so run_modis_aggre (vectorized engine), merge_granule
+and addGridEntry use it in place of the grid_data dictionary. With
+sparse=True the histograms are SparseHistogram accumulators (see sparse.py),
+which only hold the non-zero counts of the touched grid cells.
+"""
+
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+from .baseline_series import sts_name
+from .histograms import compile_histogram_spec
+from .moments import MOMENT_NAMES
+from .sparse import SparseHistogram
+
+# Block holding each statistic of sts_name
+BLOCK_NAMES = ['Minimum', 'Maximum', 'Total', 'Pixel_Counts', 'Sum_Squares', 'Histogram_Counts', 'Joint_Histogram_Counts']
+
+
+class GridAccumulator(Mapping):
+    """Level-3 accumulators of all variables in a few typed, contiguous blocks.
+
+    Args:
+        varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, moments:
+            same as init_grid_data, which gives the same keys and shapes.
+        float_dtype: type of the minimum, maximum, total and sum of squares blocks.
+        count_dtype: (signed) integer type of the pixel and histogram count blocks.
+        sparse (bool): keep every histogram as a SparseHistogram instead of in the histogram blocks.
+
+    Blocks (see BLOCK_NAMES):
+        Minimum, Maximum, Total, Pixel_Counts, Sum_Squares (without moments) and the
+        moments (MOMENT_NAMES, with moments=True) have the shape
+        (number of variables, grid_lat * grid_lon); Histogram_Counts and
+        Joint_Histogram_Counts have the shape (grid_lat * grid_lon, total number of bins),
+        with the bins of each variable side by side, so the histograms of one grid cell are contiguous.
+        With sparse=True, these two blocks are not allocated and the histograms are in the
+        sparse dictionary instead.
+    """
+
+    def __init__(self, varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                 moments=False, float_dtype=np.float64, count_dtype=np.int64, sparse=False):
+        self.grid_size = grid_lat * grid_lon
+        self.blocks = OrderedDict()
+        self.sparse = OrderedDict()
+        self._views = OrderedDict()
+
+        hist_spec = compile_histogram_spec(varnames, intervals_1d, intervals_2d)
+        nvar = len(varnames)
+
+        # Precompute the slot of every key: (block, row) or (block, first bin, bin shape)
+        slots = []
+        hist_bins, jhist_bins = 0, 0
+        for key_idx, key in enumerate(varnames):
+            if sts_switch[0] == True:
+                slots.append((key + '_' + sts_name[0], BLOCK_NAMES[0], key_idx))
+            if sts_switch[1] == True:
+                slots.append((key + '_' + sts_name[1], BLOCK_NAMES[1], key_idx))
+            if (sts_switch[2] == True) | (sts_switch[3] == True) | (sts_switch[4] == True):
+                slots.append((key + '_' + sts_name[2], BLOCK_NAMES[2], key_idx))
+                slots.append((key + '_' + sts_name[3], BLOCK_NAMES[3], key_idx))
+                if not moments:
+                    slots.append((key + '_' + sts_name[4], BLOCK_NAMES[4], key_idx))
+            if moments & ((sts_switch[2] == True) | (sts_switch[4] == True)):
+                for name in MOMENT_NAMES:
+                    slots.append((key + '_' + name, name, key_idx))
+            if sts_switch[5] == True:
+                nbin1 = hist_spec.edges_1d[key_idx].size - 1
+                slots.append((key + '_' + sts_name[5], BLOCK_NAMES[5], (hist_bins, (nbin1,))))
+                hist_bins += nbin1
+
+                if sts_switch[6] == True:
+                    nbin2 = hist_spec.edges_2d[key_idx].size - 1
+                    slots.append((key + '_' + sts_name[6] + histnames[key_idx], BLOCK_NAMES[6],
+                                  (jhist_bins, (nbin1, nbin2))))
+                    jhist_bins += nbin1 * nbin2
+
+        # Allocate the blocks which hold at least one slot
+        used = set(slot[1] for slot in slots)
+        for name, dtype, fill in zip(BLOCK_NAMES[:5], [float_dtype, float_dtype, float_dtype, count_dtype, float_dtype],
+                                     [np.inf, -np.inf, 0, 0, 0]):
+            if name in used:
+                self.blocks[name] = np.full((nvar, self.grid_size), fill, dtype=dtype)
+        for name, dtype in zip(MOMENT_NAMES, [count_dtype, float_dtype, float_dtype]):
+            if name in used:
+                self.blocks[name] = np.zeros((nvar, self.grid_size), dtype=dtype)
+        if (BLOCK_NAMES[5] in used) and not sparse:
+            self.blocks[BLOCK_NAMES[5]] = np.zeros((self.grid_size, hist_bins), dtype=count_dtype)
+        if (BLOCK_NAMES[6] in used) and not sparse:
+            self.blocks[BLOCK_NAMES[6]] = np.zeros((self.grid_size, jhist_bins), dtype=count_dtype)
+
+        for key, name, slot in slots:
+            if isinstance(slot, tuple) and sparse:
+                self.sparse[key] = SparseHistogram((self.grid_size,) + slot[1], count_dtype)
+                self._views[key] = self.sparse[key]
+                continue
+            block = self.blocks[name]
+            if isinstance(slot, tuple):
+                start, shape = slot
+                view = block[:, start:start + int(np.prod(shape))].reshape((self.grid_size,) + shape)
+            else:
+                view = block[slot]
+            self._views[key] = view
+
+    def __getitem__(self, key):
+        return self._views[key]
+
+    def __iter__(self):
+        return iter(self._views)
+
+    def __len__(self):
+        return len(self._views)
+
+    @property
+    def nbytes(self):
+        # Memory held by the accumulators
+        return sum(block.nbytes for block in self.blocks.values()) + sum(
+            hist.nbytes for hist in self.sparse.values())
+
+    def to_grid_data(self):
+        # Export the grid_data dictionary layout (views into the blocks, no copies)
+        return OrderedDict(self._views)
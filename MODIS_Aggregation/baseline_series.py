@@ -32,7 +32,6 @@ V8 Updates: Change histogram count from averaged value to be all pixel values
 """
 
 import os
-import sys
 import h5py
 import timeit
 import random
@@ -43,6 +42,19 @@ from netCDF4 import Dataset
 from collections import OrderedDict
 from datetime import date, datetime
 from dateutil.rrule import rrule, DAILY, MONTHLY
+from .grid_reduction import sts_name, locate_grid_index, group_cells, cell_count, cell_nansum, cell_nanmin, \
+    cell_nanmax
+from .histograms import compile_histogram_spec, cell_histogram, cell_histogram2d
+from .parallel import map_granules, prefetch_map
+from .granule_index import prune_granules
+from .checkpoint import granule_name, save_checkpoint, load_checkpoint, run_config
+from .level3_writer import write_grid_entry, write_sparse_entry
+from .profiling import get_profile, set_thread_profile, Profile
+from .cloud_mask import cloudiness
+from .sparse import SparseHistogram
+from .fused import fused_aggre_granule, FUSED_COMPILED
+from .moments import MOMENT_NAMES, moment_keys, cell_moments, value_moments, flag_moments, \
+    merge_moments_into, finalize_moments
 
 
 def read_filelist(loc_dir, prefix, yr, day, fileformat):
@@ -54,9 +66,10 @@ def read_filelist(loc_dir, prefix, yr, day, fileformat):
     return fname
 
 
-def readEntry(key, ncf):
+def readEntry(key, ncf, spl_num=3):
     # Read the MODIS variables based on User's name list
-    rdval = np.array(ncf.variables[key]).astype(np.float)
+    # Only the sampled pixels are read from the file (strided hyperslab), then cast to float
+    rdval = read_sampled(ncf.variables[key], spl_num).astype(float)
 
     # For netCDF4, the variable is done by (rdval * scale) + offst
     # For MODIS HDF4 file, the variable should be done by (rdval-offst)*scale
@@ -71,73 +84,133 @@ def readEntry(key, ncf):
 
     rdval[np.where(rdval == fillvalue)] = np.nan
 
-    # Sampling the variable
-    rdval = rdval[2::spl_num, 3::spl_num]
-
     return rdval, lonam, unit, fillvalue, scale, offst
 
 
-def read_MODIS(varnames, fname1, fname2):
-    # Store the data from variables after reading MODIS files
+def read_sampled(ncvar, spl_num=3, *index):
+    # Sampling the variable while reading: the netCDF/HDF layer only decodes the pixels
+    # [2::spl_num, 3::spl_num] of the first two dimensions (starts from 3 and 4 counting from 1),
+    # index optionally selects the remaining dimensions, e.g. 0 for the first byte of Cloud_Mask_1km
+    values = np.array(ncvar[(slice(2, None, spl_num), slice(3, None, spl_num)) + index])
+    get_profile().count('bytes_read', values.nbytes)
+    return values
+
+
+def read_MOD06(varnames, fname1, spl_num=3):
+    # Read the Cloud Mask category and the User-defined variables of a MYD06 file
     data = {}
+    profile = get_profile()
 
     # Read the Cloud Mask from MYD06 product
-    ncfile = Dataset(fname1, 'r')
+    with profile.timer('read_mod06'):
+        ncfile = Dataset(fname1, 'r')
 
-    # CM1km = readEntry('Cloud_Mask_1km',ncfile)
-    # CM1km = np.array(ncfile.variables['Cloud_Mask_1km'])
-    # data['CM'] = (np.array(CM1km[:,:,0],dtype='byte') & 0b00000110) >>1
+        # CM1km = readEntry('Cloud_Mask_1km',ncfile)
+        # CM1km = np.array(ncfile.variables['Cloud_Mask_1km'])
+        # data['CM'] = (np.array(CM1km[:,:,0],dtype='byte') & 0b00000110) >>1
 
-    d06_CM = ncfile.variables['Cloud_Mask_1km'][:, :, 0]
-    CM1km = d06_CM[2::spl_num, 3::spl_num]
-    data['CM'] = (np.array(CM1km, dtype='byte') & 0b00000110) >> 1
-    data['CM'] = data['CM'].astype(np.float)
+        CM1km = read_sampled(ncfile.variables['Cloud_Mask_1km'], spl_num, 0)
+
+    # Cloudiness category (bits 1-2) as uint8, decoded through a lookup table (see cloud_mask.py)
+    with profile.timer('decode_cm'):
+        data['CM'] = cloudiness(CM1km)
 
     # Read the User-defined variables from MYD06 product
-    for key in varnames:
-        if key == 'cloud_fraction':
-            continue  # Ignoreing Cloud_Fraction from the input file
-        else:
-            data[key], lonam, unit, fill, scale, offst = readEntry(key, ncfile)
-            data[key] = (data[key] - offst) / scale
-            data[key] = (data[key] - offst) * scale
+    with profile.timer('read_mod06'):
+        for key in varnames:
+            if key == 'cloud_fraction':
+                continue  # Ignoreing Cloud_Fraction from the input file
+            else:
+                data[key], lonam, unit, fill, scale, offst = readEntry(key, ncfile, spl_num)
+                data[key] = (data[key] - offst) / scale
+                data[key] = (data[key] - offst) * scale
 
-    ncfile.close()
+        ncfile.close()
+    profile.count('pixels_read', data['CM'].size)
 
-    # Read the common variables (Latitude & Longitude) from MYD03 product
-    ncfile = Dataset(fname2, 'r')
-    d03_lat = np.array(ncfile.variables['Latitude'][:, :])
-    d03_lon = np.array(ncfile.variables['Longitude'][:, :])
-    lat = d03_lat[2::spl_num, 3::spl_num]
-    lon = d03_lon[2::spl_num, 3::spl_num]
-    attr_lat = ncfile.variables['Latitude']._FillValue
-    attr_lon = ncfile.variables['Longitude']._FillValue
+    return data
 
+
+def check_resolution(varnames, data, shape):
     # If the variable is not 1km product, exit and tell the User to reset the variables.
     for key in varnames:
         if key == 'cloud_fraction': continue  # Ignoreing Cloud_Fraction from the input file
-        if data[key].shape[0] != lat.shape[0]:
-            print("The dimension of varibale '" + key + "' is not match with latitude & longitude.")
-            print("Input variables should have 1km resolution.")
-            print("Check your varibales.")
-            sys.exit()
+        if data[key].shape[0] != shape[0]:
+            raise ValueError("The dimension of varibale '" + key + "' is not match with latitude & longitude. " + \
+                             "Input variables should have 1km resolution, check your varibales.")
+
+
+def read_MODIS(varnames, fname1, fname2, spl_num=3):
+    # Store the data from variables after reading MODIS files
+    data = read_MOD06(varnames, fname1, spl_num)
+    profile = get_profile()
+
+    # Read the common variables (Latitude & Longitude) from MYD03 product
+    with profile.timer('read_mod03'):
+        ncfile = Dataset(fname2, 'r')
+        lat = read_sampled(ncfile.variables['Latitude'], spl_num)
+        lon = read_sampled(ncfile.variables['Longitude'], spl_num)
+        attr_lat = ncfile.variables['Latitude']._FillValue
+        attr_lon = ncfile.variables['Longitude']._FillValue
+        ncfile.close()
+
+    check_resolution(varnames, data, lat.shape)
 
     # Use _FillValue to remove fill data in lat & lon
+    # (their pixels fall out of the region, so the cloud mask of these pixels is never used)
     lat[np.where(lat == attr_lat)] = np.nan
     lon[np.where(lat == attr_lat)] = np.nan
-    data['CM'][np.where(lat == attr_lat)] = np.nan  # which will not be identified by lines 80-83
 
     lat[np.where(lon == attr_lon)] = np.nan
     lon[np.where(lon == attr_lon)] = np.nan
-    data['CM'][np.where(lon == attr_lon)] = np.nan  # which will not be identified by lines 80-83
-    ncfile.close()
 
     return lat, lon, data
 
 
+def init_grid_data(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, moments=False):
+    # Create arrays for level-3 statistics data
+    # moments=True adds the count, mean and M2 accumulators (see moments.py) used for a stable mean & std,
+    # in place of the sum of squares (Standard_Deviation) accumulator
+    grid_data = {}
+    key_idx = 0
+    for key in varnames:
+        if sts_switch[0] == True:
+            grid_data[key + '_' + sts_name[0]] = np.zeros(grid_lat * grid_lon) + np.inf
+        if sts_switch[1] == True:
+            grid_data[key + '_' + sts_name[1]] = np.zeros(grid_lat * grid_lon) - np.inf
+        if (sts_switch[2] == True) | (sts_switch[3] == True) | (sts_switch[4] == True):
+            grid_data[key + '_' + sts_name[2]] = np.zeros(grid_lat * grid_lon)
+            grid_data[key + '_' + sts_name[3]] = np.zeros(grid_lat * grid_lon)
+            if not moments:
+                grid_data[key + '_' + sts_name[4]] = np.zeros(grid_lat * grid_lon)
+        if moments & ((sts_switch[2] == True) | (sts_switch[4] == True)):
+            for moment_key in moment_keys(key + '_'):
+                grid_data[moment_key] = np.zeros(grid_lat * grid_lon)
+        if sts_switch[5] == True:
+            bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=float, sep=',')
+            grid_data[key + '_' + sts_name[5]] = np.zeros((grid_lat * grid_lon, bin_interval1.shape[0] - 1))
+
+            if sts_switch[6] == True:
+                bin_interval2 = np.fromstring(intervals_2d[key_idx], dtype=float, sep=',')
+                grid_data[key + '_' + sts_name[6] + histnames[key_idx]] = np.zeros(
+                    (grid_lat * grid_lon, bin_interval1.shape[0] - 1, bin_interval2.shape[0] - 1))
+
+        key_idx += 1
+
+    return grid_data
+
+
 def cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_val_2d, \
-              sts_switch, sts_name, intervals_1d, intervals_2d, key_idx):
+              sts_switch, sts_name, intervals_1d, intervals_2d, key_idx, histnames=None):
     # Calculate Statistics pamameters
+    with get_profile().timer('cal_stats'):
+        return _cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_val_2d, \
+                          sts_switch, sts_name, intervals_1d, intervals_2d, key_idx, histnames)
+
+
+def _cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_val_2d, \
+               sts_switch, sts_name, intervals_1d, intervals_2d, key_idx, histnames=None):
+    # Body of cal_stats
 
     # Min and Max
     if sts_switch[0] == True:
@@ -153,13 +226,21 @@ def cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_
         grid_data[key + '_' + sts_name[2]][z] += tot_val
         grid_data[key + '_' + sts_name[3]][z] += count
 
-    # Standard Deviation
-    if sts_switch[4] == True:
+    # Standard Deviation, from the moments instead when they are allocated
+    if (sts_switch[4] == True) & ((key + '_' + sts_name[4]) in grid_data):
         grid_data[key + '_' + sts_name[4]][z] += tot_val ** 2
 
+    # Moments (count, mean, M2) for a stable mean & standard deviation, when allocated
+    if (key + '_' + MOMENT_NAMES[0]) in grid_data:
+        if key == 'cloud_fraction':
+            moments = flag_moments(count, tot_val)
+        else:
+            moments = value_moments(all_val)
+        grid_data = merge_moments_into(grid_data, dict(zip(moment_keys(key + '_'), moments)), key + '_', z)
+
     # 1D Histogram
     if sts_switch[5] == True:
-        bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=np.float, sep=',')
+        bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=float, sep=',')
         if all_val.size == 1:
             all_val = np.array([all_val])
         else:
@@ -173,8 +254,8 @@ def cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_
 
     # 2D Histogram
     if sts_switch[6] == True:
-        bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=np.float, sep=',')
-        bin_interval2 = np.fromstring(intervals_2d[key_idx], dtype=np.float, sep=',')
+        bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=float, sep=',')
+        bin_interval2 = np.fromstring(intervals_2d[key_idx], dtype=float, sep=',')
         if all_val.size == 1:
             all_val = np.array([all_val])
             all_val_2d = np.array([all_val_2d])
@@ -197,109 +278,613 @@ def cal_stats(z, key, grid_data, min_val, max_val, tot_val, count, all_val, all_
 
 
 def run_modis_aggre(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, \
-                    grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx):
+                    grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx, \
+                    histnames=None, engine='vectorized', workers=None, spl_num=3, granule_index=None, \
+                    checkpoint_file=None, checkpoint_every=50, index_cache=None, prefetch=None, \
+                    granule_cache=None):
     # This function is the data aggregation loops by number of files
-    hdfs = np.array(hdfs)
-    for j in hdfs:  # range(1):#hdfs:
-        print("File Number: {} / {}".format(j, hdfs[-1]))
+    # engine='vectorized' reduces every grid cell in whole-array passes (aggre_granule),
+    # engine='legacy' keeps the original per-cell loop (aggre_granule_legacy) for comparison.
+    # engine='fused' aggregates every granule in one compiled loop over its pixels (fused_aggre_granule)
+    # when numba is installed, and runs like engine='vectorized' otherwise; the other options are the same.
+    # workers > 1 aggregates the granule pairs in a process pool (vectorized engine only);
+    # the partial results are merged in file order, so grid_data is the same as in a serial run.
+    # granule_index (see build_granule_index) skips the granules lying outside of the region before reading them.
+    # Granules which cannot be read or aggregated are reported and skipped instead of stopping the run.
+    # checkpoint_file saves grid_data and the merged granules every checkpoint_every granules (and at the end);
+    # when it exists, the run resumes from it and only aggregates the granules not merged yet (it must have been
+    # saved by a run with the same region, grid, sampling rate and statistics).
+    # With profiling enabled (see enable_profile) every granule gets its own record of timers and counters.
+    # index_cache (a GridIndexCache, vectorized engine only) keeps the grid index of every MYD03 granule,
+    # the granules found in it are aggregated without opening their MYD03 file.
+    # prefetch > 0 (serial vectorized engine) reads up to prefetch granule pairs ahead in a background thread
+    # while the current one is aggregated.
+    # granule_cache (a GranuleCache, vectorized engine only) reads the granules preprocessed by
+    # preprocess_granules from the cache instead of the HDF files.
+    if engine not in ('vectorized', 'legacy', 'fused'):
+        raise ValueError("Unknown aggregation engine '{}'".format(engine))
+    profile = get_profile()
+
+    hdfs = prune_granules(hdfs, fname2, granule_index, NTA_lats, NTA_lons)
+    last = hdfs[-1] if len(hdfs) > 0 else None
+
+    processed, failed = [], OrderedDict()
+    if checkpoint_file is not None:
+        config = run_config(NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, sts_switch, varnames, \
+                            intervals_1d, intervals_2d, var_idx, histnames, spl_num)
+        processed, failed = load_checkpoint(checkpoint_file, grid_data, config)
+        if len(processed) > 0:
+            print("Resuming from {}: {} granules already aggregated".format(checkpoint_file, len(processed)))
+        done = set(processed)
+        hdfs = [j for j in hdfs if granule_name(fname1[j]) not in done]
+
+    if engine == 'legacy':
+        if (workers is not None) and (workers > 1):
+            raise ValueError("The legacy engine can only run serially")
+        if index_cache is not None:
+            raise ValueError("The legacy engine does not use the grid index cache")
+        if (prefetch is not None) and (prefetch > 0):
+            raise ValueError("The legacy engine does not prefetch granules")
+        if granule_cache is not None:
+            raise ValueError("The legacy engine does not read the granule cache")
+
+        for j in hdfs:  # range(1):#hdfs:
+            print("File Number: {} / {}".format(j, last))
+
+            # Read Level-2 MODIS data
+            # The granule is aggregated into new accumulators, merged only when it succeeds
+            profile.start_granule(granule_name(fname1[j]))
+            try:
+                lat, lon, data = read_MODIS(varnames, fname1[j], fname2[j], spl_num)
+                granule_data = aggre_granule_legacy(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, \
+                                                    gap_y, empty_grid_like(grid_data), sts_switch, varnames, \
+                                                    intervals_1d, intervals_2d, var_idx, histnames)
+            except Exception as err:
+                profile.end_granule('failed')
+                skip_granule(failed, fname1[j], describe_error(err))
+                continue
+            with profile.timer('merge'):
+                grid_data = merge_grid_data(grid_data, granule_data)
+            profile.end_granule()
+            processed.append(granule_name(fname1[j]))
+            failed.pop(granule_name(fname1[j]), None)
+            if (checkpoint_file is not None) and (len(processed) % checkpoint_every == 0):
+                with profile.timer('checkpoint'):
+                    save_checkpoint(checkpoint_file, grid_data, processed, failed, config)
+    else:
+        moments = any(key.endswith('_' + MOMENT_NAMES[0]) for key in grid_data)
+        results = aggre_results(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, moments, \
+                                sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames, engine, \
+                                workers, spl_num, index_cache, prefetch, granule_cache)
+        for j, (partial, error, record) in zip(hdfs, results):
+            print("File Number: {} / {}".format(j, last))
+            if record is not None:
+                profile.add_granule(record)
+            if error is not None:
+                skip_granule(failed, fname1[j], error)
+                continue
+            with profile.timer('merge'):
+                grid_data = merge_granule(grid_data, partial)
+            processed.append(granule_name(fname1[j]))
+            failed.pop(granule_name(fname1[j]), None)
+            if (checkpoint_file is not None) and (len(processed) % checkpoint_every == 0):
+                with profile.timer('checkpoint'):
+                    save_checkpoint(checkpoint_file, grid_data, processed, failed, config)
+
+    if checkpoint_file is not None:
+        with profile.timer('checkpoint'):
+            save_checkpoint(checkpoint_file, grid_data, processed, failed, config)
+    if len(failed) > 0:
+        print("{} granules skipped: {}".format(len(failed), ' '.join(failed)))
+
+    return grid_data
 
+
+def aggre_results(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, moments, \
+                  sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames=None, engine='vectorized', \
+                  workers=None, spl_num=3, index_cache=None, prefetch=None, granule_cache=None):
+    # (partial, error, record) of every granule pair of hdfs in order (see try_aggre_file), aggregated serially,
+    # with prefetching or in a process pool like run_modis_aggre (vectorized or fused engine)
+    # Parse the histogram bin edges once per run
+    hist_spec = compile_histogram_spec(varnames, intervals_1d, intervals_2d, var_idx)
+    config = (NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+              sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames, hist_spec, moments)
+
+    aggre_func = fused_aggre_granule if (engine == 'fused') and FUSED_COMPILED else aggre_granule
+    profiled = get_profile().enabled
+    tasks = ((fname1[j], fname2[j], spl_num, config, profiled, index_cache, granule_cache, aggre_func) for j in hdfs)
+    if (prefetch is not None) and (prefetch > 0) and ((workers is None) or (workers <= 1)):
+        return prefetch_aggre_files(tasks, prefetch)
+    return map_granules(try_aggre_file, tasks, workers)
+
+
+def read_cached(varnames, fname1, fname2, spl_num, granule_cache):
+    # The (lat, lon, data) of a granule pair from the GranuleCache when it holds it, None otherwise
+    if granule_cache is None:
+        return None
+    with get_profile().timer('read_cache'):
+        granule = granule_cache.load(fname1, fname2, varnames, spl_num)
+    if granule is not None:
+        get_profile().count('granule_cache_hits')
+        get_profile().count('pixels_read', granule[2]['CM'].size)
+    return granule
+
+
+def load_file(task):
+    # Read the inputs of aggre_granule for one granule pair (see aggre_file): (lat, lon, data, grid_index),
+    # grid_index is None when aggre_granule has to locate the pixels, lat and lon are None when it comes
+    # from the GridIndexCache of the run (the optional 6th item of the task). The granule is read from the
+    # GranuleCache of the run (the optional 7th item) when it is there, from the HDF files otherwise.
+    fname1, fname2, spl_num, config = task[:4]
+    index_cache = task[5] if len(task) > 5 else None
+    granule_cache = task[6] if len(task) > 6 else None
+    NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y = config[:6]
+    varnames = config[7]
+
+    granule = read_cached(varnames, fname1, fname2, spl_num, granule_cache)
+    if index_cache is None:
         # Read Level-2 MODIS data
-        lat, lon, data = read_MODIS(varnames, fname1[j], fname2[j])
-        CM = data['CM']
+        lat, lon, data = read_MODIS(varnames, fname1, fname2, spl_num) if granule is None else granule
+        return lat, lon, data, None
+
+    key = index_cache.key(fname2, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y, spl_num)
+    cached = index_cache.load(key)
+    if cached is None:
+        get_profile().count('index_cache_misses')
+        lat, lon, data = read_MODIS(varnames, fname1, fname2, spl_num) if granule is None else granule
+        with get_profile().timer('region_filter'):
+            res_idx, latlon_index = locate_grid_index(lat, lon, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y)
+        index_cache.store(key, res_idx, latlon_index, lat.shape)
+    else:
+        # The geolocation is not needed anymore, only MYD06 is read
+        get_profile().count('index_cache_hits')
+        res_idx, latlon_index, shape = cached
+        data = read_MOD06(varnames, fname1, spl_num) if granule is None else granule[2]
+        check_resolution(varnames, data, shape)
+        if data['CM'].shape != shape:
+            raise ValueError("The cached grid index of {} does not match the shape of {}".format(fname2, fname1))
 
-        # Restrain lat & lon & variables in the required region
-        res_idx = np.where((lat > NTA_lats[0]) & (lat < NTA_lats[1]) & (lon > NTA_lons[0]) & (lon < NTA_lons[1]))
-        lat = lat[res_idx]
-        lon = lon[res_idx]
-        CM = CM[res_idx]
+    return None, None, data, (res_idx, latlon_index)
 
-        # Ravel the 2-D data to 1-D array
-        lat = lat.ravel()
-        lon = lon.ravel()
-        CM = CM.ravel()
 
-        key_idx = 0
-        for key in varnames:
-            if key == 'cloud_fraction':
-                CF_key_idx = key_idx
-                key_idx += 1
-                continue  # Ignoreing Cloud_Fraction from the input file
-            data[key] = data[key][res_idx].ravel()
+def aggre_loaded(task):
+    # Aggregate the inputs read by load_file: task is (inputs, config[, aggregation function]),
+    # the function being aggre_granule by default or fused_aggre_granule
+    (lat, lon, data, grid_index), config = task[:2]
+    aggre_func = task[2] if len(task) > 2 else aggre_granule
+    return aggre_func(lat, lon, data, *config, grid_index=grid_index)
+
+
+def aggre_file(task):
+    # Read one granule pair and aggregate it into a partial result (worker of run_modis_aggre);
+    # the optional 8th item of the task is the aggregation function (see aggre_loaded)
+    return aggre_loaded((load_file(task), task[3]) + tuple(task[7:8]))
+
+
+def task_profiled(task):
+    # The optional 5th item of a run_modis_aggre task asks for a record of the granule (see profiled_call)
+    return (len(task) > 4) and bool(task[4])
+
+
+def profiled_call(func, task, name, profiled, seed=None):
+    """Call func(task), catching its error and optionally profiling it on its own.
+
+    The call reports to a new Profile of the calling thread, so it can run in a worker
+    process or in a prefetch thread without mixing its timers with the other granules.
+
+    Args:
+        name (string): granule name of the record.
+        profiled (bool): record the timers and counters of the call.
+        seed (dict): record of an earlier step of the same granule (e.g. its reading), added to the record.
+
+    Returns:
+        (result, error, record) (tuple): error is None or a one-line message (result is None then),
+        record is the granule record for Profile.add_granule, None when not profiled.
+    """
+    if profiled:
+        profile = Profile()
+        previous = set_thread_profile(profile)
+        profile.start_granule(name)
+        if seed is not None:
+            profile.add_record(seed)
+
+    try:
+        result = (func(task), None)
+    except Exception as err:
+        result = (None, describe_error(err))
+
+    record = None
+    if profiled:
+        record = profile.end_granule('ok' if result[1] is None else 'failed')
+        if seed is not None:
+            record['seconds'] += seed['seconds']
+        set_thread_profile(previous)
+
+    return result + (record,)
+
+
+def try_aggre_file(task):
+    # aggre_file returning (partial, None, record), or (None, error message, record) when the granule fails,
+    # so one corrupt granule does not abort the whole run (the message also crosses process boundaries).
+    # record holds the timers and counters of the granule when the task asks for them (see task_profiled).
+    return profiled_call(aggre_file, task, granule_name(task[0]), task_profiled(task))
+
+
+def try_load_file(task):
+    # load_file returning (inputs, error, record) like try_aggre_file (reader of prefetch_aggre_files)
+    return profiled_call(load_file, task, granule_name(task[0]), task_profiled(task))
+
+
+def prefetch_aggre_files(tasks, depth=2):
+    # try_aggre_file of every task, the granule pairs being read by a background thread up to depth granules
+    # ahead while the calling thread aggregates (at most depth + 1 granules are held in memory)
+    tasks = list(tasks)
+    for task, (inputs, error, record) in zip(tasks, prefetch_map(try_load_file, tasks, depth)):
+        if error is not None:
+            yield None, error, record
+            continue
+        yield profiled_call(aggre_loaded, (inputs, task[3]) + tuple(task[7:8]), granule_name(task[0]), \
+                            task_profiled(task), record)
+
+
+def describe_error(err):
+    # One-line description of the error of a failing granule
+    return '{}: {}'.format(type(err).__name__, err)
+
+
+def skip_granule(failed, fname, error):
+    # Report a failing granule and remember it, the run goes on with the next one
+    print("Skipping {} ({})".format(fname, error))
+    failed[granule_name(fname)] = error
+
+
+def empty_grid_like(grid_data):
+    # New dense accumulators with the keys and shapes of grid_data, at their initial values (see init_grid_data)
+    empty = OrderedDict()
+    for key in grid_data:
+        if key.endswith('_' + sts_name[0]):
+            empty[key] = np.full(grid_data[key].shape, np.inf)
+        elif key.endswith('_' + sts_name[1]):
+            empty[key] = np.full(grid_data[key].shape, -np.inf)
+        else:
+            empty[key] = np.zeros(grid_data[key].shape)
+    return empty
+
+
+def aggre_granule_legacy(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+                         grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames=None):
+    # Aggregate one granule into grid_data by looping over every grid box it occupies
+    CM = data['CM']
+
+    # Restrain lat & lon & variables in the required region
+    res_idx = np.where((lat > NTA_lats[0]) & (lat < NTA_lats[1]) & (lon > NTA_lons[0]) & (lon < NTA_lons[1]))
+    lat = lat[res_idx]
+    lon = lon[res_idx]
+    CM = CM[res_idx]
+
+    # Ravel the 2-D data to 1-D array
+    lat = lat.ravel()
+    lon = lon.ravel()
+    CM = CM.ravel()
+    get_profile().count('pixels_kept', lat.size)
+    get_profile().count('pixels_dropped', data['CM'].size - lat.size)
+
+    key_idx = 0
+    for key in varnames:
+        if key == 'cloud_fraction':
+            CF_key_idx = key_idx
             key_idx += 1
+            continue  # Ignoreing Cloud_Fraction from the input file
+        data[key] = data[key][res_idx].ravel()
+        key_idx += 1
 
-        # Locate the lat lon index into 3-Level frid box
-        idx_lon = np.round((lon - NTA_lons[0]) / gap_x).astype(int)
-        idx_lat = np.round((lat - NTA_lats[0]) / gap_y).astype(int)
+    # Locate the lat lon index into 3-Level frid box
+    idx_lon = np.round((lon - NTA_lons[0]) / gap_x).astype(int)
+    idx_lat = np.round((lat - NTA_lats[0]) / gap_y).astype(int)
 
-        latlon_index = (idx_lat * grid_lon) + idx_lon
+    latlon_index = (idx_lat * grid_lon) + idx_lon
 
-        latlon_index_unique = np.unique(latlon_index)
+    latlon_index_unique = np.unique(latlon_index)
 
-        # print(lon[0],idx_lon[0],lat[0],idx_lat[0])
-        # print(latlon_index_unique.max(),grid_lat*grid_lon)
+    # print(lon[0],idx_lon[0],lat[0],idx_lat[0])
+    # print(latlon_index_unique.max(),grid_lat*grid_lon)
 
-        for i in np.arange(latlon_index_unique.size):
-            # -----loop through all the grid boxes ocupied by this granule------#
-            z = latlon_index_unique[i]
-            if ((z >= 0) & (z < (grid_lat * grid_lon))):
+    for i in np.arange(latlon_index_unique.size):
+        # -----loop through all the grid boxes ocupied by this granule------#
+        z = latlon_index_unique[i]
+        if ((z >= 0) & (z < (grid_lat * grid_lon))):
 
-                # For cloud fraction
-                TOT_pix = np.sum(CM[np.where(latlon_index == z)] >= 0).astype(float)
-                CLD_pix = np.sum(CM[np.where(latlon_index == z)] <= 1).astype(float)
+            # For cloud fraction
+            TOT_pix = np.sum(CM[np.where(latlon_index == z)] >= 0).astype(float)
+            CLD_pix = np.sum(CM[np.where(latlon_index == z)] <= 1).astype(float)
 
-                # local_data = CM[np.where(latlon_index == z)]
-                # if local_data[np.where(np.isnan(local_data) == 0)].size == 0:
-                #	print('All NaN is Ture.')
+            # local_data = CM[np.where(latlon_index == z)]
+            # if local_data[np.where(np.isnan(local_data) == 0)].size == 0:
+            #	print('All NaN is Ture.')
+
+            Fraction = CLD_pix / TOT_pix
 
-                Fraction = CLD_pix / TOT_pix
+            if len(intervals_2d) != 1:
+                pixel_data_2d = data[varnames[var_idx[CF_key_idx]]]
+                ave_val_2d = np.nansum(pixel_data_2d[np.where(latlon_index == z)]).astype(float) / TOT_pix
+            else:
+                ave_val_2d = 0
+
+            # Calculate Statistics pamameters
+            grid_data = cal_stats(z, "cloud_fraction", grid_data, \
+                                  Fraction, Fraction, CLD_pix, TOT_pix, Fraction, ave_val_2d, \
+                                  sts_switch, sts_name, intervals_1d, intervals_2d, CF_key_idx, histnames)
+
+            # For other variables
+            key_idx = 0
+            for key in varnames:
+                if key == 'cloud_fraction':  # Ignoreing Cloud_Fraction from the input file
+                    key_idx += 1
+                    continue
+                pixel_data = data[key]
+
+                tot_val = np.nansum(pixel_data[np.where(latlon_index == z)]).astype(float)
+                # ave_val = tot_val / TOT_pix
+                all_val = np.array(pixel_data[np.where(latlon_index == z)]).astype(float)
+                max_val = np.nanmax(pixel_data[np.where(latlon_index == z)]).astype(float)
+                min_val = np.nanmin(pixel_data[np.where(latlon_index == z)]).astype(float)
+
+                # local_data = pixel_data[np.where(latlon_index == z)]
+                # print(local_data.size,z)
+                # print(z,tot_val,max_val,min_val,CLD_pix,TOT_pix)
+                # if local_data[np.where(np.isnan(local_data) == 0)].size == 0:
+                #	print('All NaN is Ture.',key,tot_val,max_val,min_val,CLD_pix,TOT_pix)
 
                 if len(intervals_2d) != 1:
-                    pixel_data_2d = data[varnames[var_idx[CF_key_idx]]]
-                    ave_val_2d = np.nansum(pixel_data_2d[np.where(latlon_index == z)]).astype(float) / TOT_pix
+                    pixel_data_2d = data[varnames[var_idx[key_idx]]]
+                    all_val_2d = np.array(pixel_data_2d[np.where(latlon_index == z)]).astype(float)
                 else:
-                    ave_val_2d = 0
+                    all_val_2d = 0
 
                 # Calculate Statistics pamameters
-                grid_data = cal_stats(z, "cloud_fraction", grid_data, \
-                                      Fraction, Fraction, CLD_pix, TOT_pix, Fraction, ave_val_2d, \
-                                      sts_switch, sts_name, intervals_1d, intervals_2d, CF_key_idx)
-
-                # For other variables
-                key_idx = 0
-                for key in varnames:
-                    if key == 'cloud_fraction':  # Ignoreing Cloud_Fraction from the input file
-                        key_idx += 1
-                        continue
-                    pixel_data = data[key]
-
-                    tot_val = np.nansum(pixel_data[np.where(latlon_index == z)]).astype(float)
-                    # ave_val = tot_val / TOT_pix
-                    all_val = np.array(pixel_data[np.where(latlon_index == z)]).astype(float)
-                    max_val = np.nanmax(pixel_data[np.where(latlon_index == z)]).astype(float)
-                    min_val = np.nanmin(pixel_data[np.where(latlon_index == z)]).astype(float)
-
-                    # local_data = pixel_data[np.where(latlon_index == z)]
-                    # print(local_data.size,z)
-                    # print(z,tot_val,max_val,min_val,CLD_pix,TOT_pix)
-                    # if local_data[np.where(np.isnan(local_data) == 0)].size == 0:
-                    #	print('All NaN is Ture.',key,tot_val,max_val,min_val,CLD_pix,TOT_pix)
-
-                    if len(intervals_2d) != 1:
-                        pixel_data_2d = data[varnames[var_idx[key_idx]]]
-                        all_val_2d = np.array(pixel_data_2d[np.where(latlon_index == z)]).astype(float)
-                    else:
-                        all_val_2d = 0
-
-                    # Calculate Statistics pamameters
-                    grid_data = cal_stats(z, key, grid_data, \
-                                          min_val, max_val, tot_val, CLD_pix, all_val, all_val_2d, \
-                                          sts_switch, sts_name, intervals_1d, intervals_2d, key_idx)
+                grid_data = cal_stats(z, key, grid_data, \
+                                      min_val, max_val, tot_val, CLD_pix, all_val, all_val_2d, \
+                                      sts_switch, sts_name, intervals_1d, intervals_2d, key_idx, histnames)
 
-                    key_idx += 1
+                key_idx += 1
 
     return grid_data
 
 
+def aggre_granule(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+                  sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames=None, hist_spec=None, \
+                  moments=False, grid_index=None):
+    """Aggregate one granule with whole-array reductions over the grid cells it occupies.
+
+    Gives the same statistics as aggre_granule_legacy, but returns them as a partial
+    result for the touched cells only; use merge_granule to add it into grid_data.
+
+    hist_spec is the compiled bin table from compile_histogram_spec; it is parsed
+    from intervals_1d / intervals_2d when not given. moments=True also returns the
+    count, mean and M2 of every variable (see init_grid_data and moments.py).
+    grid_index is the (res_idx, latlon_index) of locate_grid_index when it is already
+    known (see GridIndexCache), lat and lon are not used then.
+
+    Returns:
+        partial (dict): 'cells' holds the flattened grid indices touched by the granule,
+        every other key is a grid_data key holding one value (or histogram) per cell.
+    """
+    if hist_spec is None:
+        hist_spec = compile_histogram_spec(varnames, intervals_1d, intervals_2d, var_idx)
+    profile = get_profile()
+
+    if grid_index is None:
+        with profile.timer('region_filter'):
+            grid_index = locate_grid_index(lat, lon, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y)
+    res_idx, latlon_index = grid_index
+    with profile.timer('group_cells'):
+        groups = group_cells(latlon_index, grid_lat * grid_lon)
+    profile.count('pixels_kept', latlon_index.size)
+    profile.count('pixels_dropped', data['CM'].size - latlon_index.size)
+    profile.count('cells_touched', groups.cells.size)
+
+    CM = data['CM'][res_idx].ravel()
+    pixels = {}
+    for key in varnames:
+        if key == 'cloud_fraction': continue  # Ignoreing Cloud_Fraction from the input file
+        pixels[key] = data[key][res_idx].ravel()
+
+    partial = {'cells': groups.cells}
+
+    # For cloud fraction
+    with profile.timer('cell_stats'):
+        TOT_pix = cell_count(groups, CM >= 0)
+        CLD_pix = cell_count(groups, CM <= 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Fraction = CLD_pix / TOT_pix
+
+    # Histograms are only counted for grid boxes holding more than one pixel
+    multi_pix = groups.counts > 1
+
+    key_idx = 0
+    for key in varnames:
+        if key == 'cloud_fraction':
+            # The cell fraction is a single value per grid box, so it never enters the histograms
+            min_val, max_val, tot_val = Fraction, Fraction, CLD_pix
+            all_val = None
+        else:
+            all_val = pixels[key]
+            with profile.timer('cell_stats'):
+                tot_val = cell_nansum(groups, all_val)
+                min_val = cell_nanmin(groups, all_val)
+                max_val = cell_nanmax(groups, all_val)
+
+        if sts_switch[0] == True:
+            partial[key + '_' + sts_name[0]] = min_val
+        if sts_switch[1] == True:
+            partial[key + '_' + sts_name[1]] = max_val
+        if (sts_switch[2] == True) | (sts_switch[3] == True):
+            partial[key + '_' + sts_name[2]] = tot_val
+            partial[key + '_' + sts_name[3]] = TOT_pix if key == 'cloud_fraction' else CLD_pix
+        if (sts_switch[4] == True) & (not moments):
+            partial[key + '_' + sts_name[4]] = tot_val ** 2
+        if moments & ((sts_switch[2] == True) | (sts_switch[4] == True)):
+            with profile.timer('moments'):
+                if key == 'cloud_fraction':
+                    cell_stats = flag_moments(TOT_pix, CLD_pix)
+                else:
+                    cell_stats = cell_moments(groups, all_val)
+            partial.update(zip(moment_keys(key + '_'), cell_stats))
+
+        if (all_val is not None) & (sts_switch[5] == True):
+            with profile.timer('histograms'):
+                partial[key + '_' + sts_name[5]] = cell_histogram(groups, all_val, hist_spec.edges_1d[key_idx], \
+                                                                  multi_pix)
+
+        if (all_val is not None) & (sts_switch[6] == True):
+            with profile.timer('histograms'):
+                partial[key + '_' + sts_name[6] + histnames[key_idx]] = cell_histogram2d(
+                    groups, all_val, pixels[hist_spec.jvars[key_idx]], \
+                    hist_spec.edges_1d[key_idx], hist_spec.edges_2d[key_idx], multi_pix)
+
+        key_idx += 1
+
+    return partial
+
+
+def merge_granule(grid_data, partial):
+    # Add the partial result of one granule (see aggre_granule) into grid_data,
+    # a dictionary or a GridAccumulator (whose counts are integers, and histograms possibly sparse)
+    cells = partial['cells']
+    for key in partial:
+        if key == 'cells':
+            continue
+        target = grid_data[key]
+        if isinstance(target, SparseHistogram):
+            target.add(cells, partial[key])
+        elif key.endswith('_' + MOMENT_NAMES[0]):
+            grid_data = merge_moments_into(grid_data, partial, key[:-len(MOMENT_NAMES[0])], cells)
+        elif key.endswith('_' + MOMENT_NAMES[1]) | key.endswith('_' + MOMENT_NAMES[2]):
+            continue  # Merged with their count
+        elif key.endswith('_' + sts_name[0]):
+            target[cells] = np.fmin(target[cells], partial[key])
+        elif key.endswith('_' + sts_name[1]):
+            target[cells] = np.fmax(target[cells], partial[key])
+        else:
+            target[cells] += partial[key].astype(target.dtype, copy=False)
+
+    return grid_data
+
+
+def merge_grid_data(grid_data, other):
+    # Add the accumulators of another run on the same grid (e.g. another day) into grid_data, in place
+    for key in other:
+        target = grid_data[key]
+        if isinstance(target, SparseHistogram):
+            if isinstance(other[key], SparseHistogram):
+                target.add_sparse(other[key])
+            else:
+                target.add(None, other[key])
+        elif isinstance(other[key], SparseHistogram):
+            # Added entry by entry, without densifying the other histogram
+            np.add.at(target, np.unravel_index(other[key].index, target.shape), other[key].counts)
+        elif key.endswith('_' + MOMENT_NAMES[0]):
+            grid_data = merge_moments_into(grid_data, other, key[:-len(MOMENT_NAMES[0])])
+        elif key.endswith('_' + MOMENT_NAMES[1]) | key.endswith('_' + MOMENT_NAMES[2]):
+            continue  # Merged with their count
+        elif key.endswith('_' + sts_name[0]):
+            np.fmin(target, other[key], out=target)
+        elif key.endswith('_' + sts_name[1]):
+            np.fmax(target, other[key], out=target)
+        else:
+            target += np.asarray(other[key]).astype(target.dtype, copy=False)
+
+    return grid_data
+
+
+def finalize(grid_data, sts_switch, varnames, histnames, grid_lat, grid_lon):
+    """Compute the level-3 statistics of the accumulators, leaving grid_data untouched.
+
+    grid_data keeps its sums, counts, sums of squares and extrema, so it can
+    still be merged with other periods (see merge_grid_data) or saved.
+    When grid_data holds the moment accumulators (init_grid_data(..., moments=True)),
+    the mean and standard deviation are those of the valid pixels, from the moments.
+
+    Returns:
+        final (OrderedDict): the statistics switched on in sts_switch, in the order of
+        grid_data, as new arrays of shape (grid_lat, grid_lon) followed by the histogram bins.
+    """
+    final = OrderedDict()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for key_idx, key in enumerate(varnames):
+            moments = (key + '_' + MOMENT_NAMES[0]) in grid_data
+            if moments:
+                mean, std = finalize_moments(*[grid_data[moment_key] for moment_key in moment_keys(key + '_')])
+            elif (sts_switch[2] == True) | (sts_switch[4] == True):
+                mean = grid_data[key + '_' + sts_name[2]] / grid_data[key + '_' + sts_name[3]]
+
+            if sts_switch[0] == True:
+                final[key + '_' + sts_name[0]] = grid_data[key + '_' + sts_name[0]].reshape([grid_lat, grid_lon]).copy()
+            if sts_switch[1] == True:
+                final[key + '_' + sts_name[1]] = grid_data[key + '_' + sts_name[1]].reshape([grid_lat, grid_lon]).copy()
+            if sts_switch[2] == True:
+                final[key + '_' + sts_name[2]] = mean.reshape([grid_lat, grid_lon])
+            if sts_switch[3] == True:
+                final[key + '_' + sts_name[3]] = grid_data[key + '_' + sts_name[3]].reshape([grid_lat, grid_lon]).copy()
+            if sts_switch[4] == True:
+                if not moments:
+                    std = ((grid_data[key + '_' + sts_name[4]] / grid_data[key + '_' + sts_name[3]]) - mean ** 2) ** 0.5
+                final[key + '_' + sts_name[4]] = std.reshape([grid_lat, grid_lon])
+            if sts_switch[5] == True:
+                hist = grid_data[key + '_' + sts_name[5]]
+                final[key + '_' + sts_name[5]] = hist.reshape((grid_lat, grid_lon) + hist.shape[1:]).copy()
+            if sts_switch[6] == True:
+                jhist = grid_data[key + '_' + sts_name[6] + histnames[key_idx]]
+                final[key + '_' + sts_name[6] + histnames[key_idx]] = jhist.reshape(
+                    (grid_lat, grid_lon) + jhist.shape[1:]).copy()
+
+    return final
+
+
+def write_level3(fname, final, sts_switch, map_lat, map_lon, unit_list, longname_list, fillvalue_list, \
+                 scale_list, offst_list, compression='gzip', compression_opts=4, shuffle=True, dtype='narrow', \
+                 sparse=False, attrs=None):
+    # Create the HDF5 file of the finalized statistics (see finalize), one variable after another for each statistic.
+    # Each statistic is packed and written chunk by chunk by write_grid_entry with the given filters and integer type,
+    # compression=None and dtype=int give the uncompressed 64-bit datasets of addGridEntry.
+    # sparse=True writes the SparseHistogram statistics as coordinate lists (see write_sparse_entry)
+    # attrs (dict) are written as attributes of the file, e.g. how the statistics were accumulated
+    ff = h5py.File(fname, 'w')
+    for name, value in (attrs or {}).items():
+        ff.attrs[name] = value
+
+    PC = ff.create_dataset('lat_bnd', data=map_lat)
+    PC.attrs['units'] = 'degrees'
+    PC.attrs['long_name'] = 'Latitude_boundaries'
+
+    PC = ff.create_dataset('lon_bnd', data=map_lon)
+    PC.attrs['units'] = 'degrees'
+    PC.attrs['long_name'] = 'Longitude_boundaries'
+
+    sts_idx = np.array(np.where(np.asarray(sts_switch) == True))[0]
+    for i in range(sts_idx.shape[0]):
+        cnt = 0
+        for key in final:
+
+            if key.find("1km") != -1:
+                new_name = key.replace("_1km", "")
+            else:
+                new_name = key
+
+            if ((sts_name[sts_idx[i]] in key) == True) and sparse and isinstance(final[key], SparseHistogram):
+                write_sparse_entry(ff, new_name, unit_list[cnt], longname_list[cnt], fillvalue_list[cnt],
+                                   scale_list[cnt], offst_list[cnt], final[key], compression=compression,
+                                   compression_opts=compression_opts, shuffle=shuffle)
+                cnt += 1
+            elif (sts_name[sts_idx[i]] in key) == True:
+                write_grid_entry(ff, new_name, unit_list[cnt], longname_list[cnt], fillvalue_list[cnt],
+                                 scale_list[cnt], offst_list[cnt], final[key], compression=compression,
+                                 compression_opts=compression_opts, shuffle=shuffle, dtype=dtype)
+                cnt += 1
+
+    ff.close()
+
+
 def addGridEntry(f, name, units, long_name, fillvalue, scale_factor, add_offset, data):
     '''
     f:h5py.File()
@@ -312,21 +897,23 @@ def addGridEntry(f, name, units, long_name, fillvalue, scale_factor, add_offset,
     It needs to be reverted from the netCDF4 reading first, then convert it in the way of HDF file.
     '''
     if (('Histogram_Counts' in name) == True) | (('Jhisto_vs_' in name) == True) | (('Pixel_Counts' in name) == True):
-        original_data = data.astype(np.int)
+        original_data = data.astype(int)
     elif (('Maximum' in name) == True) | (('Minimum' in name) == True):
         tmp_data = data / scale_factor + add_offset
         tmp_data[np.where(np.isinf(tmp_data) == 1)] = fillvalue
-        original_data = tmp_data.astype(np.int)
+        original_data = tmp_data.astype(int)
     else:
         tmp_data = data / scale_factor + add_offset
         tmp_data[np.where(np.isnan(tmp_data) == 1)] = fillvalue
-        original_data = tmp_data.astype(np.int)
+        original_data = tmp_data.astype(int)
 
-    PCentry = f.create_dataset(name, data=original_data)
+    with get_profile().timer('write'):
+        PCentry = f.create_dataset(name, data=original_data)
+    get_profile().count('bytes_written', PCentry.id.get_storage_size())
     PCentry.dims[0].label = 'lat_bnd'
     PCentry.dims[1].label = 'lon_bnd'
-    PCentry.attrs['units'] = np.str(units)
-    PCentry.attrs["long_name"] = np.str(long_name)
+    PCentry.attrs['units'] = str(units)
+    PCentry.attrs["long_name"] = str(long_name)
     PCentry.attrs['_FillValue'] = fillvalue
     PCentry.attrs['scale_factor'] = scale_factor
     PCentry.attrs['add_offset'] = add_offset
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Checkpoint and resume of long aggregation runs.
+
+A checkpoint is one .npz file holding every accumulator of grid_data (not
+finalized) with the names of the granules already merged into them and of
+the granules which failed. It is written to a temporary file and moved in
+place, so an interrupted run always leaves the previous complete checkpoint.
+run_modis_aggre reloads it and only aggregates the granules not merged yet.
+A SparseHistogram accumulator is saved as its (2, non-zero entries) flat
+indices and counts, with its dense shape. The region, grid, sampling rate
+and statistics of the run (see run_config) are saved with them, and a run
+with another configuration refuses to resume from the checkpoint.
+"""
+
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+from .sparse import SparseHistogram
+
+# Names of the granule lists inside the checkpoint (grid_data keys never start with '_')
+PROCESSED_KEY = '_processed_granules'
+FAILED_KEY = '_failed_granules'
+ERRORS_KEY = '_failed_errors'
+CONFIG_KEY = '_config'
+# Prefix of the dense shape of a sparse accumulator
+SPARSE_KEY = '_sparse_'
+
+
+def granule_name(fname):
+    # Name identifying a granule in the checkpoint: the MYD06 file name without its directory
+    return os.path.basename(str(fname))
+
+
+def run_config(NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, sts_switch, varnames, intervals_1d, \
+               intervals_2d, var_idx, histnames, spl_num):
+    # JSON description of the region, grid, sampling rate and statistics of a run, saved with its checkpoint
+    config = {'NTA_lats': NTA_lats, 'NTA_lons': NTA_lons, 'grid_lon': grid_lon, 'grid_lat': grid_lat,
+              'gap_x': gap_x, 'gap_y': gap_y, 'sts_switch': sts_switch, 'varnames': varnames,
+              'intervals_1d': intervals_1d, 'intervals_2d': intervals_2d, 'var_idx': var_idx,
+              'histnames': histnames, 'spl_num': spl_num}
+    return json.dumps(dict((key, np.asarray(value).tolist()) for key, value in config.items()), sort_keys=True)
+
+
+def save_checkpoint(checkpoint_file, grid_data, processed, failed, config=None):
+    """Write the accumulators and the granule lists atomically.
+
+    Args:
+        checkpoint_file (string): path of the .npz checkpoint.
+        grid_data (dict or GridAccumulator): the accumulators, before finalization.
+        processed (list): names of the granules merged into grid_data.
+        failed (dict): error message of every granule which could not be aggregated.
+        config (string): configuration of the run (see run_config), checked by load_checkpoint.
+    """
+    arrays = {}
+    for key in grid_data:
+        value = grid_data[key]
+        if isinstance(value, SparseHistogram):
+            arrays[key] = np.stack([value.index, value.counts.astype(np.int64)])
+            arrays[SPARSE_KEY + key] = np.array(value.shape)
+        else:
+            arrays[key] = value
+    arrays[PROCESSED_KEY] = np.array(processed, dtype=str)
+    arrays[FAILED_KEY] = np.array(list(failed.keys()), dtype=str)
+    arrays[ERRORS_KEY] = np.array(list(failed.values()), dtype=str)
+    if config is not None:
+        arrays[CONFIG_KEY] = np.array(config)
+
+    tmp_file = checkpoint_file + '.tmp.npz'
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file, grid_data, config=None):
+    """Restore the accumulators of a checkpoint into grid_data, in place.
+
+    grid_data must be freshly initialized with the same variables, statistics
+    and grid as the checkpointed run. A missing checkpoint leaves it untouched.
+    With config (see run_config), the checkpoint must have been saved with the
+    same configuration.
+
+    Returns:
+        (processed, failed) (tuple): the list of merged granule names and the
+        dict of failed granule names and error messages, empty without checkpoint.
+    """
+    if not os.path.exists(checkpoint_file):
+        return [], OrderedDict()
+
+    with np.load(checkpoint_file) as saved:
+        if (config is not None) and ((CONFIG_KEY not in saved.files) or (str(saved[CONFIG_KEY]) != config)):
+            raise ValueError("Checkpoint '{}' was saved by a run with another region, grid, sampling rate or "
+                             "statistics".format(checkpoint_file))
+        keys = [key for key in saved.files if not key.startswith('_')]
+        if sorted(keys) != sorted(grid_data):
+            raise ValueError("Checkpoint '{}' does not hold the statistics of this run".format(checkpoint_file))
+        for key in keys:
+            if SPARSE_KEY + key in saved.files:
+                shape, (index, counts) = tuple(saved[SPARSE_KEY + key]), saved[key]
+                values = SparseHistogram(shape, np.int64, index, counts)
+            else:
+                values = saved[key]
+                shape = values.shape
+            if shape != grid_data[key].shape:
+                raise ValueError("Checkpoint '{}' has another shape for '{}'".format(checkpoint_file, key))
+            if isinstance(grid_data[key], SparseHistogram):
+                grid_data[key][...] = values
+            else:
+                grid_data[key][...] = np.asarray(values)
+
+        processed = saved[PROCESSED_KEY].tolist()
+        failed = OrderedDict(zip(saved[FAILED_KEY].tolist(), saved[ERRORS_KEY].tolist()))
+
+    return processed, failed
@@ -1,58 +1,149 @@
+import os
 import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
+import dask
+import dask.array as da
+from .parallel import map_granules, prefetch_map
+from .granule_index import prune_granules
+from .cloud_mask import cloudiness, count_cloud_mask, category_fractions, surface_fractions, CM_CATEGORIES, \
+    SURFACE_TYPES
+
+# MYD03 variables which are not needed for the aggregation
+M03_var_list = ['Scan Offset', 'Track Offset', 'Height Offset', 'Height', 'SensorZenith',
+                'Range', 'SolarZenith', 'SolarAzimuth', 'Land/SeaMask', 'WaterPresent', 'gflags',
+                'Scan number', 'EV frames', 'Scan Type', 'EV start time', 'SD start time',
+                'SV start time', 'EV center time', 'Mirror side', 'SD Sun zenith', 'SD Sun azimuth',
+                'Moon Vector', 'orb_pos', 'orb_vel', 'T_inst2ECR', 'attitude_angles', 'sun_ref',
+                'impulse_enc', 'impulse_time', 'thermal_correction', 'SensorAzimuth']
 
 
-def aggregateOneFileData(M06_file, M03_file):
+def aggregateOneFileData(M06_file, M03_file, grid_res=1.0, stride=3):
     """Aggregate one file from MYD06_L2 and its corresponding file from MYD03. Read 'Cloud_Mask_1km' variable from the MYD06_L2 file, read 'Latitude' and 'Longitude' variables from the MYD03 file. Group Cloud_Mask_1km values based on their (lat, lon) grid.
     Args:
         M06_file (string): File path for M06_file.
         M03_file (string): File path for corresponding M03_file.
+        grid_res (float): Size of the global (lat, lon) grid boxes in degrees, 1.0 gives the 180*360 grid.
+        stride (int): Sampling stride in both directions of the swath, 3 picks the 1st, 4th, 7th, ... pixel.
 
     Returns:
-        (cloud_pix, total_pix) (tuple): cloud_pix is an 2D(180*360) numpy array for cloud pixel count of each grid, total_pix is an 2D(180*360) numpy array for total pixel count of each grid.
+        (cloud_pix, total_pix) (tuple): cloud_pix is an 2D(180*360 for 1 degree) numpy array for cloud pixel count of each grid, total_pix is an 2D(180*360 for 1 degree) numpy array for total pixel count of each grid.
     """
 
-    var_list = ['Scan Offset', 'Track Offset', 'Height Offset', 'Height', 'SensorZenith',
-                'Range', 'SolarZenith', 'SolarAzimuth', 'Land/SeaMask', 'WaterPresent', 'gflags',
-                'Scan number', 'EV frames', 'Scan Type', 'EV start time', 'SD start time',
-                'SV start time', 'EV center time', 'Mirror side', 'SD Sun zenith', 'SD Sun azimuth',
-                'Moon Vector', 'orb_pos', 'orb_vel', 'T_inst2ECR', 'attitude_angles', 'sun_ref',
-                'impulse_enc', 'impulse_time', 'thermal_correction', 'SensorAzimuth']
+    return countCloudPixels(*readOneFile(M06_file, M03_file, stride), grid_res=grid_res)
+
+
+def readOneFile(M06_file, M03_file, stride=3):
+    """Read and decode the sampled cloud mask of one file pair with its geolocation.
+
+    Returns:
+        (ds06_decoded, lat, lon) (tuple): sampled cloudiness category (bits 1-2 of Cloud_Mask_1km), latitude and longitude.
+    """
+    # read 'Cloud_Mask_1km' variable from the MYD06_L2 file, whose shape is (2030, 1354), sampling data with
+    # 1/stride ratio (pick 1st, 4th, 7th, ... for stride 3) in both directions, (677, 452) for stride 3
+    with xr.open_dataset(M06_file, drop_variables="Scan Type") as d06:
+        d06CM = d06['Cloud_Mask_1km'][::stride, ::stride, 0].values
+    ds06_decoded = cloudiness(d06CM)
+    # Latitude and Longitude from one handle of the MYD03 file, whose shape is (2030, 1354)
+    with xr.open_dataset(M03_file, drop_variables=M03_var_list) as d03:
+        d03_lat = d03['Latitude'][::stride, ::stride].values
+        d03_lon = d03['Longitude'][::stride, ::stride].values
+
+    return ds06_decoded, d03_lat, d03_lon
+
+
+def readOneFileTask(task):
+    # readOneFile of a (M06_file, M03_file, grid_res, stride) task (reader of calculateCloudFraction)
+    M06_file, M03_file, grid_res, stride = task
+    return readOneFile(M06_file, M03_file, stride)
+
+
+def gridShape(grid_res=1.0):
+    # Number of (lat, lon) grid boxes of the global grid, (180, 360) for 1 degree
+    return int(round(180.0 / grid_res)), int(round(360.0 / grid_res))
 
-    total_pix = np.zeros((180, 360))
-    cloud_pix = np.zeros((180, 360))
-    # read 'Cloud_Mask_1km' variable from the MYD06_L2 file, whose shape is (2030, 1354)
-    d06 = xr.open_dataset(M06_file, drop_variables="Scan Type")['Cloud_Mask_1km'][:, :, 0].values
-    # sampling data with 1/3 ratio (pick 1st, 4th, 7th, ...) in both latitude and longitude direction. d06CM's shape is (677, 452)
-    d06CM = d06[::3, ::3]
-    ds06_decoded = (np.array(d06CM, dtype="byte") & 0b00000110) >> 1
-    # shape of d03_lat and d03_lon: (2030, 1354)
-    d03_lat = xr.open_dataset(M03_file, drop_variables=var_list)['Latitude'][:, :].values
-    d03_lon = xr.open_dataset(M03_file, drop_variables=var_list)['Longitude'][:, :].values
-
-    # sampling data with 1/3 ratio, shape of lat and lon: (677, 452), then convert data from 2D to 1D, then add offset to change value range from (-90, 90) to (0, 180) for lat.
-    lat = (d03_lat[::3, ::3].ravel() + 89.5).astype(int)
-    lon = (d03_lon[::3, ::3].ravel() + 179.5).astype(int)
-    lat = np.where(lat > -1, lat, 0)
-    lon = np.where(lon > -1, lon, 0)
-    # increment total_pix by 1 for the grid for each value in (lat, lon).
-    for i, j in zip(lat, lon):
-        total_pix[i, j] += 1
-
-    # covert ds06_decoded from 2D to 1D, check whether each element is less than or equal to 0, return a tuple whose first element is an 1D arrays of indices of ds06_decoded's elements whose value is less than or equal to 0.
-    index = np.nonzero(ds06_decoded.ravel() == 0)
-    # get its lat and lon for each cloud pixel.
-    # we can use this approach because the internal structure (677, 452) is the same for both MYD03 and MYD06.
-    cloud_lon = [lon[i] for i in index[0]]
-    cloud_lat = [lat[i] for i in index[0]]
-    # increment cloud_pix by 1 for the grid for each value in (cloud_lat, cloud_lon).
-    for x, y in zip(cloud_lat, cloud_lon):
-        cloud_pix[x, y] += 1
+
+def gridIndex(lat, lon, grid_res=1.0):
+    # Flattened index of the global (lat, lon) grid box of each pixel, same shape as lat and lon
+    n_lat, n_lon = gridShape(grid_res)
+    # add offset to change value range from (-90, 90) to (0, 180) for lat (in grid boxes).
+    lat_idx = ((lat + (90 - grid_res / 2.0)) / grid_res).astype(int)
+    lon_idx = ((lon + (180 - grid_res / 2.0)) / grid_res).astype(int)
+    lat_idx = np.clip(lat_idx, 0, n_lat - 1)
+    lon_idx = np.clip(lon_idx, 0, n_lon - 1)
+    return lat_idx * n_lon + lon_idx
+
+
+def countCloudPixels(ds06_decoded, lat, lon, grid_res=1.0):
+    """Count the cloudy and total pixels of each global (lat, lon) grid box in whole-array passes.
+    Args:
+        ds06_decoded (numpy array): decoded cloud mask (bits 1-2 of Cloud_Mask_1km), 0 is confident cloudy.
+        lat (numpy array): latitude of each pixel, same shape as ds06_decoded.
+        lon (numpy array): longitude of each pixel, same shape as ds06_decoded.
+        grid_res (float): Size of the grid boxes in degrees.
+
+    Returns:
+        (cloud_pix, total_pix) (tuple): 2D numpy arrays of shape gridShape(grid_res).
+    """
+    n_lat, n_lon = gridShape(grid_res)
+    # convert data from 2D to 1D
+    grid_idx = gridIndex(np.ravel(lat), np.ravel(lon), grid_res)
+
+    # count every pixel for the grid of each value in (lat, lon).
+    total_pix = np.bincount(grid_idx, minlength=n_lat * n_lon).reshape(n_lat, n_lon).astype(float)
+    # count the cloud pixels (ds06_decoded equal to 0) for their grid; MYD03 and MYD06 share the same sampled structure.
+    cloudy = np.ravel(ds06_decoded) == 0
+    cloud_pix = np.bincount(grid_idx[cloudy], minlength=n_lat * n_lon).reshape(n_lat, n_lon).astype(float)
 
     return cloud_pix, total_pix
 
 
+def aggregateOneFileMask(M06_file, M03_file, grid_res=1.0, stride=3):
+    """Count the pixels of one file pair per grid box, cloudiness category and surface type, in one pass.
+    Args:
+        M06_file (string): File path for M06_file.
+        M03_file (string): File path for corresponding M03_file.
+        grid_res (float): Size of the global (lat, lon) grid boxes in degrees.
+        stride (int): Sampling stride in both directions of the swath.
+
+    Returns:
+        counts (numpy array): pixel counts of shape gridShape(grid_res) + (4, 4), for the categories of
+        CM_CATEGORIES and the surfaces of SURFACE_TYPES; pixels whose cloud mask is not determined are left out.
+    """
+    with xr.open_dataset(M06_file, drop_variables="Scan Type") as d06:
+        d06CM = d06['Cloud_Mask_1km'][::stride, ::stride, 0].values
+    with xr.open_dataset(M03_file, drop_variables=M03_var_list) as d03:
+        grid_idx = gridIndex(d03['Latitude'][::stride, ::stride].values, d03['Longitude'][::stride, ::stride].values,
+                             grid_res)
+
+    n_lat, n_lon = gridShape(grid_res)
+    counts = count_cloud_mask(d06CM, grid_idx, n_lat * n_lon)
+    return counts.reshape(n_lat, n_lon, len(CM_CATEGORIES), len(SURFACE_TYPES))
+
+
+def calculateCloudMaskFractions(M03_files, M06_files, grid_res=1.0, stride=3, workers=None):
+    """Fractions of the cloudiness categories per grid box, over all pixels and per surface type.
+
+    Returns:
+        (category_fraction, surface_fraction) (tuple): arrays of shape gridShape(grid_res) + (4,) and
+        gridShape(grid_res) + (4 surface types, 4 categories), NaN where there is no pixel.
+    """
+    n_lat, n_lon = gridShape(grid_res)
+    counts = np.zeros((n_lat * n_lon, len(CM_CATEGORIES), len(SURFACE_TYPES)), dtype=np.int64)
+
+    tasks = ((M06_file, M03_file, grid_res, stride) for M06_file, M03_file in zip(M06_files, M03_files))
+    for file_counts in map_granules(aggregateOneFileMaskTask, tasks, workers):
+        counts += file_counts.reshape(counts.shape)
+
+    return category_fractions(counts).reshape(n_lat, n_lon, -1), \
+        surface_fractions(counts).reshape(n_lat, n_lon, len(SURFACE_TYPES), len(CM_CATEGORIES))
+
+
+def aggregateOneFileMaskTask(task):
+    # aggregateOneFileMask of a (M06_file, M03_file, grid_res, stride) task (worker of calculateCloudMaskFractions)
+    return aggregateOneFileMask(*task)
+
+
 def displayOutput(cf):
     # write output into an nc file
     cf.to_netcdf("monthlyCloudFraction-file-level-for-loop.nc")
@@ -60,7 +151,8 @@ def displayOutput(cf):
 
     # write output into a figure
     plt.figure(figsize=(14, 7))
-    plt.contourf(range(-180, 180), range(-90, 90), cf, 100, cmap="jet")
+    grid_res = 360.0 / cf.shape[1]
+    plt.contourf(np.arange(cf.shape[1]) * grid_res - 180, np.arange(cf.shape[0]) * grid_res - 90, cf, 100, cmap="jet")
     plt.xlabel("Longitude", fontsize=14)
     plt.ylabel("Latitude", fontsize=14)
     plt.title("Level 3 Cloud Fraction Aggregation for January 2008", fontsize=16)
@@ -69,23 +161,130 @@ def displayOutput(cf):
     print("Created plot monthlyCloudFraction-file-level-for-loop.png")
 
 
-def calculateCloudFraction(M03_files, M06_files):
-    cloud_pix_global = np.zeros((180, 360))
-    total_pix_global = np.zeros((180, 360))
+def aggregateOneFilePartial(task):
+    """Aggregate one file pair into a compact partial result (worker of calculateCloudFraction).
+    Args:
+        task (tuple): (M06_file, M03_file, grid_res, stride).
+
+    Returns:
+        (cells, cloud_count, total_count) (tuple): flattened indices of the grid boxes holding pixels, with their cloud and total pixel counts.
+    """
+    M06_file, M03_file, grid_res, stride = task
+    return compactCounts(*aggregateOneFileData(M06_file, M03_file, grid_res, stride))
+
+
+def compactCounts(cloud_pix, total_pix):
+    # Grid boxes holding pixels with their cloud and total pixel counts
+    cells = np.flatnonzero(total_pix)
+    return cells, cloud_pix.ravel()[cells], total_pix.ravel()[cells]
+
+
+def calculateCloudFraction(M03_files, M06_files, grid_res=1.0, stride=3, workers=None, prefetch=None, \
+                           granule_index=None, NTA_lats=None, NTA_lons=None):
+    cloud_pix_global = np.zeros(gridShape(grid_res))
+    total_pix_global = np.zeros(gridShape(grid_res))
+
+    # with a granule_index (see build_granule_index) and a region NTA_lats / NTA_lons, the file pairs whose
+    # MYD03 granule lies entirely outside of the region are skipped before opening them (the grid boxes
+    # of the region get the same counts as without the index)
+    if (granule_index is not None) and ((NTA_lats is None) or (NTA_lons is None)):
+        raise ValueError("Pruning granules with the granule index needs the region NTA_lats and NTA_lons")
+    hdfs = prune_granules(np.arange(len(M03_files)), M03_files, granule_index, NTA_lats, NTA_lons)
+
+    # with workers > 1 the file pairs are aggregated in a process pool and merged in file order,
+    # otherwise prefetch > 0 reads up to prefetch file pairs ahead in a background thread while counting
+    tasks = ((M06_files[j], M03_files[j], grid_res, stride) for j in hdfs)
+    if (prefetch is not None) and (prefetch > 0) and ((workers is None) or (workers <= 1)):
+        partials = (compactCounts(*countCloudPixels(*swath, grid_res=grid_res))
+                    for swath in prefetch_map(readOneFileTask, tasks, prefetch))
+    else:
+        partials = map_granules(aggregateOneFilePartial, tasks, workers)
+    for cells, cloud_count, total_count in partials:
+        cloud_pix_global.ravel()[cells] += cloud_count
+        total_pix_global.ravel()[cells] += total_count
+
+    # calculate final cloud fraction using global 2D result
+    total_pix_global[np.where(total_pix_global == 0)] = 1.0
+    cf = cloud_pix_global / total_pix_global
+    return cf
+
+
+def chunkRows(data_array, chunk_rows):
+    # Lazy dask array of a (sampled) 2D swath variable, chunked along the scan lines only
+    return data_array.chunk({data_array.dims[0]: chunk_rows, data_array.dims[1]: -1}).data
+
+
+def lazyOneFileCounts(M06_file, M03_file, grid_res=1.0, stride=3, chunk_rows=256):
+    """Build the lazy cloud and total pixel counts of one file pair, opening each file once.
+    Args:
+        M06_file (string): File path for M06_file.
+        M03_file (string): File path for corresponding M03_file.
+        grid_res (float): Size of the global (lat, lon) grid boxes in degrees.
+        stride (int): Sampling stride in both directions of the swath.
+        chunk_rows (int): Number of sampled scan lines per dask chunk.
+
+    Returns:
+        (cloud_count, total_count, datasets) (tuple): 1D dask arrays of the counts over the flattened grid, and the opened xarray datasets to close after computing.
+    """
+    d06 = xr.open_dataset(M06_file, drop_variables="Scan Type")
+    d03 = xr.open_dataset(M03_file, drop_variables=M03_var_list)
+
+    cm = chunkRows(d06['Cloud_Mask_1km'][::stride, ::stride, 0], chunk_rows)
+    lat = chunkRows(d03['Latitude'][::stride, ::stride], chunk_rows)
+    lon = chunkRows(d03['Longitude'][::stride, ::stride], chunk_rows).rechunk(lat.chunks)
+    cm = cm.rechunk(lat.chunks)
+
+    ds06_decoded = cm.map_blocks(cloudiness, dtype=np.uint8)
+    grid_idx = da.map_blocks(gridIndex, lat, lon, grid_res, dtype=np.int64).ravel()
+    n_grid = np.prod(gridShape(grid_res))
+
+    total_count = da.bincount(grid_idx, minlength=n_grid)
+    cloud_count = da.bincount(grid_idx, weights=(ds06_decoded == 0).ravel().astype(float), minlength=n_grid)
+
+    return cloud_count, total_count, [d06, d03]
+
+
+def calculateCloudFractionLazy(M03_files, M06_files, grid_res=1.0, stride=3, chunk_rows=256, scheduler='threads'):
+    """Calculate the cloud fraction of many file pairs with one lazy dask graph.
+
+    Every file pair contributes per-chunk pixel counts, which are summed with a
+    tree reduction, so peak memory is bounded by the chunk size and the grid
+    rather than by the number of files.
+    Args:
+        scheduler (string): dask scheduler used to compute the graph ('threads', 'processes' or 'synchronous').
+
+    Returns:
+        cf (numpy array): 2D cloud fraction of shape gridShape(grid_res), same as calculateCloudFraction.
+    """
+    cloud_counts, total_counts, datasets = [], [], []
+    try:
+        for M06_file, M03_file in zip(M06_files, M03_files):
+            cloud_count, total_count, opened = lazyOneFileCounts(M06_file, M03_file, grid_res, stride, chunk_rows)
+            cloud_counts.append(cloud_count)
+            total_counts.append(total_count)
+            datasets.extend(opened)
+
+        cloud_pix_global, total_pix_global = dask.compute(da.stack(cloud_counts).sum(axis=0),
+                                                          da.stack(total_counts).sum(axis=0),
+                                                          scheduler=scheduler)
+    finally:
+        for ds in datasets:
+            ds.close()
 
-    for M06_file, M03_file in zip(M06_files, M03_files):
-        one_day_result = aggregateOneFileData(M06_file, M03_file)
-        cloud_pix_global += one_day_result[0]
-        total_pix_global += one_day_result[1]
+    cloud_pix_global = cloud_pix_global.reshape(gridShape(grid_res)).astype(float)
+    total_pix_global = total_pix_global.reshape(gridShape(grid_res)).astype(float)
 
     # calculate final cloud fraction using global 2D result
     total_pix_global[np.where(total_pix_global == 0)] = 1.0
-    cf = np.zeros((180, 360))
     cf = cloud_pix_global / total_pix_global
     return cf
 
 
 def getInputDirectories():
-    M03_dir = "/Users/lakshmipriyanka/Project/MODIS_Aggregation/resources/data/input_data_sample/MYD03/"
-    M06_dir = "/Users/lakshmipriyanka/Project/MODIS_Aggregation/resources/data/input_data_sample/MYD06/"
+    # MYD03 and MYD06 directories, from the MODIS_M03_DIR and MODIS_M06_DIR environment variables when set
+    # (e.g. a directory of synthetic granules, see synthetic.write_synthetic_granules)
+    M03_dir = os.environ.get('MODIS_M03_DIR',
+                             "/Users/lakshmipriyanka/Project/MODIS_Aggregation/resources/data/input_data_sample/MYD03/")
+    M06_dir = os.environ.get('MODIS_M06_DIR',
+                             "/Users/lakshmipriyanka/Project/MODIS_Aggregation/resources/data/input_data_sample/MYD06/")
     return M03_dir, M06_dir
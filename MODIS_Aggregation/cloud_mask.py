@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Lookup-table decoding of the bit fields of Cloud_Mask_1km (byte 0).
+
+    bit 0     cloud mask determined (1) or not (0)
+    bits 1-2  cloudiness: 0 confident cloudy, 1 probably cloudy, 2 probably clear, 3 confident clear
+    bit 3     day (1) or night (0)
+    bit 4     no sunglint (1) or sunglint (0)
+    bit 5     no snow/ice (1) or snow/ice (0)
+    bits 6-7  surface: 0 water, 1 coastal, 2 desert, 3 land
+
+A byte has only 256 values, so every field is precomputed for all of them:
+CM_LUT[byte] gives all the fields of a pixel in one gather, as uint8, instead
+of one mask-and-shift pass (and a float copy) per field. The cloudiness and
+surface of a pixel also share one code (CM_CODE_LUT), so the pixel counts of
+every grid box per cloudiness category and surface type come from a single
+bincount (see count_cloud_mask).
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+# Bit fields of byte 0: name, first bit, number of bits
+CM_FIELDS = [('determined', 0, 1), ('cloudiness', 1, 2), ('day', 3, 1), ('no_sunglint', 4, 1),
+             ('no_snow_ice', 5, 1), ('surface', 6, 2)]
+
+CM_CATEGORIES = ['confident_cloudy', 'probably_cloudy', 'probably_clear', 'confident_clear']
+SURFACE_TYPES = ['water', 'coastal', 'desert', 'land']
+
+# CM_LUT[byte, i] is the field i of CM_FIELDS for that byte
+_bytes = np.arange(256)
+CM_LUT = np.stack([(_bytes >> shift) & ((1 << bits) - 1) for name, shift, bits in CM_FIELDS],
+                  axis=1).astype(np.uint8)
+
+# cloudiness * 4 + surface of every byte
+CM_CODE_LUT = (CM_LUT[:, 1] * len(SURFACE_TYPES) + CM_LUT[:, 5]).astype(np.uint8)
+del _bytes
+
+
+def mask_bytes(values):
+    # Raw Cloud_Mask_1km bytes as uint8 LUT indices: int8 values are reinterpreted, floats (a fill
+    # value masked to NaN by xarray) are cast back with NaN as 0, i.e. not determined
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), 0, values).astype(np.int16).astype(np.uint8)
+    if values.dtype.itemsize == 1:
+        return values.view(np.uint8)
+    return values.astype(np.uint8)
+
+
+def decode_cloud_mask(byte0):
+    """Decode all the bit fields of byte 0 of Cloud_Mask_1km in one pass.
+
+    Args:
+        byte0 (numpy array): raw bytes (int8, uint8 or float with NaN fill), any shape.
+
+    Returns:
+        (fields, valid) (tuple): fields is an OrderedDict of the uint8 field arrays of CM_FIELDS except
+        'determined', with the shape of byte0 (views into one decoded array); valid is the boolean
+        'determined' mask.
+    """
+    decoded = CM_LUT[mask_bytes(byte0)]
+    fields = OrderedDict((name, decoded[..., i]) for i, (name, shift, bits) in enumerate(CM_FIELDS) if i > 0)
+    return fields, decoded[..., 0].astype(bool)
+
+
+def cloudiness(byte0):
+    # Cloudiness category (bits 1-2) of every byte, as uint8
+    return CM_LUT[mask_bytes(byte0), 1]
+
+
+def count_cloud_mask(byte0, grid_idx, n_grid, valid_only=True):
+    """Count the pixels of every grid box per cloudiness category and surface type.
+
+    Args:
+        byte0 (numpy array): raw bytes of Cloud_Mask_1km, same size as grid_idx.
+        grid_idx (numpy array): flattened grid box of every pixel, pixels outside [0, n_grid) are dropped.
+        n_grid (int): number of grid boxes.
+        valid_only (bool): count only the pixels whose cloud mask is determined.
+
+    Returns:
+        counts (numpy array): int64 array of shape (n_grid, 4 categories, 4 surface types).
+    """
+    codes = mask_bytes(byte0).ravel()
+    grid_idx = np.asarray(grid_idx).ravel()
+    keep = (grid_idx >= 0) & (grid_idx < n_grid)
+    if valid_only:
+        keep &= CM_LUT[codes, 0].astype(bool)
+
+    nbins = len(CM_CATEGORIES) * len(SURFACE_TYPES)
+    counts = np.bincount(grid_idx[keep].astype(np.int64) * nbins + CM_CODE_LUT[codes[keep]], minlength=n_grid * nbins)
+    return counts.reshape(n_grid, len(CM_CATEGORIES), len(SURFACE_TYPES))
+
+
+def category_fractions(counts):
+    # Fraction of the pixels of every grid box in each cloudiness category, (n_grid, 4), NaN for empty boxes
+    total = counts.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return counts.sum(axis=2) / total[:, None]
+
+
+def surface_fractions(counts):
+    # Fraction of the pixels of every surface type in each cloudiness category, (n_grid, 4 surfaces,
+    # 4 categories), NaN where a grid box has no pixel of that surface
+    per_surface = counts.transpose(0, 2, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return per_surface / per_surface.sum(axis=2, keepdims=True)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Single-scan discovery of MODIS granules and MYD06 / MYD03 pairing.
+
+Each product directory is listed once with os.scandir (instead of one
+'ls' subprocess per day), the granule key (A2008001.0000) is parsed from
+every file name and MYD06 granules are paired with MYD03 granules by key,
+so a missing file is reported instead of shifting all following pairs.
+"""
+
+import os
+import json
+import numpy as np
+from datetime import datetime
+from .granule_index import GRANULE_TIME
+
+
+def granule_key(fname):
+    # Return the granule key of a MODIS file name, e.g. 'A2008001.0000', None if it has none
+    match = GRANULE_TIME.search(os.path.basename(fname))
+    if match is None:
+        return None
+    return 'A{}{}.{}{}'.format(*match.groups())
+
+
+def list_directory(loc_dir, cache_file=None):
+    # List the file names of a directory once, reusing the cached listing while the directory is unchanged
+    loc_dir = os.path.abspath(loc_dir)
+    mtime_ns = os.stat(loc_dir).st_mtime_ns
+
+    cache = {}
+    if (cache_file is not None) and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+        entry = cache.get(loc_dir)
+        if (entry is not None) and (entry['mtime_ns'] == mtime_ns):
+            return entry['names']
+
+    with os.scandir(loc_dir) as it:
+        names = sorted(e.name for e in it if e.is_file())
+
+    if cache_file is not None:
+        cache[loc_dir] = {'mtime_ns': mtime_ns, 'names': names}
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+
+    return names
+
+
+def scan_granules(loc_dir, prefix, fileformat='hdf', cache_file=None):
+    """Find the granules of one product directory in a single scan.
+
+    Args:
+        loc_dir (string): product directory, e.g. '.../MYD06_L2/'.
+        prefix (string): file name prefix, e.g. 'MYD06_L2.A'.
+        fileformat (string): file extension without the dot.
+        cache_file (string): optional JSON file caching the directory listing between runs.
+
+    Returns:
+        granules (dict): file path of every granule key; for duplicated keys the
+        last file name in sorted order (the latest processing) is kept.
+    """
+    granules = {}
+    for name in list_directory(loc_dir, cache_file):
+        if not (name.startswith(prefix) and name.endswith('.' + fileformat)):
+            continue
+        key = granule_key(name)
+        if key is not None:
+            granules[key] = os.path.join(loc_dir, name)
+
+    return granules
+
+
+def key_date(key):
+    # Calendar date of a granule key
+    return datetime.strptime(key[1:8], '%Y%j').date()
+
+
+def pair_granules(MYD06_dir, MYD06_prefix, MYD03_dir, MYD03_prefix, start=None, until=None, \
+                  fileformat='hdf', cache_file=None):
+    """Pair the MYD06 and MYD03 granules of [start, until] by granule key.
+
+    Returns:
+        (fname1, fname2, unmatched) (tuple): fname1 and fname2 are numpy arrays of
+        the paired MYD06 and MYD03 paths sorted by granule time, unmatched is a dict
+        with the sorted keys of the 'MYD06' and 'MYD03' granules without partner.
+    """
+    granules06 = scan_granules(MYD06_dir, MYD06_prefix, fileformat, cache_file)
+    granules03 = scan_granules(MYD03_dir, MYD03_prefix, fileformat, cache_file)
+
+    def in_period(key):
+        day = key_date(key)
+        return ((start is None) or (day >= start)) and ((until is None) or (day <= until))
+
+    keys06 = set(k for k in granules06 if in_period(k))
+    keys03 = set(k for k in granules03 if in_period(k))
+    keys = sorted(keys06 & keys03)
+
+    fname1 = np.array([granules06[k] for k in keys], dtype=str)
+    fname2 = np.array([granules03[k] for k in keys], dtype=str)
+    unmatched = {'MYD06': sorted(keys06 - keys03), 'MYD03': sorted(keys03 - keys06)}
+
+    return fname1, fname2, unmatched
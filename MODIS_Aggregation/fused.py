@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Fused per-pixel aggregation kernel, compiled with numba when it is installed.
+
+aggre_granule makes one whole-array pass per step: region filter, grid
+index, sort by grid cell, then one reduction per statistic and variable and
+one bincount per histogram. fused_aggre_granule computes the same partial
+result in two loops over the pixels of the granule, once locate_grid_index
+has filtered them and computed their grid cells (with the same arithmetic,
+so the numpy types of the region bounds and gaps give the same cells):
+    1. update the pixel counts, sums, minimum and maximum of all the
+       variables of the cell of every pixel,
+    2. once the counts and means of the cells are known, update the moments
+       (squared deviations from the mean) and the 1D and joint histogram
+       bins of the cells holding more than one pixel.
+The cells are numbered in the order the pixels reach them, through a slot
+map of the size of the grid which is reused across granules, so no sort is
+needed. The partial result has the layout of aggre_granule, so it is merged
+by merge_granule into any grid_data (dictionary, GridAccumulator, sparse
+histograms), in file order, also from worker processes.
+
+The loops are plain Python when numba is not installed (FUSED_COMPILED is
+False): fused_aggre_granule still gives the right result, slowly, and
+run_modis_aggre(..., engine='fused') falls back to the NumPy engine
+(aggre_granule).
+"""
+
+import threading
+import numpy as np
+from .grid_reduction import sts_name, locate_grid_index
+from .histograms import compile_histogram_spec
+from .moments import moment_keys, flag_moments
+from .profiling import get_profile
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# True when the kernels are compiled
+FUSED_COMPILED = numba is not None
+
+# Slot map of every thread (see grid_slots)
+_scratch = threading.local()
+
+
+def jit(func):
+    # Compile func with numba when it is installed, keep the Python function otherwise
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@jit
+def find_bin(x, edges, start, stop):
+    # Bin of x in edges[start:stop] like bin_index: -1 for NaN and values outside of the edges
+    if (x != x) or (x < edges[start]) or (x > edges[stop - 1]):
+        return -1
+    if x == edges[stop - 1]:
+        return stop - start - 2
+    lo, hi = start, stop - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if edges[mid] <= x:
+            lo = mid
+        else:
+            hi = mid
+    return lo - start
+
+
+@jit
+def locate_pass(cm, values, pixel_slot, grid_size, slots, cells, npx, tot, cld, vsum, vmin, vmax, vcnt):
+    """First loop: slot of the cell of every pixel and the counts, sums and extrema of every cell.
+
+    pixel_slot holds the grid cell of every pixel (-1 outside of the region); it is replaced by the
+    slot of the cell in the outputs (cells, npx, ...). slots (grid_size, all -1) is left all -1.
+
+    Returns:
+        (ncells, kept): number of cells touched and of pixels inside the region.
+    """
+    ncells, kept = 0, 0
+    nvar = values.shape[0]
+    for p in range(pixel_slot.size):
+        cell = pixel_slot[p]
+        if cell != -1:
+            kept += 1
+        if (cell < 0) or (cell >= grid_size):
+            pixel_slot[p] = -1
+            continue
+
+        s = slots[cell]
+        if s < 0:
+            s = ncells
+            slots[cell] = s
+            cells[s] = cell
+            ncells += 1
+        pixel_slot[p] = s
+
+        npx[s] += 1
+        if cm[p] >= 0:
+            tot[s] += 1
+        if cm[p] <= 1:
+            cld[s] += 1
+        for v in range(nvar):
+            z = values[v, p]
+            if z == z:
+                vsum[v, s] += z
+                vcnt[v, s] += 1
+                if (vmin[v, s] != vmin[v, s]) or (z < vmin[v, s]):
+                    vmin[v, s] = z
+                if (vmax[v, s] != vmax[v, s]) or (z > vmax[v, s]):
+                    vmax[v, s] = z
+
+    # Leave the slot map clean for the next granule
+    for s in range(ncells):
+        slots[cells[s]] = -1
+    return ncells, kept
+
+
+@jit
+def histogram_pass(values, pixel_slot, npx, vmean, moments, vm2, hist_var, edges1, starts1, offsets1, hist1, \
+                   jrow, edges2, starts2, offsets2, hist2):
+    """Second loop: squared deviations from the cell means and histogram bins of every pixel.
+
+    Only the cells holding more than one pixel are counted in the histograms (like aggre_granule).
+    hist_var tells which variables are binned, jrow the row in values of the second
+    variable of their joint histogram (-1 for none); edges / starts / offsets are the flat bin edges,
+    the first edge and the first output bin of every variable.
+    """
+    nvar = values.shape[0]
+    for p in range(pixel_slot.size):
+        s = pixel_slot[p]
+        if s < 0:
+            continue
+        for v in range(nvar):
+            z = values[v, p]
+            if moments and (z == z):
+                vm2[v, s] += (z - vmean[v, s]) ** 2
+            if (npx[s] <= 1) or (not hist_var[v]):
+                continue
+            b1 = find_bin(z, edges1, starts1[v], starts1[v + 1])
+            if b1 < 0:
+                continue
+            hist1[s, offsets1[v] + b1] += 1
+            if jrow[v] >= 0:
+                b2 = find_bin(values[jrow[v], p], edges2, starts2[v], starts2[v + 1])
+                if b2 >= 0:
+                    nbin2 = starts2[v + 1] - starts2[v] - 1
+                    hist2[s, offsets2[v] + b1 * nbin2 + b2] += 1
+
+
+def grid_slots(grid_size):
+    # Slot map of the grid cells (all -1) of the calling thread, reused across granules
+    slots = getattr(_scratch, 'slots', None)
+    if (slots is None) or (slots.size != grid_size):
+        slots = np.full(grid_size, -1, dtype=np.int64)
+        _scratch.slots = slots
+    return slots
+
+
+def flat_edges(edges_list):
+    # Concatenated bin edges, the first edge of every table and the first output bin of every variable
+    edges = [np.zeros(0) if e is None else np.asarray(e, dtype=np.float64) for e in edges_list]
+    starts = np.cumsum([0] + [e.size for e in edges]).astype(np.int64)
+    return np.concatenate(edges + [np.zeros(0)]), starts
+
+
+def fused_aggre_granule(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+                        sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames=None, hist_spec=None, \
+                        moments=False, grid_index=None):
+    """Aggregate one granule with the fused kernel (see the module documentation).
+
+    Same arguments and partial result as aggre_granule; the counts, extrema and histograms
+    are identical, the sums and moments equal to rounding.
+    """
+    if hist_spec is None:
+        hist_spec = compile_histogram_spec(varnames, intervals_1d, intervals_2d, var_idx)
+    profile = get_profile()
+    grid_size = grid_lat * grid_lon
+
+    # Pixels of the variables as rows, cloud_fraction only needs the cloud mask
+    keys = [key for key in varnames if key != 'cloud_fraction']
+    rows = dict((key, row) for row, key in enumerate(keys))
+    cm = np.asarray(data['CM']).ravel()
+    values = np.empty((len(keys), cm.size))
+    for key in keys:
+        values[rows[key]] = np.asarray(data[key]).ravel()
+
+    # The grid cells of aggre_granule, whatever the types of the region bounds and gaps
+    if grid_index is None:
+        with profile.timer('region_filter'):
+            grid_index = locate_grid_index(lat, lon, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y)
+    res_idx, latlon_index = grid_index
+    pixel_slot = np.full(cm.size, -1, dtype=np.int64)
+    pixel_slot[np.ravel_multi_index(res_idx, np.shape(data['CM']))] = latlon_index
+
+    size = min(cm.size, grid_size)
+    cells = np.empty(size, dtype=np.int64)
+    npx, tot, cld = np.zeros(size), np.zeros(size), np.zeros(size)
+    vsum, vcnt = np.zeros((len(keys), size)), np.zeros((len(keys), size))
+    vmin, vmax = np.full((len(keys), size), np.nan), np.full((len(keys), size), np.nan)
+
+    with profile.timer('fused_kernel'):
+        ncells, kept = locate_pass(cm, values, pixel_slot, grid_size, grid_slots(grid_size), cells, npx, tot, cld,
+                                   vsum, vmin, vmax, vcnt)
+
+        vsum, vcnt, vmin, vmax = vsum[:, :ncells], vcnt[:, :ncells], vmin[:, :ncells], vmax[:, :ncells]
+        vmean = np.divide(vsum, vcnt, out=np.zeros(vsum.shape), where=vcnt > 0)
+        vm2 = np.zeros(vsum.shape)
+
+        # Histogram layout: the bins of every variable side by side. A joint histogram also needs
+        # the 1D bins of its first variable, so they are computed when either histogram is on
+        var_k = [k for k, key in enumerate(varnames) if key != 'cloud_fraction']
+        jrow = np.array([rows[hist_spec.jvars[k]] if (sts_switch[6] == True) and (hist_spec.jvars[k] is not None)
+                         else -1 for k in var_k], dtype=np.int64)
+        edges1, starts1 = flat_edges([hist_spec.edges_1d[k] if (sts_switch[5] == True) or (jrow[row] >= 0)
+                                      else None for row, k in enumerate(var_k)])
+        edges2, starts2 = flat_edges([hist_spec.edges_2d[k] if jrow[row] >= 0 else None
+                                      for row, k in enumerate(var_k)])
+        nbin1 = np.maximum(np.diff(starts1) - 1, 0)
+        nbin2 = np.maximum(np.diff(starts2) - 1, 0)
+        hist_var = nbin1 > 0
+        offsets1 = np.cumsum(np.r_[0, nbin1]).astype(np.int64)
+        offsets2 = np.cumsum(np.r_[0, nbin1 * nbin2 * (jrow >= 0)]).astype(np.int64)
+        hist1 = np.zeros((ncells, offsets1[-1]), dtype=np.int64)
+        hist2 = np.zeros((ncells, offsets2[-1]), dtype=np.int64)
+
+        histogram_pass(values, pixel_slot, npx[:ncells], vmean, bool(moments), vm2, hist_var, edges1, starts1,
+                       offsets1, hist1, jrow, edges2, starts2, offsets2, hist2)
+    profile.count('pixels_kept', kept)
+    profile.count('pixels_dropped', cm.size - kept)
+    profile.count('cells_touched', ncells)
+
+    # Cells in increasing order, like aggre_granule
+    order = np.argsort(cells[:ncells])
+    TOT_pix, CLD_pix = tot[:ncells][order], cld[:ncells][order]
+    partial = {'cells': cells[:ncells][order]}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Fraction = CLD_pix / TOT_pix
+
+    for key_idx, key in enumerate(varnames):
+        if key == 'cloud_fraction':
+            min_val, max_val, tot_val = Fraction, Fraction, CLD_pix
+        else:
+            row = rows[key]
+            tot_val, min_val, max_val = vsum[row][order], vmin[row][order], vmax[row][order]
+
+        if sts_switch[0] == True:
+            partial[key + '_' + sts_name[0]] = min_val
+        if sts_switch[1] == True:
+            partial[key + '_' + sts_name[1]] = max_val
+        if (sts_switch[2] == True) | (sts_switch[3] == True):
+            partial[key + '_' + sts_name[2]] = tot_val
+            partial[key + '_' + sts_name[3]] = TOT_pix if key == 'cloud_fraction' else CLD_pix
+        if (sts_switch[4] == True) & (not moments):
+            partial[key + '_' + sts_name[4]] = tot_val ** 2
+        if moments & ((sts_switch[2] == True) | (sts_switch[4] == True)):
+            if key == 'cloud_fraction':
+                cell_stats = flag_moments(TOT_pix, CLD_pix)
+            else:
+                cell_stats = (vcnt[row][order], vmean[row][order], vm2[row][order])
+            partial.update(zip(moment_keys(key + '_'), cell_stats))
+
+        if (key != 'cloud_fraction') & (sts_switch[5] == True):
+            partial[key + '_' + sts_name[5]] = hist1[order, offsets1[row]:offsets1[row + 1]]
+
+        if (key != 'cloud_fraction') & (sts_switch[6] == True):
+            partial[key + '_' + sts_name[6] + histnames[key_idx]] = hist2[
+                order, offsets2[row]:offsets2[row + 1]].reshape(ncells, nbin1[row], nbin2[row])
+
+    return partial
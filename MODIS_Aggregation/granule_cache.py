@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Compact, preprocessed copies of MYD06 / MYD03 granule pairs.
+
+Aggregation campaigns rerun the same granules with other grids, regions and
+histogram intervals. preprocess_granules reads every pair once, exactly like
+read_MODIS (sampled, scaled, fill values as NaN), and keeps the result in a
+GranuleCache directory, one sub-directory per granule and sampling rate with
+one .npy file per column:
+    - CM.npy: cloudiness category, uint8,
+    - Latitude.npy / Longitude.npy: float32, NaN where the geolocation is filled,
+    - <variable>.npy: float32 values of every preprocessed MYD06 variable,
+    - meta.json: the variables, the sampling rate and the size and
+      modification time of the source files.
+The columns are loaded as memory maps, so a run only reads the pages it
+uses. run_modis_aggre(..., granule_cache=...) reads the granules from the
+cache when they are in it (with all the requested variables and unchanged
+source files) and falls back to the HDF files otherwise. The variables are
+stored as float32, so the statistics match those of the HDF files to float32
+precision.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from .parallel import map_granules
+from .baseline_series import read_MODIS
+
+CACHE_VERSION = 1
+
+# Columns every entry holds besides the MYD06 variables
+GEOLOCATION_COLUMNS = ['Latitude', 'Longitude']
+
+
+def source_identity(fname):
+    # Name, size and modification time of a source file, an entry is stale when they change
+    stat = os.stat(fname)
+    return [os.path.basename(str(fname)), stat.st_size, stat.st_mtime_ns]
+
+
+class GranuleCache(object):
+    """Directory of preprocessed granule pairs (see the module documentation).
+
+    Args:
+        directory (string): cache directory, created if needed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def entry(self, fname1, spl_num):
+        # Directory of the entry of a MYD06 file for one sampling rate
+        return os.path.join(self.directory, '{}.s{}'.format(os.path.basename(str(fname1)), int(spl_num)))
+
+    def load(self, fname1, fname2, varnames, spl_num=3):
+        """Return the cached (lat, lon, data) of a granule pair like read_MODIS, None if it is not cached.
+
+        None is also returned when a variable of varnames is missing from the entry or when the
+        source files changed since it was written. The arrays are read-only memory maps.
+        """
+        entry = self.entry(fname1, spl_num)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            sources = [source_identity(fname1), source_identity(fname2)]
+        except OSError:
+            return None
+        if (meta['version'] != CACHE_VERSION) or (meta['sources'] != sources):
+            return None
+        needed = [key for key in varnames if key != 'cloud_fraction']
+        if any(key not in meta['variables'] for key in needed):
+            return None
+
+        columns = {}
+        try:
+            for key in ['CM'] + GEOLOCATION_COLUMNS + needed:
+                columns[key] = np.load(os.path.join(entry, key + '.npy'), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+
+        data = {'CM': columns['CM']}
+        for key in needed:
+            data[key] = columns[key]
+        return columns['Latitude'], columns['Longitude'], data
+
+    def store(self, fname1, fname2, varnames, spl_num, lat, lon, data):
+        # Write the entry of a granule pair read by read_MODIS, replacing an older one
+        entry = self.entry(fname1, spl_num)
+        tmp_entry = tempfile.mkdtemp(suffix='.tmp', dir=self.directory)
+        variables = [key for key in varnames if key != 'cloud_fraction']
+
+        np.save(os.path.join(tmp_entry, 'CM.npy'), np.asarray(data['CM'], dtype=np.uint8))
+        for key, values in zip(GEOLOCATION_COLUMNS, [lat, lon]):
+            np.save(os.path.join(tmp_entry, key + '.npy'), np.asarray(values, dtype=np.float32))
+        for key in variables:
+            np.save(os.path.join(tmp_entry, key + '.npy'), np.asarray(data[key], dtype=np.float32))
+
+        meta = {'version': CACHE_VERSION, 'spl_num': int(spl_num), 'shape': list(np.shape(lat)),
+                'variables': variables, 'sources': [source_identity(fname1), source_identity(fname2)]}
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        # Swap the complete entry in place, readers never see a partial one
+        if os.path.isdir(entry):
+            shutil.rmtree(entry)
+        os.replace(tmp_entry, entry)
+
+    def nbytes(self):
+        # Total size of the cached files
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+
+def preprocess_file(task):
+    # Read one granule pair and store it in the cache, unless it is already there (worker of preprocess_granules)
+    directory, fname1, fname2, varnames, spl_num = task
+    cache = GranuleCache(directory)
+    if cache.load(fname1, fname2, varnames, spl_num) is not None:
+        return False
+    lat, lon, data = read_MODIS(varnames, fname1, fname2, spl_num)
+    cache.store(fname1, fname2, varnames, spl_num, lat, lon, data)
+    return True
+
+
+def preprocess_granules(cache, fname1, fname2, varnames, spl_num=3, workers=None):
+    """Convert granule pairs into cache entries, once.
+
+    Args:
+        cache (GranuleCache): the cache to fill.
+        fname1, fname2 (arrays): paths of the MYD06 files and of their MYD03 files.
+        varnames (array): MYD06 variables to keep (cloud_fraction only needs the cloud mask).
+        spl_num (int): sampling rate, the aggregation has to use the same one to hit the cache.
+        workers (int): number of worker processes.
+
+    Returns:
+        written (int): number of entries written, the pairs already cached are skipped.
+    """
+    varnames = [str(key) for key in varnames]
+    tasks = ((cache.directory, f1, f2, varnames, spl_num) for f1, f2 in zip(fname1, fname2))
+    return sum(map_granules(preprocess_file, tasks, workers))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Spatial and temporal index of MYD03 granules.
+
+For every MYD03 file the index keeps the lat/lon bounding box of the valid
+pixels, the granule time parsed from the file name (A2008001.0000) and the
+day/night flag. It is built once, updated incrementally (only new or modified
+files are read again) and stored as one uncompressed .npz file, which loads
+in milliseconds. The aggregation drivers use it to skip the granules falling
+entirely outside of the NTA_lats / NTA_lons region before opening them.
+"""
+
+import os
+import re
+import numpy as np
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+
+# Granule time in MODIS file names, e.g. MYD03.A2008001.0000.061.hdf
+GRANULE_TIME = re.compile(r'\.A(\d{4})(\d{3})\.(\d{2})(\d{2})\.')
+
+# Solar zenith angle (degrees) separating day and night pixels
+DAY_SOLAR_ZENITH = 85.0
+
+INDEX_FIELDS = ['files', 'mtime', 'size', 'time', 'lat_min', 'lat_max', 'lon_min', 'lon_max', 'daynight']
+
+
+def parse_granule_time(fname):
+    # Return the granule start time of a MODIS file name, None if it has no A<year><day>.<hhmm> key
+    match = GRANULE_TIME.search(os.path.basename(fname))
+    if match is None:
+        return None
+    year, day, hour, minute = [int(g) for g in match.groups()]
+    return datetime(year, 1, 1, hour, minute) + timedelta(days=day - 1)
+
+
+def read_daynight(ncfile):
+    # Day/night flag of a MYD03 granule: 'D', 'N', 'M' (mixed) or '' if unknown
+    for attr in ncfile.ncattrs():
+        if attr.startswith('CoreMetadata'):
+            match = re.search(r'DAYNIGHTFLAG.*?VALUE\s*=\s*"(\w+)"', str(ncfile.getncattr(attr)), re.S)
+            if match is not None:
+                return match.group(1)[0].upper()
+
+    if 'SolarZenith' in ncfile.variables:
+        sza = np.ma.filled(ncfile.variables['SolarZenith'][:, :].astype(float), np.nan)
+        day = sza < DAY_SOLAR_ZENITH
+        night = sza >= DAY_SOLAR_ZENITH
+        if np.all(day | np.isnan(sza)) & np.any(day):
+            return 'D'
+        if np.all(night | np.isnan(sza)) & np.any(night):
+            return 'N'
+        return 'M'
+
+    return ''
+
+
+def read_granule_extent(fname):
+    # Bounding box of the valid pixels of a MYD03 granule and its day/night flag
+    ncfile = Dataset(fname, 'r')
+    lat = np.ma.filled(ncfile.variables['Latitude'][:, :].astype(float), np.nan)
+    lon = np.ma.filled(ncfile.variables['Longitude'][:, :].astype(float), np.nan)
+    daynight = read_daynight(ncfile)
+    ncfile.close()
+
+    valid = (lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 180)
+    if not np.any(valid):
+        return np.nan, np.nan, np.nan, np.nan, daynight
+
+    return lat[valid].min(), lat[valid].max(), lon[valid].min(), lon[valid].max(), daynight
+
+
+def empty_granule_index():
+    return {'files': np.array([], dtype=str), 'mtime': np.array([]), 'size': np.array([], dtype=np.int64),
+            'time': np.array([], dtype='datetime64[m]'), 'lat_min': np.array([]), 'lat_max': np.array([]),
+            'lon_min': np.array([]), 'lon_max': np.array([]), 'daynight': np.array([], dtype='<U1')}
+
+
+def load_granule_index(index_file):
+    # Load the index stored by save_granule_index, an empty index if the file does not exist
+    if not os.path.exists(index_file):
+        return empty_granule_index()
+    with np.load(index_file, allow_pickle=False) as npz:
+        return {field: npz[field] for field in INDEX_FIELDS}
+
+
+def save_granule_index(index, index_file):
+    # Write the index atomically, so an interrupted update never leaves a broken file
+    tmp_file = index_file + '.tmp.npz'
+    np.savez(tmp_file, **index)
+    os.replace(tmp_file, index_file)
+
+
+def build_granule_index(M03_files, index_file=None):
+    """Build or incrementally update the index of a list of MYD03 files.
+
+    Files already in index_file with the same modification time and size are
+    not read again; the others are read and added. Entries of files missing
+    from M03_files are kept, so one index can serve several date ranges.
+
+    Returns:
+        index (dict): one numpy array per field of INDEX_FIELDS, one entry per file.
+    """
+    index = load_granule_index(index_file) if index_file is not None else empty_granule_index()
+    known = dict(zip(index['files'], range(index['files'].size)))
+
+    rows = {field: list(index[field]) for field in INDEX_FIELDS}
+    for fname in M03_files:
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        i = known.get(fname)
+        if (i is not None) and (rows['mtime'][i] == stat.st_mtime) and (rows['size'][i] == stat.st_size):
+            continue
+
+        time = parse_granule_time(fname)
+        entry = (fname, stat.st_mtime, stat.st_size, np.datetime64(time, 'm') if time else np.datetime64('NaT'))
+        entry += read_granule_extent(fname)
+        if i is None:
+            known[fname] = len(rows['files'])
+            for field, value in zip(INDEX_FIELDS, entry):
+                rows[field].append(value)
+        else:
+            for field, value in zip(INDEX_FIELDS, entry):
+                rows[field][i] = value
+
+    index = empty_granule_index()
+    for field in INDEX_FIELDS:
+        index[field] = np.array(rows[field], dtype=str if field == 'files' else index[field].dtype)
+
+    if index_file is not None:
+        save_granule_index(index, index_file)
+
+    return index
+
+
+def query_granule_index(index, M03_files, NTA_lats=None, NTA_lons=None, start=None, end=None, daynight=None):
+    """Select the MYD03 files which may hold pixels in the region and period.
+
+    A granule is kept when its bounding box overlaps the open region
+    (NTA_lats[0], NTA_lats[1]) x (NTA_lons[0], NTA_lons[1]) used by the
+    aggregation, its time is in [start, end] and its day/night flag is in
+    daynight (e.g. 'D' or ['D', 'M']). Files missing from the index are kept.
+
+    Returns:
+        keep (numpy array): boolean per file of M03_files.
+    """
+    position = dict(zip(index['files'], range(index['files'].size)))
+    keep = np.ones(len(M03_files), dtype=bool)
+
+    for k, fname in enumerate(M03_files):
+        i = position.get(os.path.abspath(fname))
+        if i is None:
+            continue
+        if NTA_lats is not None:
+            keep[k] &= (index['lat_max'][i] > NTA_lats[0]) & (index['lat_min'][i] < NTA_lats[1])
+        if NTA_lons is not None:
+            keep[k] &= (index['lon_max'][i] > NTA_lons[0]) & (index['lon_min'][i] < NTA_lons[1])
+        if (start is not None) and (not np.isnat(index['time'][i])):
+            keep[k] &= index['time'][i] >= np.datetime64(start, 'm')
+        if (end is not None) and (not np.isnat(index['time'][i])):
+            keep[k] &= index['time'][i] <= np.datetime64(end, 'm')
+        if (daynight is not None) and (index['daynight'][i] != ''):
+            keep[k] &= index['daynight'][i] in daynight
+
+    return keep
+
+
+def prune_granules(hdfs, fname2, granule_index, NTA_lats, NTA_lons):
+    # Drop the file numbers whose MYD03 granule lies entirely outside of the region
+    hdfs = np.array(hdfs)
+    if (granule_index is None) or (hdfs.size == 0):
+        return hdfs
+    keep = query_granule_index(granule_index, [fname2[j] for j in hdfs], NTA_lats, NTA_lons)
+    return hdfs[keep]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Vectorized grid-cell reductions for the MODIS aggregation engine.
+
+The pixels of one granule are grouped by their flattened (lat, lon) grid index
+with a single stable sort. Every per-cell statistic is then one ``reduceat``
+over the sorted segments, instead of one ``np.where(latlon_index == z)`` per
+grid cell.
+"""
+
+import numpy as np
+from collections import namedtuple
+
+# Define the statistics names for HDF5 output
+sts_name = ['Minimum', 'Maximum', 'Mean', 'Pixel_Counts', \
+            'Standard_Deviation', 'Histogram_Counts', 'Jhisto_vs_']
+
+# order:   positions of the in-grid pixels, sorted by grid cell
+# cells:   unique grid cells touched by the granule
+# starts:  first position of each cell inside the sorted pixels
+# counts:  number of pixels in each cell
+# inverse: position in 'cells' of every sorted pixel
+CellGroups = namedtuple('CellGroups', ['order', 'cells', 'starts', 'counts', 'inverse'])
+
+
+def locate_grid_index(lat, lon, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y):
+    # Restrain lat & lon in the required region and locate each pixel in the flattened grid
+    res_idx = np.where((lat > NTA_lats[0]) & (lat < NTA_lats[1]) & (lon > NTA_lons[0]) & (lon < NTA_lons[1]))
+
+    idx_lon = np.round((lon[res_idx].ravel() - NTA_lons[0]) / gap_x).astype(int)
+    idx_lat = np.round((lat[res_idx].ravel() - NTA_lats[0]) / gap_y).astype(int)
+
+    latlon_index = (idx_lat * grid_lon) + idx_lon
+
+    return res_idx, latlon_index
+
+
+def group_cells(latlon_index, grid_size):
+    # Group the pixels by grid cell, dropping the indices outside of [0, grid_size)
+    latlon_index = np.asarray(latlon_index).ravel()
+    valid = np.nonzero((latlon_index >= 0) & (latlon_index < grid_size))[0]
+    order = valid[np.argsort(latlon_index[valid], kind='stable')]
+
+    cells, starts, counts = np.unique(latlon_index[order], return_index=True, return_counts=True)
+    inverse = np.repeat(np.arange(cells.size), counts)
+
+    return CellGroups(order, cells, starts, counts, inverse)
+
+
+def _cell_reduce(ufunc, groups, values, fill):
+    # Apply a ufunc over the sorted segments of each grid cell
+    if groups.cells.size == 0:
+        return np.zeros(0) + fill
+    return ufunc.reduceat(np.asarray(values).ravel()[groups.order], groups.starts)
+
+
+def cell_count(groups, mask):
+    # Number of pixels in each cell where mask is True
+    return _cell_reduce(np.add, groups, np.asarray(mask, dtype=np.int64), 0).astype(np.float64)
+
+
+def cell_nansum(groups, values):
+    # Sum of the non-NaN pixel values in each cell (same as np.nansum per cell)
+    values = np.asarray(values, dtype=np.float64).ravel()
+    return _cell_reduce(np.add, groups, np.where(np.isnan(values), 0.0, values), 0.0)
+
+
+def cell_nanmin(groups, values):
+    # Minimum of the non-NaN pixel values in each cell, NaN if the cell has none
+    return _cell_reduce(np.fmin, groups, np.asarray(values, dtype=np.float64), np.nan)
+
+
+def cell_nanmax(groups, values):
+    # Maximum of the non-NaN pixel values in each cell, NaN if the cell has none
+    return _cell_reduce(np.fmax, groups, np.asarray(values, dtype=np.float64), np.nan)
+
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Precompiled bin tables and batched 1D / 2D histograms over grid cells.
+
+The interval strings of the variable name lists are parsed once per run by
+compile_histogram_spec. The histograms of every grid cell of a granule are
+then counted in one digitize-and-bincount pass over a combined
+(cell, bin1, bin2) index, with the same bin rules as np.histogram and
+np.histogram2d (left-closed bins, last bin closed on both sides, NaN and
+out-of-range values dropped).
+"""
+
+import numpy as np
+from collections import namedtuple
+
+# edges_1d: bin edges of the 1D histogram of each variable (None if not defined)
+# edges_2d: bin edges of the joint histogram axis of each variable (None if not defined)
+# jvars:    name of the variable paired with each variable in the joint histogram
+HistogramSpec = namedtuple('HistogramSpec', ['edges_1d', 'edges_2d', 'jvars'])
+
+
+def _parse_edges(intervals, key_idx):
+    # Parse one comma separated interval string, e.g. '0,10,20,50'
+    if (intervals is None) or (len(intervals) <= key_idx) or (not isinstance(intervals[key_idx], str)):
+        return None
+    return np.fromstring(intervals[key_idx], dtype=np.float64, sep=',')
+
+
+def compile_histogram_spec(varnames, intervals_1d, intervals_2d=None, var_idx=None):
+    # Parse the bin edges of every variable once per run
+    edges_1d, edges_2d, jvars = [], [], []
+    for key_idx in range(len(varnames)):
+        edges_1d.append(_parse_edges(intervals_1d, key_idx))
+        edges_2d.append(_parse_edges(intervals_2d, key_idx))
+        if (var_idx is not None) and (len(var_idx) > key_idx) and (edges_2d[-1] is not None):
+            jvars.append(varnames[var_idx[key_idx]])
+        else:
+            jvars.append(None)
+
+    return HistogramSpec(edges_1d, edges_2d, jvars)
+
+
+def bin_index(values, edges):
+    # Bin number of every value, -1 for NaN and values outside of [edges[0], edges[-1]]
+    values = np.asarray(values)
+    nbin = edges.size - 1
+    idx = np.searchsorted(edges, values, side='right') - 1
+    idx[values == edges[-1]] = nbin - 1
+    idx[(idx < 0) | (idx >= nbin)] = -1
+
+    return idx
+
+
+def cell_histogram(groups, values, edges, mask=None):
+    """Count the 1D histogram of every grid cell of a granule in one pass.
+
+    Args:
+        groups (CellGroups): pixel grouping from grid_reduction.group_cells.
+        values (numpy array): pixel values, in the same order as the grid index.
+        edges (numpy array): bin edges from compile_histogram_spec.
+        mask (numpy array): optional boolean per cell of groups.cells, cells where it is False are not counted.
+
+    Returns:
+        hist (numpy array): int64 counts of shape (number of cells, number of bins).
+    """
+    nbin = edges.size - 1
+    b1 = bin_index(np.asarray(values).ravel()[groups.order], edges)
+    keep = b1 >= 0
+    if mask is not None:
+        keep &= mask[groups.inverse]
+
+    flat = groups.inverse[keep] * nbin + b1[keep]
+    hist = np.bincount(flat, minlength=groups.cells.size * nbin)
+
+    return hist.reshape(groups.cells.size, nbin)
+
+
+def cell_histogram2d(groups, values1, values2, edges1, edges2, mask=None):
+    """Count the joint histogram of every grid cell of a granule in one pass.
+
+    Same as cell_histogram, over the combined (cell, bin1, bin2) index.
+
+    Returns:
+        jhist (numpy array): int64 counts of shape (number of cells, number of bins 1, number of bins 2).
+    """
+    nbin1, nbin2 = edges1.size - 1, edges2.size - 1
+    b1 = bin_index(np.asarray(values1).ravel()[groups.order], edges1)
+    b2 = bin_index(np.asarray(values2).ravel()[groups.order], edges2)
+    keep = (b1 >= 0) & (b2 >= 0)
+    if mask is not None:
+        keep &= mask[groups.inverse]
+
+    flat = (groups.inverse[keep] * nbin1 + b1[keep]) * nbin2 + b2[keep]
+    jhist = np.bincount(flat, minlength=groups.cells.size * nbin1 * nbin2)
+
+    return jhist.reshape(groups.cells.size, nbin1, nbin2)
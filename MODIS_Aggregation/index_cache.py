@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the grid index of MYD03 granules.
+
+The geolocation of a granule never changes, so the pixels kept in the
+region and their flattened grid cells (see locate_grid_index) only depend on
+the MYD03 file, the region, the grid and the sampling rate. GridIndexCache
+keeps them as one .npy file per granule and configuration, loaded as a
+memory map; with a cache hit the aggregation does not open the MYD03 file
+at all (see run_modis_aggre).
+
+An entry is an int32 array of shape (3, N + 1): column 0 holds the sampled
+shape of the granule and N, columns 1..N the row, the column and the grid
+cell of every kept pixel. The key is a hash of the MYD03 file name, size and
+modification time and of the grid configuration, so a modified file or
+another grid never reads a stale entry. When the cache grows over max_bytes
+the least recently used entries are removed.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+# Bump when the layout of the entries changes, older entries are then never read
+CACHE_VERSION = 1
+
+# Default size limit of a cache directory
+CACHE_BYTES = 4 << 30
+
+
+class GridIndexCache(object):
+    """Directory of cached grid index maps with a size limit.
+
+    Args:
+        directory (string): cache directory, created if needed; it can be shared by runs
+            and worker processes.
+        max_bytes (int): total size of the entries kept after every store.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, fname, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y, spl_num):
+        # Key of the grid index of the MYD03 file fname for one region, grid and sampling rate
+        stat = os.stat(fname)
+        identity = [CACHE_VERSION, os.path.basename(str(fname)), stat.st_size, stat.st_mtime_ns,
+                    [float(v) for v in NTA_lats], [float(v) for v in NTA_lons], int(grid_lon), float(gap_x),
+                    float(gap_y), int(spl_num)]
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, key):
+        """Return the cached (res_idx, latlon_index, shape) of a key, None if it is not cached.
+
+        res_idx is the (rows, cols) tuple of the kept pixels like locate_grid_index returns,
+        the arrays are read-only memory maps of the entry.
+        """
+        path = self.path(key)
+        try:
+            entry = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used for the eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        shape = (int(entry[0, 0]), int(entry[1, 0]))
+        return (entry[0, 1:], entry[1, 1:]), entry[2, 1:], shape
+
+    def store(self, key, res_idx, latlon_index, shape):
+        # Write the grid index of a granule (atomically), then evict the oldest entries over max_bytes
+        entry = np.empty((3, latlon_index.size + 1), dtype=np.int32)
+        entry[:, 0] = [shape[0], shape[1], latlon_index.size]
+        entry[0, 1:] = res_idx[0]
+        entry[1, 1:] = res_idx[1]
+        entry[2, 1:] = latlon_index
+
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, entry)
+        os.replace(tmp_file, self.path(key))
+
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every entry, oldest first
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Removed by another process
+            found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def evict(self):
+        # Remove the least recently used entries until the cache fits in max_bytes
+        found = self.entries()
+        total = sum(size for mtime, size, path in found)
+        for mtime, size, path in found:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def nbytes(self):
+        # Total size of the entries
+        return sum(size for mtime, size, path in self.entries())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed and streaming HDF5 output of the level-3 statistics.
+
+write_grid_entry stores the same packed integers and attributes as
+addGridEntry, but:
+    - the dataset is chunked along the grid (lat rows, then lon columns) with
+      the histogram bins of a grid box kept in one chunk,
+    - gzip or lzf compression and the shuffle filter can be applied,
+    - the integer type is the narrowest one holding the packed values and the fill value,
+    - values are packed chunk by chunk, so the peak memory is a few chunks
+      instead of several full-size copies of the statistic.
+A SparseHistogram (see sparse.py) is densified one chunk at a time and its
+empty chunks are not written (they read as 0). write_sparse_entry stores it
+without densifying, as the coordinate list of its non-zero counts, and
+read_sparse_entry reads it back.
+"""
+
+import numpy as np
+from .profiling import get_profile
+from .sparse import SparseHistogram
+
+# Integer types tried from the narrowest, for packed values and counts
+INT_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+# Target uncompressed size of one chunk
+CHUNK_BYTES = 1 << 20
+
+
+def choose_chunks(shape, itemsize, chunk_bytes=CHUNK_BYTES):
+    # Chunk shape of a (lat, lon[, bins...]) dataset close to chunk_bytes: whole histograms per grid box,
+    # whole lat rows while they fit, otherwise part of a row
+    bins = tuple(shape[2:])
+    box_bytes = itemsize * int(np.prod(bins, dtype=np.int64))
+    if len(shape) < 2:
+        return (max(1, min(shape[0], chunk_bytes // box_bytes)),)
+
+    row_bytes = box_bytes * shape[1]
+    if row_bytes <= chunk_bytes:
+        return (max(1, min(shape[0], chunk_bytes // row_bytes)), shape[1]) + bins
+    return (1, max(1, min(shape[1], chunk_bytes // box_bytes))) + bins
+
+
+def chunk_slices(shape, chunks):
+    # Slices selecting every chunk of a dataset
+    for corner in np.ndindex(*[(n + c - 1) // c for n, c in zip(shape, chunks)]):
+        yield tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(corner, chunks, shape))
+
+
+def narrow_int_dtype(low, high):
+    # Narrowest signed integer type holding [low, high]
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if (low >= info.min) and (high <= info.max):
+            return np.dtype(dtype)
+    raise ValueError("Packed values [{}, {}] do not fit in 64-bit integers".format(low, high))
+
+
+def pack_block(name, block, fillvalue, scale_factor, add_offset):
+    # Pack one block of a statistic like addGridEntry: counts are truncated to integers, other values are
+    # converted to (value / scale_factor + add_offset) with empty grid boxes set to fillvalue
+    if ('Histogram_Counts' in name) | ('Jhisto_vs_' in name) | ('Pixel_Counts' in name):
+        return block.astype(np.int64)
+
+    tmp_data = np.divide(block, scale_factor, dtype=float)
+    tmp_data += add_offset
+    if ('Maximum' in name) | ('Minimum' in name):
+        tmp_data[np.isinf(tmp_data)] = fillvalue
+    else:
+        tmp_data[np.isnan(tmp_data)] = fillvalue
+    return tmp_data.astype(np.int64)
+
+
+def write_grid_entry(f, name, units, long_name, fillvalue, scale_factor, add_offset, data, \
+                     compression='gzip', compression_opts=4, shuffle=True, dtype='narrow', chunk_bytes=CHUNK_BYTES):
+    """Write one finalized statistic as a chunked, compressed dataset of packed integers.
+
+    Args:
+        f (h5py.File): the output file.
+        name, units, long_name, fillvalue, scale_factor, add_offset, data: same as addGridEntry.
+        compression (string): 'gzip', 'lzf' or None.
+        compression_opts (int): gzip level, ignored for the other filters.
+        shuffle (bool): apply the byte shuffle filter before compression.
+        dtype: 'narrow' for the narrowest integer type holding the packed values, or an integer type.
+        chunk_bytes (int): target uncompressed size of a chunk (see choose_chunks).
+
+    Returns:
+        The h5py dataset.
+    """
+    with get_profile().timer('write'):
+        PCentry = _write_grid_entry(f, name, units, long_name, fillvalue, scale_factor, add_offset, data, \
+                                    compression, compression_opts, shuffle, dtype, chunk_bytes)
+    get_profile().count('bytes_written', PCentry.id.get_storage_size())
+
+    return PCentry
+
+
+def _write_grid_entry(f, name, units, long_name, fillvalue, scale_factor, add_offset, data, \
+                      compression, compression_opts, shuffle, dtype, chunk_bytes):
+    # Body of write_grid_entry, timed as the 'write' phase
+    sparse = isinstance(data, SparseHistogram)
+    if not sparse:
+        data = np.asarray(data)
+
+    if isinstance(dtype, str) and (dtype == 'narrow') and sparse:
+        # The counts are the non-zero values, the other ones are 0
+        counts = data.counts.astype(np.int64)
+        low = min([fillvalue, 0] + ([counts.min()] if counts.size > 0 else []))
+        high = max([fillvalue, 0] + ([counts.max()] if counts.size > 0 else []))
+        dtype = narrow_int_dtype(low, high)
+    elif isinstance(dtype, str) and (dtype == 'narrow'):
+        # First pass: range of the packed values, one chunk at a time
+        low, high = fillvalue, fillvalue
+        for block in chunk_slices(data.shape, choose_chunks(data.shape, 8, chunk_bytes)):
+            packed = pack_block(name, data[block], fillvalue, scale_factor, add_offset)
+            if packed.size > 0:
+                low, high = min(low, packed.min()), max(high, packed.max())
+        dtype = narrow_int_dtype(low, high)
+    dtype = np.dtype(dtype)
+
+    chunks = choose_chunks(data.shape, dtype.itemsize, chunk_bytes)
+    if compression != 'gzip':
+        compression_opts = None
+    PCentry = f.create_dataset(name, shape=data.shape, dtype=dtype, chunks=chunks, compression=compression, \
+                               compression_opts=compression_opts, shuffle=shuffle and (compression is not None))
+
+    # Second pass: pack and write every chunk
+    for block in chunk_slices(data.shape, chunks):
+        values = data[block]
+        if sparse and not values.any():
+            continue
+        PCentry[block] = pack_block(name, values, fillvalue, scale_factor, add_offset).astype(dtype)
+
+    if data.ndim > 1:
+        PCentry.dims[0].label = 'lat_bnd'
+        PCentry.dims[1].label = 'lon_bnd'
+    PCentry.attrs['units'] = str(units)
+    PCentry.attrs["long_name"] = str(long_name)
+    PCentry.attrs['_FillValue'] = fillvalue
+    PCentry.attrs['scale_factor'] = scale_factor
+    PCentry.attrs['add_offset'] = add_offset
+
+    return PCentry
+
+
+def write_sparse_entry(f, name, units, long_name, fillvalue, scale_factor, add_offset, data, \
+                       compression='gzip', compression_opts=4, shuffle=True):
+    """Write a SparseHistogram statistic as the coordinate list of its non-zero counts.
+
+    The group name holds the datasets 'index' (flat C-order index of every non-zero count into
+    the array of shape attribute 'shape') and 'counts', with the attributes of write_grid_entry.
+
+    Returns:
+        The h5py group.
+    """
+    if compression != 'gzip':
+        compression_opts = None
+    with get_profile().timer('write'):
+        group = f.create_group(name)
+        index, counts = data.index, data.counts.astype(np.int64)
+        high = max([0] + ([counts.max()] if counts.size > 0 else []))
+        # Empty datasets cannot be chunked, so they are not compressed either
+        filters = {'compression': compression, 'compression_opts': compression_opts,
+                   'shuffle': shuffle and (compression is not None)} if index.size > 0 else {}
+        for key, values, dtype in [('index', index, narrow_int_dtype(0, max(data.size - 1, 0))),
+                                   ('counts', counts, narrow_int_dtype(0, high))]:
+            group.create_dataset(key, data=values.astype(dtype), **filters)
+
+    group.attrs['shape'] = np.array(data.shape, dtype=np.int64)
+    group.attrs['units'] = str(units)
+    group.attrs["long_name"] = str(long_name)
+    group.attrs['_FillValue'] = fillvalue
+    group.attrs['scale_factor'] = scale_factor
+    group.attrs['add_offset'] = add_offset
+    get_profile().count('bytes_written', group['index'].id.get_storage_size() + group['counts'].id.get_storage_size())
+
+    return group
+
+
+def read_sparse_entry(group):
+    # SparseHistogram of a statistic written by write_sparse_entry
+    return SparseHistogram(group.attrs['shape'], np.int64, group['index'][:], group['counts'][:])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+One-pass, mergeable moment accumulators for the mean and standard deviation.
+
+The legacy 'Standard_Deviation' accumulator adds the square of each cell's
+per-granule total, and the final sum_sq / count - mean ** 2 cancels badly
+for large counts. The moment accumulators, which replace it, keep per grid
+cell and variable the number of valid pixels, their mean and M2 (the sum of
+squared deviations from the mean). A granule is reduced with two passes over its own pixels,
+and two sets of moments are combined with the parallel update of Chan et al.:
+
+    n = n_a + n_b
+    mean = mean_a + (mean_b - mean_a) * n_b / n
+    M2 = M2_a + M2_b + (mean_b - mean_a) ** 2 * n_a * n_b / n
+
+so granules, workers, MPI ranks and days merge without loss of precision.
+For cloud_fraction the moments are those of the per-pixel cloudy flag.
+The Pixel_Counts of a variable still count its cloudy pixels, which may hold
+fewer or more valid values than the moments: a product finalized from the
+moments carries MOMENT_ATTRS to tell them apart.
+"""
+
+import numpy as np
+from .grid_reduction import cell_count, cell_nansum
+
+# Names of the moment accumulators, appended to the variable name like sts_name
+MOMENT_NAMES = ['Moment_Count', 'Moment_Mean', 'Moment_M2']
+
+# Attributes of a level-3 product whose Mean and Standard_Deviation are finalized from the moments
+MOMENT_ATTRS = {'Pixel_Counts': 'cloudy or probably cloudy pixels of the grid box (all the pixels for '
+                                'cloud_fraction)',
+                'Mean_and_Standard_Deviation': 'of the pixels of the grid box with a valid value (of the cloudy '
+                                               'flag of all the pixels for cloud_fraction)'}
+
+
+def moment_keys(prefix):
+    # grid_data keys of the count, mean and M2 accumulators of a variable ('key_') or of a block ('')
+    return [prefix + name for name in MOMENT_NAMES]
+
+
+def cell_moments(groups, values):
+    # Number of non-NaN pixels, their mean and M2 in each grid cell (see group_cells)
+    values = np.asarray(values, dtype=np.float64).ravel()
+    count = cell_count(groups, ~np.isnan(values))
+    mean = np.divide(cell_nansum(groups, values), count, out=np.zeros(count.size), where=count > 0)
+
+    # Second pass over the pixels: squared deviations from the mean of their own cell
+    dev = np.full(values.size, np.nan)
+    dev[groups.order] = values[groups.order] - mean[groups.inverse]
+    m2 = cell_nansum(groups, dev ** 2)
+
+    return count, mean, m2
+
+
+def value_moments(values):
+    # Number of non-NaN values, their mean and M2 (one grid cell of the legacy engine)
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return 0.0, 0.0, 0.0
+    mean = values.sum() / values.size
+    return float(values.size), mean, ((values - mean) ** 2).sum()
+
+
+def flag_moments(total, hits):
+    # Moments of a 0/1 flag set on 'hits' of 'total' pixels, e.g. the cloudy pixels for cloud_fraction
+    total = np.asarray(total, dtype=np.float64)
+    hits = np.asarray(hits, dtype=np.float64)
+    mean = np.divide(hits, total, out=np.zeros(total.shape), where=total > 0)
+    return total, mean, hits * (1 - mean)
+
+
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    # Combine two sets of moments (Chan et al. parallel update), element by element
+    count_a, count_b = np.asarray(count_a, dtype=np.float64), np.asarray(count_b, dtype=np.float64)
+    count = count_a + count_b
+    weight = np.divide(count_b, count, out=np.zeros(count.shape), where=count > 0)
+    delta = np.asarray(mean_b, dtype=np.float64) - mean_a
+
+    mean = mean_a + delta * weight
+    m2 = m2_a + m2_b + delta ** 2 * count_a * weight
+
+    return count, mean, m2
+
+
+def merge_moments_into(grid_data, other, prefix, cells=slice(None)):
+    # Merge the moments of other[prefix + MOMENT_NAMES] into grid_data at the given cells, in place
+    keys = moment_keys(prefix)
+    merged = merge_moments(*([grid_data[key][cells] for key in keys] + [other[key] for key in keys]))
+    for key, values in zip(keys, merged):
+        grid_data[key][cells] = values
+
+    return grid_data
+
+
+def finalize_moments(count, mean, m2):
+    # Mean and (population) standard deviation of the accumulated moments, NaN for empty grid boxes
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, mean, np.nan)
+        std = (m2 / count) ** 0.5
+
+    return mean, std
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+MPI execution mode of the baseline aggregation for multi-node runs.
+
+The file list is split across the ranks, every rank aggregates its own
+granules into a local grid_data, and the accumulators are combined with
+collective reductions: MIN for the minimum, MAX for the maximum and SUM for
+totals, counts, squares and histograms. The moment accumulators are merged
+exactly in two steps: the counts and the weighted means are summed on all
+ranks (Allreduce), then every rank sums its M2 and the spread of its means
+around the global mean to the root. The sparse histograms of a
+GridAccumulator(..., sparse=True) are gathered and added on the root rank.
+Only the root rank holds the result,
+so only the root rank writes the HDF5 output.
+
+Local test on one machine:
+    mpirun -n 4 python examples/modis_bs.py <same arguments as the serial run>
+"""
+
+import numpy as np
+from .baseline_series import run_modis_aggre, sts_name
+from .granule_index import prune_granules
+from .moments import MOMENT_NAMES, moment_keys
+
+
+def get_mpi_comm():
+    # Return MPI.COMM_WORLD, or None when mpi4py is not installed
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    return MPI.COMM_WORLD
+
+
+def split_files(hdfs, rank, size):
+    # Round-robin split of the file numbers, so every rank gets granules from the whole period
+    return np.array(hdfs)[rank::size]
+
+
+def reduce_grid_data(grid_data, comm, root=0):
+    # Combine the grid_data of every rank on the root rank, returns None on the other ranks
+    from mpi4py import MPI
+
+    # A GridAccumulator is reduced block by block, in place
+    arrays = getattr(grid_data, 'blocks', grid_data)
+
+    rank = comm.Get_rank()
+    for key in sorted(arrays):
+        if key.endswith(MOMENT_NAMES[0]):
+            reduce_moments(arrays, key[:-len(MOMENT_NAMES[0])], comm, root)
+            continue
+        elif key.endswith(MOMENT_NAMES[1]) | key.endswith(MOMENT_NAMES[2]):
+            continue  # Reduced with their count
+        elif key.endswith(sts_name[0]):
+            op = MPI.MIN
+        elif key.endswith(sts_name[1]):
+            op = MPI.MAX
+        else:
+            op = MPI.SUM
+
+        buf = np.ascontiguousarray(arrays[key])
+        if rank == root:
+            comm.Reduce(MPI.IN_PLACE, buf, op=op, root=root)
+        else:
+            comm.Reduce(buf, None, op=op, root=root)
+        if buf is not arrays[key]:
+            arrays[key] = buf
+
+    # The sparse histograms of a GridAccumulator(..., sparse=True) are gathered and added on the root rank
+    for key in sorted(getattr(grid_data, 'sparse', {})):
+        hist = grid_data.sparse[key]
+        parts = comm.gather((hist.index, hist.counts), root=root)
+        if rank == root:
+            for index, counts in parts[:root] + parts[root + 1:]:
+                hist.add_entries(index, counts)
+
+    return grid_data if rank == root else None
+
+
+def reduce_moments(arrays, prefix, comm, root=0):
+    # Combine the count, mean and M2 accumulators of arrays[prefix + MOMENT_NAMES] on the root rank, in place
+    from mpi4py import MPI
+
+    count_key, mean_key, m2_key = moment_keys(prefix)
+    count = np.asarray(arrays[count_key], dtype=np.float64)
+    mean = np.asarray(arrays[mean_key], dtype=np.float64)
+
+    total_count = np.zeros_like(count)
+    comm.Allreduce(np.ascontiguousarray(count), total_count, op=MPI.SUM)
+    total_mean = np.zeros_like(count)
+    comm.Allreduce(np.ascontiguousarray(count * mean), total_mean, op=MPI.SUM)
+    np.divide(total_mean, total_count, out=total_mean, where=total_count > 0)
+
+    spread = np.asarray(arrays[m2_key], dtype=np.float64) + count * (mean - total_mean) ** 2
+    m2 = np.zeros_like(count) if comm.Get_rank() == root else None
+    comm.Reduce(np.ascontiguousarray(spread), m2, op=MPI.SUM, root=root)
+
+    if comm.Get_rank() == root:
+        arrays[count_key][...] = total_count
+        arrays[mean_key][...] = total_mean
+        arrays[m2_key][...] = m2
+
+
+def run_modis_aggre_mpi(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, \
+                        grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx, \
+                        histnames=None, workers=None, spl_num=3, granule_index=None, comm=None, root=0, \
+                        checkpoint_file=None, checkpoint_every=50, index_cache=None, prefetch=None, \
+                        granule_cache=None, engine='vectorized'):
+    """Run run_modis_aggre with the files split across the MPI ranks.
+
+    Every rank must call it with the same arguments and its own, freshly
+    initialized grid_data (see init_grid_data).
+
+    With checkpoint_file, every rank checkpoints its own accumulators to
+    checkpoint_file + '.rank<N>'; resuming needs the same number of ranks.
+
+    Returns:
+        grid_data (dict): the statistics of all files on the root rank, None on the other ranks.
+    """
+    if comm is None:
+        comm = get_mpi_comm()
+    rank, size = comm.Get_rank(), comm.Get_size()
+
+    # Prune before splitting, so the granules left in the region are spread evenly across the ranks
+    hdfs = prune_granules(hdfs, fname2, granule_index, NTA_lats, NTA_lons)
+    local_hdfs = split_files(hdfs, rank, size)
+    if checkpoint_file is not None:
+        checkpoint_file = '{}.rank{}'.format(checkpoint_file, rank)
+    if local_hdfs.size > 0:
+        grid_data = run_modis_aggre(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+                                    local_hdfs, grid_data, sts_switch, varnames, intervals_1d, intervals_2d, \
+                                    var_idx, histnames=histnames, workers=workers, spl_num=spl_num, \
+                                    checkpoint_file=checkpoint_file, checkpoint_every=checkpoint_every, \
+                                    index_cache=index_cache, prefetch=prefetch, granule_cache=granule_cache, \
+                                    engine=engine)
+
+    return reduce_grid_data(grid_data, comm, root)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Process-pool execution of the per-granule aggregation.
+
+Workers return compact partial results (touched grid cells only) and the
+parent merges them strictly in file order, so the merged statistics are
+bit-identical to a serial run whatever the number of workers.
+
+prefetch_map overlaps the reading of the next granules with the work of
+the calling process: a background thread reads a bounded number of
+granules ahead, so the disk and the CPU are busy at the same time.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def map_granules(func, tasks, workers=None, max_pending=None):
+    """Apply func to every task, in a pool of worker processes when workers > 1.
+
+    Args:
+        func (callable): module-level (picklable) function called with one task.
+        tasks (iterable): one task per granule pair.
+        workers (int): number of worker processes, None or 1 runs in the calling process.
+        max_pending (int): maximum number of tasks submitted but not yet returned, 2 * workers by default.
+
+    Yields:
+        The result of func for every task, in the order of the tasks.
+    """
+    if (workers is None) or (workers <= 1):
+        for task in tasks:
+            yield func(task)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    # Keep a bounded window of futures so finished partial results do not pile up in memory
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(func, task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch_map(func, tasks, depth=2):
+    """Apply func to every task in a background thread, at most depth tasks ahead of the consumer.
+
+    While the caller works on the result of one task, the thread already runs func on the
+    next ones (typically reading and decoding the next granule pairs), so at most depth + 1
+    results are held in memory. The thread is the only one calling func, so func does not
+    need to be thread-safe with itself (HDF5 builds usually are not).
+
+    Args:
+        func (callable): called with one task in the background thread.
+        tasks (iterable): one task per granule pair.
+        depth (int): number of tasks run ahead, 0 runs func in the calling thread.
+
+    Yields:
+        The result of func for every task, in the order of the tasks; an exception raised
+        by func is raised when its result is reached.
+    """
+    if depth <= 0:
+        for task in tasks:
+            yield func(task)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(func, task))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Several level-3 periods (e.g. the days and the month) from one pass over the granules.
+
+run_modis_aggre builds one grid_data for all its granules, so daily and
+monthly products used to need one run (and one read of every granule) each.
+run_modis_aggre_periods reads and aggregates every granule once and merges
+its partial result into the accumulators of every period holding its date,
+one period of every kind: 'daily', 'pentad', 'monthly', a number of days or
+a user function. The granules are taken in time order, so a period is
+complete as soon as a granule past its end comes: it is handed to a callback
+(which finalizes and writes it, see examples/modis_bs.py) and released, and
+only one period of every kind is held in memory.
+"""
+
+from collections import namedtuple, OrderedDict
+from datetime import date, timedelta
+from .baseline_series import aggre_results, merge_granule, skip_granule
+from .checkpoint import granule_name
+from .granule_index import parse_granule_time, prune_granules
+from .moments import MOMENT_NAMES
+from .profiling import get_profile
+
+# One period of one kind:
+# kind:      the kind of period as given to run_modis_aggre_periods ('daily', 'monthly', 8, ...)
+# start/end: first and last date of the period
+# grid_data: its accumulators (None once released)
+# processed: names of the granules merged into it, failed: {name: error} of its granules which failed
+Period = namedtuple('Period', ['kind', 'start', 'end', 'grid_data', 'processed', 'failed'])
+
+
+def period_bounds(day, kind):
+    """First and last date of the period of the given kind holding day.
+
+    Args:
+        day (date): a date.
+        kind: 'daily', 'pentad' (days 1-5, 6-10, ... of the year, the 73rd one up to Dec 31),
+            'monthly', 'yearly', a number of days (periods counted from Jan 1, the last one cut at Dec 31),
+            or a function of a date returning the (start, end) dates of its period.
+
+    Returns:
+        (start, end) (tuple): dates.
+    """
+    if callable(kind):
+        return kind(day)
+    if kind == 'daily':
+        return day, day
+    if kind == 'monthly':
+        following = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        return day.replace(day=1), following - timedelta(days=1)
+    if kind == 'yearly':
+        return date(day.year, 1, 1), date(day.year, 12, 31)
+    if (kind != 'pentad') and (isinstance(kind, str) or (int(kind) != kind) or (kind < 1)):
+        raise ValueError("Unknown period '{}'".format(kind))
+
+    # Periods of n days from Jan 1: the 73rd pentad ends on Dec 31 (6 days in leap years),
+    # the last period of n days is cut at Dec 31 (e.g. the 46th 8-day period is 5 or 6 days)
+    first, last = date(day.year, 1, 1), date(day.year, 12, 31)
+    ndays = 5 if kind == 'pentad' else int(kind)
+    idx = (day - first).days // ndays
+    if kind == 'pentad':
+        idx = min(idx, 72)
+    start = first + timedelta(days=idx * ndays)
+    end = last if (kind == 'pentad') and (idx == 72) else min(start + timedelta(days=ndays - 1), last)
+    return start, end
+
+
+# Label of every named kind of period in the product file names, a number of days n is labelled 'nD'
+PERIOD_LABELS = {'daily': 'D1', 'pentad': 'P5', 'monthly': 'M', 'yearly': 'Y'}
+
+
+def period_label(kind):
+    """Fixed label of a kind of period, for the names of its product files.
+
+    Args:
+        kind: 'daily', 'pentad', 'monthly', 'yearly' or a number of days (see period_bounds),
+            a function has no label.
+
+    Returns:
+        label (string): 'D1', 'P5', 'M', 'Y' or '<n>D'.
+    """
+    if callable(kind):
+        raise ValueError("A period given by a function has no label, name its files from its dates")
+    period_bounds(date(2000, 1, 1), kind)
+    return PERIOD_LABELS[kind] if kind in PERIOD_LABELS else '{}D'.format(int(kind))
+
+
+def granule_date(fname):
+    # Date of a granule from its file name (A2008001.0000)
+    time = parse_granule_time(fname)
+    if time is None:
+        raise ValueError("No granule time in the file name {}".format(fname))
+    return time.date()
+
+
+def run_modis_aggre_periods(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, \
+                            periods, new_grid_data, on_close, sts_switch, varnames, intervals_1d, intervals_2d, \
+                            var_idx, histnames=None, engine='vectorized', workers=None, spl_num=3, \
+                            granule_index=None, index_cache=None, prefetch=None, granule_cache=None):
+    """Aggregate the granules once into the accumulators of several kinds of period, e.g. the days and the month.
+
+    Every granule is aggregated once (like run_modis_aggre, with the same engine, workers, prefetch
+    and caches) and its partial result is merged into the open period of every kind holding its
+    date, parsed from its MYD06 file name. A period is opened by its first granule (periods without
+    granules are not produced). The granules are taken in time order, so a period is closed when a
+    granule past its end comes, or after the last granule: on_close(period) is called with its Period,
+    then its accumulators are released.
+
+    Args:
+        periods (list): the kinds of period, see period_bounds.
+        new_grid_data (function): returns new, empty accumulators of the grid (init_grid_data or
+            allocate_grid_data with the arguments of the run), called for every period opened.
+        on_close (function): called with the Period of every closed period, e.g. to finalize and write it.
+        the other arguments: same as run_modis_aggre.
+
+    Returns:
+        closed (list): the Period of every closed period (with grid_data None), in the order they were closed.
+    """
+    if engine not in ('vectorized', 'fused'):
+        raise ValueError("Unknown aggregation engine '{}'".format(engine))
+    for kind in periods:
+        period_bounds(date(2000, 1, 1), kind)
+    profile = get_profile()
+
+    hdfs = prune_granules(hdfs, fname2, granule_index, NTA_lats, NTA_lons)
+    days = dict((j, granule_date(fname1[j])) for j in hdfs)
+    hdfs = sorted(hdfs, key=lambda j: days[j])
+    last = hdfs[-1] if len(hdfs) > 0 else None
+
+    opened, closed = OrderedDict(), []
+
+    def close(kind):
+        period = opened.pop(kind)
+        on_close(period)
+        closed.append(period._replace(grid_data=None))
+
+    # The accumulators of the first period tell whether the granules return their moments
+    spare = new_grid_data() if len(hdfs) > 0 else None
+    moments = (spare is not None) and any(key.endswith('_' + MOMENT_NAMES[0]) for key in spare)
+    results = aggre_results(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, hdfs, moments, \
+                            sts_switch, varnames, intervals_1d, intervals_2d, var_idx, histnames, engine, workers, \
+                            spl_num, index_cache, prefetch, granule_cache)
+    for j, (partial, error, record) in zip(hdfs, results):
+        print("File Number: {} / {}".format(j, last))
+        if record is not None:
+            profile.add_granule(record)
+
+        # Close the periods ending before this granule, open the periods of this granule
+        for kind in periods:
+            if (kind in opened) and (opened[kind].end < days[j]):
+                close(kind)
+            if kind not in opened:
+                start, end = period_bounds(days[j], kind)
+                grid_data = new_grid_data() if spare is None else spare
+                opened[kind], spare = Period(kind, start, end, grid_data, [], OrderedDict()), None
+
+        if error is not None:
+            skip_granule(opened[periods[0]].failed, fname1[j], error)
+            for kind in periods[1:]:
+                opened[kind].failed[granule_name(fname1[j])] = error
+            continue
+        with profile.timer('merge'):
+            for kind in periods:
+                merge_granule(opened[kind].grid_data, partial)
+                opened[kind].processed.append(granule_name(fname1[j]))
+
+    for kind in list(opened):
+        close(kind)
+
+    return closed
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Memory and cost estimates of an aggregation run, before anything is allocated.
+
+The accumulators of a fine grid with wide joint histogram tables easily
+need tens of GB (grid_lat * grid_lon * nbin1 * nbin2 values per variable).
+plan_run computes, from the same arguments as init_grid_data and the list of
+granule pairs:
+    - the accumulator memory of every statistic, for a storage strategy,
+    - the number of granule pairs, their size on disk and the bytes decoded
+      from them (the bytes_read counter of the profile),
+    - the projected peak resident memory of the run, all processes included:
+      the accumulators, the granules read and aggregated at the same time
+      (worker processes, prefetched granules, pending partial results) and
+      the copies made by finalize before writing, or the sparse histograms
+      merged while save_accumulators writes them (see rollup.py).
+The storage strategies (STRATEGIES) are:
+    - 'dict': init_grid_data, float64 arrays,
+    - 'accumulator': GridAccumulator, float64 values and int64 counts,
+    - 'sparse': the same with SparseHistogram histograms (see sparse.py),
+      whose memory grows with the non-zero counts: at most one per kept pixel
+      and histogram, stored with as many pending ones,
+    - 'compact': GridAccumulator, float32 values and int32 counts (the sums
+      and moments lose precision over long periods).
+With a memory budget, plan_run either refuses the run (ValueError) or, with
+fallback=True, first drops the workers and prefetched granules (the run is
+slower, its results are the same), then tries the next exact strategies.
+The lossy strategies (LOSSY_STRATEGIES) are only tried with allow_lossy=True,
+and a warning is issued when the fallback chooses one.
+allocate_grid_data creates the accumulators of the chosen strategy.
+
+The granule estimates are upper bounds for full-size granules (GRANULE_SHAPE)
+and a fixed per-process overhead (PROCESS_BYTES); the accumulators and the
+decoded bytes are exact.
+"""
+
+import os
+import warnings
+import numpy as np
+from collections import OrderedDict, namedtuple
+from .baseline_series import sts_name, init_grid_data
+from .accumulator import GridAccumulator
+from .sparse import ENTRY_BYTES
+from .moments import MOMENT_NAMES
+from .granule_index import prune_granules
+
+# Pixels of a 5-minute, 1 km MYD06 granule (along track, across track)
+GRANULE_SHAPE = (2030, 1354)
+
+# Value and count types of every storage strategy, in the order tried by the fallback: exact ones first
+STRATEGIES = OrderedDict([('dict', (np.float64, np.float64)),
+                          ('accumulator', (np.float64, np.int64)),
+                          ('sparse', (np.float64, np.int64)),
+                          ('compact', (np.float32, np.int32))])
+
+# Strategies keeping the histograms as SparseHistogram
+SPARSE_STRATEGIES = ['sparse']
+
+# Strategies whose results differ from the float64 accumulators
+LOSSY_STRATEGIES = ['compact']
+
+# Resident memory of one Python process with numpy, netCDF4, h5py and pandas loaded
+PROCESS_BYTES = 200 * 2 ** 20
+
+# Temporaries of aggre_granule per kept pixel: grid index, cell grouping and sorted copies (int64),
+# and per variable the pixel values and their histogram bins
+PIXEL_BYTES = 48
+VARIABLE_PIXEL_BYTES = 16
+
+RunPlan = namedtuple('RunPlan', ['strategy', 'workers', 'prefetch', 'statistics', 'accumulator_bytes',
+                                 'files', 'file_bytes', 'decoded_bytes', 'granule_bytes', 'final_bytes',
+                                 'saved_bytes', 'peak_bytes', 'memory_budget'])
+
+
+def accumulator_layout(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                       moments=False):
+    """Keys of init_grid_data / GridAccumulator with their statistic, shape and kind, without allocating them.
+
+    Returns:
+        layout (OrderedDict): (statistic, shape, kind) of every grid_data key, kind is 'float' for the
+        values (stored with the float type of a strategy) and 'count' for the counts (its count type).
+    """
+    size = grid_lat * grid_lon
+    layout = OrderedDict()
+    for key_idx, key in enumerate(varnames):
+        if sts_switch[0] == True:
+            layout[key + '_' + sts_name[0]] = (sts_name[0], (size,), 'float')
+        if sts_switch[1] == True:
+            layout[key + '_' + sts_name[1]] = (sts_name[1], (size,), 'float')
+        if (sts_switch[2] == True) | (sts_switch[3] == True) | (sts_switch[4] == True):
+            layout[key + '_' + sts_name[2]] = (sts_name[2], (size,), 'float')
+            layout[key + '_' + sts_name[3]] = (sts_name[3], (size,), 'count')
+            if not moments:
+                layout[key + '_' + sts_name[4]] = (sts_name[4], (size,), 'float')
+        if moments & ((sts_switch[2] == True) | (sts_switch[4] == True)):
+            for name, kind in zip(MOMENT_NAMES, ['count', 'float', 'float']):
+                layout[key + '_' + name] = (name, (size,), kind)
+        if sts_switch[5] == True:
+            nbin1 = np.fromstring(intervals_1d[key_idx], dtype=float, sep=',').size - 1
+            layout[key + '_' + sts_name[5]] = (sts_name[5], (size, nbin1), 'count')
+
+            if sts_switch[6] == True:
+                nbin2 = np.fromstring(intervals_2d[key_idx], dtype=float, sep=',').size - 1
+                layout[key + '_' + sts_name[6] + histnames[key_idx]] = (sts_name[6], (size, nbin1, nbin2), 'count')
+
+    return layout
+
+
+def sparse_bytes(shape, entries=None):
+    # Memory of the merged entries of a SparseHistogram, at most entries (the dense size when None) of them
+    size = int(np.prod(shape))
+    return ENTRY_BYTES * (size if entries is None else min(size, entries))
+
+
+def layout_bytes(layout, strategy, entries=None):
+    # Memory of every key of a layout stored with a strategy,
+    # entries bounds the non-zero counts of the sparse histograms
+    float_dtype, count_dtype = STRATEGIES[strategy]
+    itemsize = {'float': np.dtype(float_dtype).itemsize, 'count': np.dtype(count_dtype).itemsize}
+    nbytes = OrderedDict()
+    for key, (name, shape, kind) in layout.items():
+        if (strategy in SPARSE_STRATEGIES) and (name in sts_name[5:]):
+            nbytes[key] = 2 * sparse_bytes(shape, entries)  # Merged and pending entries
+        else:
+            nbytes[key] = int(np.prod(shape)) * itemsize[kind]
+    return nbytes
+
+
+def statistic_bytes(layout, strategy, entries=None):
+    # Memory of every statistic, summed over the variables
+    statistics = OrderedDict()
+    for key, nbytes in layout_bytes(layout, strategy, entries).items():
+        name = layout[key][0]
+        statistics[name] = statistics.get(name, 0) + nbytes
+    return statistics
+
+
+def final_bytes(layout, strategy, sts_switch, entries=None):
+    # Memory of the arrays created by finalize: copies of the extrema, counts and histograms, and the means
+    # and standard deviations (ratios of the values and the counts, the means of the moments keep their type)
+    float_dtype, count_dtype = STRATEGIES[strategy]
+    ratio = np.result_type(float_dtype, count_dtype).itemsize
+    moments = any(name == MOMENT_NAMES[0] for name, shape, kind in layout.values())
+    itemsize = {sts_name[0]: np.dtype(float_dtype).itemsize, sts_name[1]: np.dtype(float_dtype).itemsize,
+                sts_name[2]: np.dtype(float_dtype).itemsize if moments else ratio,
+                sts_name[3]: np.dtype(count_dtype).itemsize, sts_name[4]: ratio,
+                sts_name[5]: np.dtype(count_dtype).itemsize, sts_name[6]: np.dtype(count_dtype).itemsize}
+    nbytes = 0
+    for key, (name, shape, kind) in layout.items():
+        if (strategy in SPARSE_STRATEGIES) and (name in sts_name[5:]) and (sts_switch[sts_name.index(name)] == True):
+            nbytes += sparse_bytes(shape, entries)
+        elif (name in sts_name) and (sts_switch[sts_name.index(name)] == True):
+            nbytes += int(np.prod(shape)) * itemsize[name]
+        elif (name == MOMENT_NAMES[0]) and (sts_switch[4] == True):
+            # The standard deviation of the moments, without a sum of squares accumulator
+            nbytes += int(np.prod(shape)) * itemsize[sts_name[4]]
+    return nbytes
+
+
+def saved_bytes(layout, strategy, entries=None):
+    # Memory of save_accumulators: the dense keys are written as they are, the sparse histograms as their
+    # index and counts, one at a time, after merging their pending entries into new arrays
+    if strategy not in SPARSE_STRATEGIES:
+        return 0
+    return max([0] + [sparse_bytes(shape, entries) for name, shape, kind in layout.values() if name in sts_name[5:]])
+
+
+def sampled_pixels(granule_shape, spl_num):
+    # Number of pixels read_sampled keeps from a granule ([2::spl_num, 3::spl_num])
+    return len(range(2, granule_shape[0], spl_num)) * len(range(3, granule_shape[1], spl_num))
+
+
+def granule_bytes(layout, varnames, granule_shape, spl_num):
+    """Decoded bytes and working set of one granule pair.
+
+    Returns:
+        decoded (int): bytes of the arrays read_MODIS decodes (int8 cloud mask, float32
+        latitude / longitude, float64 variables), as counted by the bytes_read counter.
+        working (int): decoded bytes, the temporaries of aggre_granule and its partial result
+        (float64 values and int64 counts of every touched cell, at most one per pixel).
+        partial (int): the largest partial result alone.
+    """
+    npix = sampled_pixels(granule_shape, spl_num)
+    nvar = len([key for key in varnames if key != 'cloud_fraction'])
+    decoded = npix * (1 + 4 + 4 + 8 * nvar)
+
+    # The cell numbers and 8 bytes per value of every key
+    cell_bytes = 8 + 8 * sum(int(np.prod(shape[1:])) for name, shape, kind in layout.values())
+    cells = min([npix] + [shape[0] for name, shape, kind in layout.values()])
+    partial = cells * cell_bytes
+    working = decoded + npix * (PIXEL_BYTES + VARIABLE_PIXEL_BYTES * nvar) + partial
+    return decoded, working, partial
+
+
+def peak_bytes(accumulator, final, decoded, working, partial, workers=None, prefetch=None, saved=0):
+    # Peak resident memory of all processes: during the run, while saving the accumulators or while
+    # finalizing the statistics
+    if (workers is not None) and (workers > 1):
+        # Every worker aggregates one granule, the parent keeps up to 2 * workers partial results
+        running = PROCESS_BYTES + accumulator + 2 * workers * partial + workers * (PROCESS_BYTES + working)
+    else:
+        ahead = prefetch if (prefetch is not None) and (prefetch > 0) else 0
+        running = PROCESS_BYTES + accumulator + working + ahead * decoded
+    return max(running, PROCESS_BYTES + accumulator + saved, PROCESS_BYTES + accumulator + final)
+
+
+def plan_run(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, fname1=(), \
+             fname2=(), spl_num=3, moments=False, strategy='dict', workers=None, prefetch=None, \
+             granule_shape=GRANULE_SHAPE, granule_index=None, NTA_lats=None, NTA_lons=None, \
+             memory_budget=None, fallback=False, allow_lossy=False):
+    """Estimate the memory and the input of an aggregation run (see the module documentation).
+
+    Args:
+        varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, moments:
+            the arguments of init_grid_data.
+        fname1, fname2 (arrays): paths of the MYD06 files and of their MYD03 files.
+        spl_num, workers, prefetch: the arguments of run_modis_aggre.
+        strategy (string): storage of the accumulators, one of STRATEGIES.
+        granule_shape (tuple): pixels of a granule along and across track.
+        granule_index, NTA_lats, NTA_lons: only count the granules of the region (see prune_granules).
+        memory_budget (int): maximum peak memory in bytes, None for no limit.
+        fallback (bool): aggregate serially, then with the strategies after the requested one, until
+            the run is within the budget, instead of refusing it.
+        allow_lossy (bool): let the fallback choose the lossy strategies (LOSSY_STRATEGIES) too.
+
+    Returns:
+        plan (RunPlan): the chosen strategy, workers and prefetch, the accumulator bytes of every statistic
+        and in total, the number of files, their bytes on disk, the bytes decoded from them, the working
+        set of one granule, the bytes of the finalized statistics, the memory needed to save the accumulators
+        and the projected peak memory.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown accumulator strategy '{}'".format(strategy))
+
+    hdfs = prune_granules(np.arange(len(fname1)), fname2, granule_index, NTA_lats, NTA_lons)
+    files = len(hdfs)
+    file_bytes = sum(os.path.getsize(fname1[j]) + os.path.getsize(fname2[j]) for j in hdfs)
+
+    layout = accumulator_layout(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                                moments)
+    decoded, working, partial = granule_bytes(layout, varnames, granule_shape, spl_num)
+    # Every kept pixel adds to one count of each histogram, the bound is the dense size without a file list
+    entries = files * sampled_pixels(granule_shape, spl_num) if len(fname1) > 0 else None
+
+    def make_plan(name, plan_workers, plan_prefetch):
+        statistics = statistic_bytes(layout, name, entries)
+        accumulator = sum(statistics.values())
+        final = final_bytes(layout, name, sts_switch, entries)
+        saved = saved_bytes(layout, name, entries)
+        return RunPlan(name, plan_workers, plan_prefetch, statistics, accumulator, files, file_bytes,
+                       files * decoded, working, final, saved,
+                       peak_bytes(accumulator, final, decoded, working, partial, plan_workers, plan_prefetch,
+                                  saved),
+                       memory_budget)
+
+    plan = make_plan(strategy, workers, prefetch)
+    if (memory_budget is None) or (plan.peak_bytes <= memory_budget):
+        return plan
+
+    if fallback:
+        # The requested strategy and the next ones, with the requested concurrency and then serially
+        names = list(STRATEGIES)
+        for name in names[names.index(strategy):]:
+            if (name != strategy) and (name in LOSSY_STRATEGIES) and not allow_lossy:
+                continue
+            for candidate in [make_plan(name, workers, prefetch), make_plan(name, None, None)]:
+                if candidate.peak_bytes <= memory_budget:
+                    if (name != strategy) and (name in LOSSY_STRATEGIES):
+                        warnings.warn("The run uses the lossy '{}' accumulators to stay within the memory "
+                                      "budget".format(name))
+                    return candidate
+
+    raise ValueError("The run needs about {} of memory, more than the budget of {}:\n{}".format(
+        format_bytes(plan.peak_bytes), format_bytes(memory_budget), format_plan(plan)))
+
+
+def allocate_grid_data(plan, varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                       moments=False):
+    # Create the accumulators of the strategy of a plan (a RunPlan or a strategy name)
+    strategy = getattr(plan, 'strategy', plan)
+    if strategy == 'dict':
+        return init_grid_data(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                              moments=moments)
+    float_dtype, count_dtype = STRATEGIES[strategy]
+    return GridAccumulator(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, \
+                           moments=moments, float_dtype=float_dtype, count_dtype=count_dtype, \
+                           sparse=strategy in SPARSE_STRATEGIES)
+
+
+def format_bytes(nbytes):
+    # Human-readable size
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(nbytes) < 1024:
+            return '{:.1f} {}'.format(nbytes, unit)
+        nbytes /= 1024.
+    return '{:.1f} TiB'.format(nbytes)
+
+
+def format_plan(plan):
+    # Report of a RunPlan, one line per item
+    lines = ["Accumulators ({}): {}".format(plan.strategy, format_bytes(plan.accumulator_bytes))]
+    for name, nbytes in plan.statistics.items():
+        lines.append("    {:<24s} {}".format(name, format_bytes(nbytes)))
+    lines.append("Granule pairs: {} ({} on disk, {} decoded)".format(plan.files, format_bytes(plan.file_bytes),
+                                                                      format_bytes(plan.decoded_bytes)))
+    lines.append("Working set per granule: {}".format(format_bytes(plan.granule_bytes)))
+    lines.append("Finalized statistics: {}".format(format_bytes(plan.final_bytes)))
+    lines.append("Saving the accumulators: {}".format(format_bytes(plan.saved_bytes)))
+    lines.append("Projected peak memory: {} (workers: {}, prefetch: {})".format(
+        format_bytes(plan.peak_bytes), plan.workers, plan.prefetch))
+    if plan.memory_budget is not None:
+        lines.append("Memory budget: {}".format(format_bytes(plan.memory_budget)))
+    return '\n'.join(lines)
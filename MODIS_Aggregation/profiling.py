@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-phase timing and counters of the aggregation runs.
+
+The reading, gridding, statistics and writing functions report to the
+active profile:
+
+    with get_profile().timer('read_mod06'):
+        ...
+    get_profile().count('pixels_kept', n)
+
+By default the active profile is NULL_PROFILE, whose timer is one shared
+do-nothing context manager and whose count does nothing, so the
+instrumentation costs a function call per phase when disabled. enable_profile
+installs a Profile, which accumulates the seconds and calls of every phase
+and the counters of the whole run and of every granule, and writes them as
+a JSON report. Granules aggregated in worker processes or read by a
+prefetch thread are profiled there, under a profile of their own (see
+set_thread_profile), and their records are merged by the parent (see
+profiled_call).
+"""
+
+import json
+import timeit
+import threading
+from collections import OrderedDict
+
+
+class NullTimer(object):
+    # Context manager doing nothing (disabled profiling)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfile(object):
+    # Profile of a run without instrumentation: every method does nothing
+    enabled = False
+    _timer = NullTimer()
+
+    def timer(self, phase):
+        return self._timer
+
+    def count(self, name, value=1):
+        pass
+
+    def start_granule(self, name):
+        pass
+
+    def end_granule(self, status='ok'):
+        return None
+
+    def add_granule(self, record):
+        pass
+
+    def add_record(self, record):
+        pass
+
+
+NULL_PROFILE = NullProfile()
+_active_profile = NULL_PROFILE
+_thread = threading.local()
+
+
+class PhaseTimer(object):
+    # Adds the elapsed time of a 'with' block to one phase of a Profile
+
+    def __init__(self, profile, phase):
+        self.profile = profile
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add_time(self.phase, timeit.default_timer() - self.start)
+        return False
+
+
+class Profile(object):
+    """Seconds and calls of every phase and counters, for a run and for each of its granules.
+
+    Phases of one function do not overlap, so their sum is close to the time spent in the
+    instrumented code; counters are e.g. bytes_read, pixels_read, pixels_kept, pixels_dropped,
+    cells_touched, bytes_written.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.start = timeit.default_timer()
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+        self.granules = []
+        self._granule = None
+
+    def timer(self, phase):
+        return PhaseTimer(self, phase)
+
+    def add_time(self, phase, seconds, calls=1):
+        for timers in self._targets('timers'):
+            entry = timers.setdefault(phase, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def count(self, name, value=1):
+        for counters in self._targets('counters'):
+            counters[name] = counters.get(name, 0) + int(value)
+
+    def _targets(self, field):
+        # The run totals, and the current granule record while one is open
+        if self._granule is None:
+            return [getattr(self, field)]
+        return [getattr(self, field), self._granule[field]]
+
+    def start_granule(self, name):
+        # Open the record of one granule, following timers and counters also go to it
+        self._granule = {'name': str(name), 'status': None, 'seconds': timeit.default_timer(),
+                         'timers': OrderedDict(), 'counters': OrderedDict()}
+
+    def end_granule(self, status='ok'):
+        # Close the record of the current granule and return it
+        record, self._granule = self._granule, None
+        record['status'] = status
+        record['seconds'] = timeit.default_timer() - record['seconds']
+        self.granules.append(record)
+        return record
+
+    def add_granule(self, record):
+        # Add a granule record profiled in another process or thread to the run
+        self.granules.append(record)
+        self.add_record(record)
+
+    def add_record(self, record):
+        # Add the timers and counters of a record to the run (and to the open granule), not as a granule
+        for phase, (seconds, calls) in record['timers'].items():
+            self.add_time(phase, seconds, calls)
+        for name, value in record['counters'].items():
+            self.count(name, value)
+
+    def report(self):
+        # Machine-readable summary of the run, with the throughput of the main counters
+        wall = timeit.default_timer() - self.start
+        report = OrderedDict()
+        report['wall_seconds'] = wall
+        report['granules'] = len(self.granules)
+        report['granules_failed'] = sum(1 for g in self.granules if g['status'] != 'ok')
+        report['timers'] = OrderedDict((phase, {'seconds': t[0], 'calls': t[1]}) for phase, t in self.timers.items())
+        report['counters'] = OrderedDict(self.counters)
+        report['throughput'] = OrderedDict()
+        for name in ['bytes_read', 'pixels_read', 'pixels_kept', 'bytes_written']:
+            if (name in self.counters) and (wall > 0):
+                report['throughput'][name + '_per_second'] = self.counters[name] / wall
+        report['per_granule'] = [
+            OrderedDict([('name', g['name']), ('status', g['status']), ('seconds', g['seconds']),
+                         ('timers', OrderedDict((p, {'seconds': t[0], 'calls': t[1]}) for p, t in g['timers'].items())),
+                         ('counters', g['counters'])]) for g in self.granules]
+        return report
+
+    def save(self, fname):
+        # Write the report as JSON
+        with open(fname, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+def get_profile():
+    # The profile the instrumented functions report to: the profile of the calling thread when one is set
+    # (see set_thread_profile), otherwise the one of the process, NULL_PROFILE when profiling is disabled
+    profile = getattr(_thread, 'profile', None)
+    return _active_profile if profile is None else profile
+
+
+def set_thread_profile(profile):
+    # Make the calling thread report to profile (None goes back to the process profile), returns the previous one
+    previous = getattr(_thread, 'profile', None)
+    _thread.profile = profile
+    return previous
+
+
+def enable_profile(profile=None):
+    # Install a profile (a new Profile by default) and return it
+    global _active_profile
+    _active_profile = Profile() if profile is None else profile
+    return _active_profile
+
+
+def disable_profile():
+    # Go back to the do-nothing profile, returns the profile which was active
+    global _active_profile
+    profile, _active_profile = _active_profile, NULL_PROFILE
+    return profile
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution level-3 products from one aggregation at the finest grid.
+
+A coarser grid box is a block of factor x factor boxes of the finest grid,
+so its accumulators are combined from theirs without reading the pixels
+again (coarsen_grid_data):
+    - counts, sums, sums of squares and histograms are summed,
+    - Minimum / Maximum are reduced with fmin / fmax,
+    - the moment accumulators (see moments.py) are merged like MPI ranks.
+The counts, sums, moments and variable extrema of a block are exactly those
+of its pixels. Three legacy statistics are only approximated, since they
+depend on how the pixels are split into grid boxes: the per-box cloud
+fraction extrema, the sum-of-squares standard deviation (use the moments for
+an exact one) and the histograms, which skip single-pixel boxes.
+
+The lat / lon labels of a level are those of the first fine box of every
+block, i.e. np.arange(NTA_lats[0], NTA_lats[1], gap_y * factor).
+"""
+
+import numpy as np
+from collections import OrderedDict
+from .baseline_series import sts_name, finalize, write_level3
+from .moments import MOMENT_NAMES, moment_keys
+
+
+def grid_blocks(values, grid_lat, grid_lon, factor):
+    # View of flattened grid values as (grid_lat / factor, factor, grid_lon / factor, factor[, bins...])
+    values = np.asarray(values)
+    return values.reshape((grid_lat // factor, factor, grid_lon // factor, factor) + values.shape[1:])
+
+
+def coarsen_grid_data(grid_data, grid_lat, grid_lon, factor):
+    """Combine the accumulators of factor x factor grid boxes into one.
+
+    Args:
+        grid_data (dict or GridAccumulator): unfinalized accumulators of a (grid_lat, grid_lon) grid.
+        grid_lat, grid_lon (int): shape of the grid, both multiples of factor.
+        factor (int): number of grid boxes combined along lat and along lon.
+
+    Returns:
+        coarse (OrderedDict): the accumulators of the (grid_lat / factor, grid_lon / factor) grid,
+        with the keys and types of grid_data.
+    """
+    if (grid_lat % factor != 0) or (grid_lon % factor != 0):
+        raise ValueError("The grid ({} x {}) is not a multiple of the factor {}".format(grid_lat, grid_lon, factor))
+    size = (grid_lat // factor) * (grid_lon // factor)
+
+    def combine(values, reduce):
+        blocks = grid_blocks(values, grid_lat, grid_lon, factor)
+        return reduce(reduce(blocks, axis=3), axis=1).reshape((size,) + blocks.shape[4:])
+
+    coarse = OrderedDict()
+    for key in grid_data:
+        values = grid_data[key]
+        if key.endswith('_' + MOMENT_NAMES[0]):
+            # Exact merge of the moments of the boxes of every block around their common mean
+            count_key, mean_key, m2_key = moment_keys(key[:-len(MOMENT_NAMES[0])])
+            count = grid_blocks(grid_data[count_key], grid_lat, grid_lon, factor).astype(np.float64)
+            mean = grid_blocks(grid_data[mean_key], grid_lat, grid_lon, factor)
+            total = count.sum(axis=(1, 3))
+            block_mean = np.divide((count * mean).sum(axis=(1, 3)), total, out=np.zeros(total.shape),
+                                   where=total > 0)
+            spread = grid_blocks(grid_data[m2_key], grid_lat, grid_lon, factor) + \
+                count * (mean - block_mean[:, None, :, None]) ** 2
+            coarse[count_key] = total.reshape(size).astype(np.asarray(values).dtype)
+            coarse[mean_key] = block_mean.reshape(size).astype(np.asarray(grid_data[mean_key]).dtype)
+            coarse[m2_key] = spread.sum(axis=(1, 3)).reshape(size).astype(np.asarray(grid_data[m2_key]).dtype)
+        elif key.endswith('_' + MOMENT_NAMES[1]) | key.endswith('_' + MOMENT_NAMES[2]):
+            continue  # Merged with their count
+        elif key.endswith('_' + sts_name[0]):
+            coarse[key] = combine(values, np.fmin.reduce)
+        elif key.endswith('_' + sts_name[1]):
+            coarse[key] = combine(values, np.fmax.reduce)
+        else:
+            coarse[key] = combine(values, np.add.reduce).astype(np.asarray(values).dtype, copy=False)
+
+    return coarse
+
+
+def build_pyramid(grid_data, grid_lat, grid_lon, factors):
+    """Accumulators of every level of a grid pyramid.
+
+    Every level is combined from the finest level it is a multiple of (e.g. the 5 degree
+    level from the 1 degree one), so each combination reads as few boxes as possible.
+
+    Returns:
+        levels (list): (factor, grid_data, grid_lat, grid_lon) of every factor, in increasing order.
+    """
+    levels = [(1, grid_data, grid_lat, grid_lon)]
+    for factor in sorted(set(int(f) for f in factors)):
+        if factor == 1:
+            continue
+        base = [level for level in levels if factor % level[0] == 0][-1]
+        step = factor // base[0]
+        levels.append((factor, coarsen_grid_data(base[1], base[2], base[3], step), base[2] // step,
+                       base[3] // step))
+
+    return [level for level in levels if level[0] in factors]
+
+
+def write_pyramid(fnames, grid_data, sts_switch, varnames, histnames, grid_lat, grid_lon, map_lat, map_lon, \
+                  unit_list, longname_list, fillvalue_list, scale_list, offst_list, **kwargs):
+    """Write one level-3 file per level of the pyramid of grid_data.
+
+    Args:
+        fnames (dict): output file name of every factor, e.g. {1: '0.25deg.h5', 4: '1deg.h5'}.
+        grid_data: unfinalized accumulators of the finest (grid_lat, grid_lon) grid, left untouched.
+        map_lat, map_lon (arrays): labels of the finest grid.
+        kwargs: compression options and file attributes of write_level3.
+
+    Returns:
+        levels (list): (factor, grid_lat, grid_lon) of every file written.
+    """
+    written = []
+    for factor, level, level_lat, level_lon in build_pyramid(grid_data, grid_lat, grid_lon, list(fnames)):
+        final = finalize(level, sts_switch, varnames, histnames, level_lat, level_lon)
+        write_level3(fnames[factor], final, sts_switch, np.asarray(map_lat)[::factor],
+                     np.asarray(map_lon)[::factor], unit_list, longname_list, fillvalue_list, scale_list,
+                     offst_list, **kwargs)
+        written.append((factor, level_lat, level_lon))
+
+    return written
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Persisted, unfinalized accumulators and their roll-up into longer periods.
+
+A run saves its grid_data before finalization (minimum, maximum, total,
+pixel counts, sum of squares and histograms) in one HDF5 file, with the run
+configuration as a JSON attribute. Any set of those files on the same grid,
+e.g. the days of a month or the months of a year, is merged with the same
+rules as the granules (fmin, fmax, sum), then finalized and written as a
+level-3 product without reading the level-2 granules again. A SparseHistogram
+accumulator is saved as a group of its flat indices and counts (the layout of
+write_sparse_entry) and read back as a SparseHistogram, it is never densified.
+"""
+
+import os
+import json
+import h5py
+import numpy as np
+from collections import OrderedDict
+from .baseline_series import merge_grid_data, finalize, write_level3
+from .level3_writer import read_sparse_entry
+from .sparse import SparseHistogram
+from .moments import MOMENT_NAMES, MOMENT_ATTRS
+
+# Configuration entries combined over the merged files, all others must be equal
+PERIOD_FIELDS = ['start', 'end', 'granules']
+
+
+def to_json(value):
+    # numpy values of the configuration as plain JSON types
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot store {!r} in the accumulator configuration".format(value))
+
+
+def save_accumulators(fname, grid_data, config):
+    """Save the unfinalized accumulators of a run in an HDF5 file (written atomically).
+
+    Args:
+        fname (string): path of the HDF5 file.
+        grid_data (dict or GridAccumulator): the accumulators, before finalize.
+        config (dict): JSON-serializable run configuration, e.g. varnames, sts_switch,
+            intervals_1d, intervals_2d, histnames, NTA_lats, NTA_lons, gap_x, gap_y,
+            the variable attributes, and the period: 'start', 'end' (ISO dates) and 'granules'.
+    """
+    tmp_file = fname + '.tmp'
+    # track_order keeps the datasets in the order of grid_data (the order of the written product)
+    with h5py.File(tmp_file, 'w', track_order=True) as f:
+        f.attrs['config'] = json.dumps(config, default=to_json)
+        for key in grid_data:
+            value = grid_data[key]
+            if isinstance(value, SparseHistogram):
+                group = f.create_group(key)
+                group.create_dataset('index', data=value.index)
+                group.create_dataset('counts', data=value.counts)
+                group.attrs['shape'] = np.array(value.shape, dtype=np.int64)
+            else:
+                f.create_dataset(key, data=value)
+    os.replace(tmp_file, fname)
+
+
+def load_accumulators(fname):
+    """Read the accumulators saved by save_accumulators.
+
+    Returns:
+        (grid_data, config) (tuple): OrderedDict of the accumulators in saved order (the sparse
+        histograms as SparseHistogram), and the configuration.
+    """
+    with h5py.File(fname, 'r') as f:
+        config = json.loads(f.attrs['config'])
+        grid_data = OrderedDict((key, read_sparse_entry(f[key]) if isinstance(f[key], h5py.Group) else f[key][()])
+                                for key in f.keys())
+
+    return grid_data, config
+
+
+def merge_accumulators(fnames):
+    """Merge the accumulator files of several periods on the same grid.
+
+    Returns:
+        (grid_data, config) (tuple): the merged accumulators and the configuration,
+        with 'start' the earliest, 'end' the latest start and end date and 'granules' the total.
+    """
+    grid_data, config = None, None
+    for fname in fnames:
+        other, other_config = load_accumulators(fname)
+        if grid_data is None:
+            grid_data, config = other, other_config
+            continue
+
+        for field in set(config) | set(other_config):
+            if (field not in PERIOD_FIELDS) and (config.get(field) != other_config.get(field)):
+                raise ValueError("'{}' of {} does not match the other accumulator files".format(field, fname))
+        grid_data = merge_grid_data(grid_data, other)
+
+        if ('start' in config) and ('start' in other_config):
+            config['start'] = min(config['start'], other_config['start'])
+        if ('end' in config) and ('end' in other_config):
+            config['end'] = max(config['end'], other_config['end'])
+        if ('granules' in config) and ('granules' in other_config):
+            config['granules'] += other_config['granules']
+
+    if grid_data is None:
+        raise ValueError("No accumulator file to merge")
+
+    return grid_data, config
+
+
+def rollup_product(fnames, out_fname):
+    """Merge accumulator files (e.g. the days of a month) and write the finalized level-3 product.
+
+    The files must carry the configuration written by examples/modis_bs.py: the grid
+    (NTA_lats, NTA_lons, gap_x, gap_y, grid_lat, grid_lon), sts_switch, varnames,
+    histnames and the variable attributes (unit_list, longname_list, fillvalue_list,
+    scale_list, offst_list).
+
+    Returns:
+        config (dict): the configuration of the merged period.
+    """
+    grid_data, config = merge_accumulators(fnames)
+
+    sts_switch = np.array(config['sts_switch'], dtype=bool)
+    final = finalize(grid_data, sts_switch, config['varnames'], config['histnames'], \
+                     config['grid_lat'], config['grid_lon'])
+
+    map_lon = np.arange(config['NTA_lons'][0], config['NTA_lons'][1], config['gap_x'])
+    map_lat = np.arange(config['NTA_lats'][0], config['NTA_lats'][1], config['gap_y'])
+    moments = any(key.endswith('_' + MOMENT_NAMES[0]) for key in grid_data)
+    write_level3(out_fname, final, sts_switch, map_lat, map_lon, config['unit_list'], config['longname_list'], \
+                 config['fillvalue_list'], config['scale_list'], config['offst_list'], \
+                 attrs=MOMENT_ATTRS if moments else None)
+
+    return config
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Sparse storage of the histogram accumulators.
+
+The joint histograms of a fine grid are (grid_lat * grid_lon, nbin1, nbin2)
+counts, but a daily or regional run only touches a few cells and bin pairs
+of them. SparseHistogram keeps the non-zero counts only, as a coordinate
+list: the sorted flat (C order) index of every non-zero count and the
+count. The partial results of the granules are appended as they come and
+merged (sorted and summed) once they hold as many entries as the merged
+list, so adding a granule costs about its own number of entries.
+
+A SparseHistogram stands in for the dense array where the aggregation uses
+it: merge_granule / merge_grid_data add into it, finalize reshapes and
+copies it, write_grid_entry densifies it one chunk at a time, and
+np.asarray(...) or toarray() give the whole dense array. write_sparse_entry
+(see level3_writer.py) stores it as is. GridAccumulator(..., sparse=True)
+holds its histograms as SparseHistogram.
+"""
+
+import numpy as np
+
+# Bytes of one stored entry: flat index and count
+ENTRY_BYTES = 16
+
+
+class SparseHistogram(object):
+    """Counts of a dense array of the given shape, storing only the non-zero ones.
+
+    Args:
+        shape (tuple): shape of the dense array, (grid cells, bins[, bins]).
+        dtype: integer type of the counts.
+        index, counts (arrays): optional initial entries, sorted unique flat indices and their counts.
+    """
+
+    def __init__(self, shape, dtype=np.int64, index=None, counts=None):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self._index = np.zeros(0, dtype=np.int64) if index is None else np.asarray(index, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=self.dtype) if counts is None else np.asarray(counts, dtype=self.dtype)
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def index(self):
+        # Sorted flat indices of the non-zero counts
+        self.compact()
+        return self._index
+
+    @property
+    def counts(self):
+        # Non-zero counts, in the order of index
+        self.compact()
+        return self._counts
+
+    @property
+    def nnz(self):
+        return self.index.size
+
+    @property
+    def nbytes(self):
+        # Memory of the merged and pending entries
+        return self._index.nbytes + self._counts.nbytes + sum(i.nbytes + c.nbytes for i, c in self._pending)
+
+    def add(self, cells, hist):
+        """Add the histograms of some grid cells, e.g. of a granule partial result.
+
+        Args:
+            cells (array): grid cell of every histogram, None for all the grid cells in order.
+            hist (array): dense counts of shape (number of cells, bins[, bins]).
+        """
+        hist = np.asarray(hist)
+        nbins = self.size // self.shape[0]
+        flat = hist.reshape(hist.shape[0], nbins)
+        rows, bins = np.nonzero(flat)
+        if rows.size == 0:
+            return self
+        cell = rows if cells is None else np.asarray(cells, dtype=np.int64)[rows]
+        self.add_entries(cell * nbins + bins, flat[rows, bins])
+        return self
+
+    def add_entries(self, index, counts):
+        # Append flat indices (in any order, repeated or not) and their counts, merged lazily
+        self._pending.append((np.asarray(index, dtype=np.int64), np.asarray(counts).astype(self.dtype, copy=False)))
+        self._pending_size += self._pending[-1][0].size
+        if self._pending_size > max(self._index.size, 1 << 16):
+            self.compact()
+        return self
+
+    def add_sparse(self, other):
+        # Add the entries of another SparseHistogram of the same shape
+        if tuple(other.shape) != self.shape:
+            raise ValueError("Cannot add a sparse histogram of shape {} to one of shape {}".format(other.shape,
+                                                                                                 self.shape))
+        return self.add_entries(other.index, other.counts)
+
+    def compact(self):
+        # Merge the pending entries: sort the flat indices and sum the counts of equal ones
+        if len(self._pending) == 0:
+            return self
+        index = np.concatenate([self._index] + [i for i, c in self._pending])
+        counts = np.concatenate([self._counts] + [c for i, c in self._pending])
+        self._pending, self._pending_size = [], 0
+
+        if index.size == 0:
+            return self
+
+        order = np.argsort(index, kind='stable')
+        index, counts = index[order], counts[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        counts = np.add.reduceat(counts, starts)
+        index = index[starts]
+        keep = counts != 0
+        self._index, self._counts = index[keep], counts[keep]
+        return self
+
+    def toarray(self):
+        # The dense array
+        dense = np.zeros(self.size, dtype=self.dtype)
+        dense[self.index] = self.counts
+        return dense.reshape(self.shape)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.toarray()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def __getitem__(self, item):
+        # Dense block selected by basic slicing, densifying only the entries of the selected
+        # range of the first axis (e.g. the lat rows of a chunk written by write_grid_entry)
+        if not isinstance(item, tuple):
+            item = (item,)
+        if any(i is Ellipsis for i in item):
+            at = [k for k, i in enumerate(item) if i is Ellipsis][0]
+            item = item[:at] + (slice(None),) * (self.ndim - len(item) + 1) + item[at + 1:]
+        item = item + (slice(None),) * (self.ndim - len(item))
+        if not all(isinstance(i, slice) and (i.step in (None, 1)) for i in item):
+            return self.toarray()[item]
+
+        ranges = [i.indices(n)[:2] for i, n in zip(item, self.shape)]
+        row_size = self.size // self.shape[0]
+        lo, hi = np.searchsorted(self.index, [ranges[0][0] * row_size, ranges[0][1] * row_size])
+        coords = np.unravel_index(self.index[lo:hi], self.shape)
+        inside = np.ones(hi - lo, dtype=bool)
+        for coord, (start, stop) in zip(coords[1:], ranges[1:]):
+            inside &= (coord >= start) & (coord < stop)
+
+        block = np.zeros([max(stop - start, 0) for start, stop in ranges], dtype=self.dtype)
+        block[tuple(coord[inside] - start for coord, (start, stop) in zip(coords, ranges))] = \
+            self.counts[lo:hi][inside]
+        return block
+
+    def __setitem__(self, item, values):
+        # Replace all the counts by those of another SparseHistogram or of a dense array (e.g. from a checkpoint)
+        if (item is not Ellipsis) and (item != slice(None)):
+            raise ValueError("A sparse histogram can only be assigned as a whole")
+        self._pending, self._pending_size = [], 0
+        if isinstance(values, SparseHistogram):
+            if values.size != self.size:
+                raise ValueError("Cannot assign a sparse histogram of shape {} to one of shape {}".format(
+                    values.shape, self.shape))
+            self._index, self._counts = values.index.copy(), values.counts.astype(self.dtype)
+            return
+        values = np.broadcast_to(np.asarray(values), self.shape).ravel()
+        self._index = np.flatnonzero(values).astype(np.int64)
+        self._counts = values[self._index].astype(self.dtype)
+
+    def reshape(self, shape):
+        # The same counts viewed with another shape of the same size (the flat indices do not change)
+        shape = tuple(shape)
+        if int(np.prod(shape, dtype=np.int64)) != self.size:
+            raise ValueError("Cannot reshape a sparse histogram of shape {} into {}".format(self.shape, shape))
+        return SparseHistogram(shape, self.dtype, self.index, self.counts)
+
+    def copy(self):
+        return SparseHistogram(self.shape, self.dtype, self.index.copy(), self.counts.copy())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding:utf8
+# -*- coding: utf-8 -*-
+"""
+Synthetic MYD06_L2 / MYD03 granules for tests and benchmarks.
+
+The files are netCDF4 with the names, shapes, types and attributes the
+readers of this package use, so no real MODIS data is needed:
+    - MYD03: Latitude / Longitude (float32, _FillValue -999) of a 5-minute
+      swath of the Aqua sun-synchronous orbit (2030 x 1354 pixels of 1 km,
+      about 2330 km across track), and SolarZenith (scaled int16).
+    - MYD06_L2: Cloud_Mask_1km (int8, 2 byte segments) with the determined,
+      cloudiness, day/night, sunglint, snow/ice and land/water bit fields of
+      byte 0, and scaled int16 cloud variables with _FillValue over clear pixels.
+The cloud field is smooth along and across the swath and every granule is
+reproducible from its time and seed.
+"""
+
+import os
+import numpy as np
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+from .planner import GRANULE_SHAPE
+
+# Aqua orbit: inclination (degrees), period (minutes), half swath width (degrees of great circle)
+ORBIT_INCLINATION = 98.2
+ORBIT_PERIOD = 98.8
+HALF_SWATH = 10.5
+GRANULE_MINUTES = 5
+
+# MYD06_L2 variables: name, units, long_name, scale_factor, add_offset, _FillValue, physical range
+SYNTHETIC_VARIABLES = [
+    ('Cloud_Top_Pressure', 'hPa', 'Cloud Top Pressure at 1-km resolution', 0.1, 0.0, -9999, (100.0, 1050.0)),
+    ('Cloud_Top_Temperature', 'K', 'Cloud Top Temperature at 1-km resolution', 0.01, -15000.0, -32768,
+     (180.0, 310.0)),
+    ('Cloud_Optical_Thickness', 'none', 'Cloud Optical Thickness', 0.01, 0.0, -9999, (0.0, 150.0)),
+    ('Cloud_Effective_Radius', 'micron', 'Cloud Particle Effective Radius', 0.01, 0.0, -9999, (2.0, 60.0)),
+    ('Cloud_Water_Path', 'g/m^2', 'Cloud Water Path', 1.0, 0.0, -9999, (0.0, 3000.0)),
+]
+
+
+def synthetic_file_name(product, time, extension='nc'):
+    # MODIS file name of a granule, e.g. MYD03.A2008001.0005.061.synthetic.nc
+    return '{}.A{:%Y%j.%H%M}.061.synthetic.{}'.format(product, time, extension)
+
+
+def swath_geolocation(time, shape=GRANULE_SHAPE):
+    # Latitude, longitude and solar zenith angle (degrees) of the swath starting at time
+    minutes = (time - datetime(time.year, 1, 1)).total_seconds() / 60.0
+    along = np.radians(360.0 * (minutes + GRANULE_MINUTES * np.linspace(0, 1, shape[0])) / ORBIT_PERIOD)
+    across = np.radians(HALF_SWATH * np.linspace(-1, 1, shape[1]))
+
+    # Ascending node drifting west with the rotation of the Earth
+    node = np.radians(-360.0 * minutes / 1436.0)
+    incl = np.radians(ORBIT_INCLINATION)
+    a = np.array([np.cos(node), np.sin(node), 0.0])
+    b = np.array([-np.sin(node) * np.cos(incl), np.cos(node) * np.cos(incl), np.sin(incl)])
+    n = np.cross(a, b)
+
+    track = np.cos(along)[:, None] * a + np.sin(along)[:, None] * b
+    pos = np.cos(across)[None, :, None] * track[:, None, :] + np.sin(across)[None, :, None] * n
+    lat = np.degrees(np.arcsin(np.clip(pos[..., 2], -1, 1)))
+    lon = np.degrees(np.arctan2(pos[..., 1], pos[..., 0]))
+
+    # Sub-solar point from the day of year and the UTC time
+    day = time.timetuple().tm_yday
+    hours = time.hour + time.minute / 60.0
+    decl = np.radians(-23.44 * np.cos(2 * np.pi * (day + 10) / 365.0))
+    sun_lon = np.radians(180.0 - 15.0 * hours)
+    sun = np.array([np.cos(decl) * np.cos(sun_lon), np.cos(decl) * np.sin(sun_lon), np.sin(decl)])
+    sza = np.degrees(np.arccos(np.clip(pos.dot(sun), -1, 1)))
+
+    return lat.astype(np.float32), lon.astype(np.float32), sza
+
+
+def smooth_field(rng, shape, scale=64):
+    # Smooth random field in [0, 1]: coarse noise interpolated over the swath
+    coarse = rng.rand(shape[0] // scale + 2, shape[1] // scale + 2)
+    rows = np.linspace(0, coarse.shape[0] - 1.001, shape[0])
+    cols = np.linspace(0, coarse.shape[1] - 1.001, shape[1])
+    r0, c0 = rows.astype(int), cols.astype(int)
+    fr, fc = (rows - r0)[:, None], (cols - c0)[None, :]
+    return (coarse[r0][:, c0] * (1 - fr) * (1 - fc) + coarse[r0 + 1][:, c0] * fr * (1 - fc) +
+            coarse[r0][:, c0 + 1] * (1 - fr) * fc + coarse[r0 + 1][:, c0 + 1] * fr * fc)
+
+
+def cloud_mask_byte0(cloudiness, sza, lat, lon, rng):
+    # Pack the bit fields of byte 0 of Cloud_Mask_1km:
+    # bit 0 determined, bits 1-2 cloudiness (0 cloudy ... 3 clear), bit 3 day, bit 4 no sunglint,
+    # bit 5 no snow/ice, bits 6-7 surface (0 water, 1 coastal, 2 desert, 3 land)
+    land = np.sin(np.radians(3 * lon)) * np.cos(np.radians(2 * lat)) > 0.3
+    coast = np.abs(np.sin(np.radians(3 * lon)) * np.cos(np.radians(2 * lat)) - 0.3) < 0.02
+    desert = land & (np.abs(lat) > 15) & (np.abs(lat) < 30)
+    surface = np.where(coast, 1, np.where(desert, 2, np.where(land, 3, 0)))
+
+    byte0 = np.ones(cloudiness.shape, dtype=np.uint8)
+    byte0 |= (cloudiness.astype(np.uint8) << 1)
+    byte0 |= ((sza < 85).astype(np.uint8) << 3)
+    byte0 |= ((rng.rand(*cloudiness.shape) > 0.05).astype(np.uint8) << 4)
+    byte0 |= ((np.abs(lat) < 60).astype(np.uint8) << 5)
+    byte0 |= (surface.astype(np.uint8) << 6)
+
+    return byte0.view(np.int8)
+
+
+def write_synthetic_granule(directory, time, shape=GRANULE_SHAPE, seed=0, cloud_cover=0.6):
+    """Write one synthetic MYD06_L2 granule and its MYD03 geolocation granule.
+
+    Args:
+        directory (string): output directory, the files are named like the MODIS products (see synthetic_file_name).
+        time (datetime): start time of the granule, a multiple of 5 minutes like the real products.
+        shape (tuple): pixels along and across track, GRANULE_SHAPE for full-size granules.
+        seed (int): seed of the cloud field, combined with the granule time.
+        cloud_cover (float): approximate fraction of cloudy and probably cloudy pixels.
+
+    Returns:
+        (m06, m03) (tuple): paths of the MYD06_L2 and MYD03 files.
+    """
+    rng = np.random.RandomState((seed * 1000003 + int(time.strftime('%Y%j%H%M'))) % (2 ** 32))
+    lat, lon, sza = swath_geolocation(time, shape)
+
+    # Cloudiness categories from a smooth field: 0 cloudy, 1 probably cloudy, 2 probably clear, 3 clear
+    field = smooth_field(rng, shape) + 0.1 * rng.rand(*shape)
+    cut = np.quantile(field, [cloud_cover * 0.85, cloud_cover, min(1.0, cloud_cover + 0.1)])
+    cloudiness = np.searchsorted(cut, field)
+    cloudy = cloudiness <= 1
+
+    m06 = os.path.join(directory, synthetic_file_name('MYD06_L2', time))
+    m03 = os.path.join(directory, synthetic_file_name('MYD03', time))
+
+    with Dataset(m06, 'w') as nc:
+        nc.createDimension('Cell_Along_Swath_1km', shape[0])
+        nc.createDimension('Cell_Across_Swath_1km', shape[1])
+        nc.createDimension('Byte_Segment', 2)
+        dims = ('Cell_Along_Swath_1km', 'Cell_Across_Swath_1km')
+
+        cm = nc.createVariable('Cloud_Mask_1km', 'i1', dims + ('Byte_Segment',))
+        cm.set_auto_maskandscale(False)
+        cm.long_name = 'MODIS Cloud Mask, First Two Bytes'
+        mask = np.empty(shape + (2,), dtype=np.int8)
+        mask[:, :, 0] = cloud_mask_byte0(cloudiness, sza, lat, lon, rng)
+        mask[:, :, 1] = rng.randint(-128, 128, shape)
+        cm[:] = mask
+
+        depth = smooth_field(rng, shape, 32)
+        for name, units, long_name, scale, offset, fill, (low, high) in SYNTHETIC_VARIABLES:
+            var = nc.createVariable(name, 'i2', dims, fill_value=fill)
+            var.set_auto_maskandscale(False)
+            var.units = units
+            var.long_name = long_name
+            var.scale_factor = scale
+            var.add_offset = offset
+            values = low + (high - low) * np.clip(0.8 * depth + 0.2 * rng.rand(*shape), 0, 1)
+            packed = np.round(values / scale + offset).astype(np.int16)
+            packed[~cloudy] = fill
+            var[:] = packed
+
+    with Dataset(m03, 'w') as nc:
+        nc.createDimension('nscans', shape[0])
+        nc.createDimension('mframes', shape[1])
+        for name, values in [('Latitude', lat), ('Longitude', lon)]:
+            var = nc.createVariable(name, 'f4', ('nscans', 'mframes'), fill_value=-999.0)
+            var.set_auto_maskandscale(False)
+            var.units = 'degrees'
+            var[:] = values
+        var = nc.createVariable('SolarZenith', 'i2', ('nscans', 'mframes'), fill_value=-32767)
+        var.set_auto_maskandscale(False)
+        var.units = 'degrees'
+        var.scale_factor = 0.01
+        var.add_offset = 0.0
+        var[:] = np.round(sza / 0.01).astype(np.int16)
+
+    return m06, m03
+
+
+def write_synthetic_granules(directory, start, count, shape=GRANULE_SHAPE, seed=0, cloud_cover=0.6):
+    """Write count consecutive 5-minute granule pairs starting at start (a datetime).
+
+    Returns:
+        (fname1, fname2) (tuple): numpy arrays of the MYD06_L2 and MYD03 paths in time order.
+    """
+    pairs = [write_synthetic_granule(directory, start + timedelta(minutes=GRANULE_MINUTES * i), shape, seed,
+                                     cloud_cover) for i in range(count)]
+    return np.array([p[0] for p in pairs]), np.array([p[1] for p in pairs])
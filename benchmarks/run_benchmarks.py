@@ -0,0 +1,191 @@
+"""
+Benchmark suite of the MODIS aggregation on synthetic granules.
+
+Times the read, grid, stats and write phases of the baseline aggregation and
+the per-file cloud fraction separately, for several grid sizes, sampling
+rates and numbers of files, and stores the results in a JSON file which a
+later run can be compared against:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    (change the code)
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Phases (seconds for all the files, best of --repeat runs):
+    read:           read_MODIS of every granule pair
+    grid:           locate_grid_index + group_cells of every granule
+    stats:          aggre_granule + merge_granule of every granule (includes its own gridding)
+    write:          finalize + write_level3 of the statistics
+    cloud_fraction: aggregateOneFileData of every granule pair
+"""
+
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from MODIS_Aggregation import read_MODIS, locate_grid_index, init_grid_data, aggre_granule, merge_granule, \
+    finalize, write_level3, aggregateOneFileData
+from MODIS_Aggregation.grid_reduction import group_cells
+from MODIS_Aggregation.histograms import compile_histogram_spec
+from MODIS_Aggregation.synthetic import write_synthetic_granules
+
+VARNAMES = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+INTERVALS_1D = np.array(['0,0.2,0.4,0.6,0.8,1', '100,200,300,400,500,600,700,800,900,1000,1100',
+                         '0,2,4,6,10,15,20,30,50,100,150'])
+INTERVALS_2D = np.array(['0,2,4,6,10,15,20,30,50,100,150', '0,2,4,6,10,15,20,30,50,100,150',
+                         '100,200,300,400,500,600,700,800,900,1000,1100'])
+HISTNAMES = np.array(['_Cloud_Optical_Thickness', '_Cloud_Optical_Thickness', '_Cloud_Top_Pressure'])
+VAR_IDX = np.array([2, 2, 1])
+STS_SWITCH = np.ones(7, dtype=bool)
+NTA_LATS, NTA_LONS = [-90, 90], [-180, 180]
+
+
+def best_time(func, repeat):
+    # Best wall-clock time of repeat calls of func, and the result of the last call
+    best = np.inf
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        result = func()
+        best = min(best, timeit.default_timer() - start)
+    return best, result
+
+
+def bench_case(fname1, fname2, gap, spl_num, repeat, tmpdir):
+    # Time every phase for one grid size and sampling rate, returns {phase: seconds}
+    grid_lat, grid_lon = int(round(180 / gap)), int(round(360 / gap))
+    hist_spec = compile_histogram_spec(VARNAMES, INTERVALS_1D, INTERVALS_2D, VAR_IDX)
+    times = {}
+
+    times['read'], granules = best_time(
+        lambda: [read_MODIS(VARNAMES, f1, f2, spl_num) for f1, f2 in zip(fname1, fname2)], repeat)
+
+    times['grid'], _ = best_time(
+        lambda: [group_cells(locate_grid_index(lat, lon, NTA_LATS, NTA_LONS, grid_lon, gap, gap)[1],
+                             grid_lat * grid_lon) for lat, lon, data in granules], repeat)
+
+    def stats():
+        grid_data = init_grid_data(VARNAMES, STS_SWITCH, INTERVALS_1D, INTERVALS_2D, HISTNAMES, grid_lat, grid_lon)
+        for lat, lon, data in granules:
+            partial = aggre_granule(lat, lon, dict(data), NTA_LATS, NTA_LONS, grid_lon, grid_lat, gap, gap,
+                                    STS_SWITCH, VARNAMES, INTERVALS_1D, INTERVALS_2D, VAR_IDX, HISTNAMES, hist_spec)
+            grid_data = merge_granule(grid_data, partial)
+        return grid_data
+    times['stats'], grid_data = best_time(stats, repeat)
+
+    out_fname = os.path.join(tmpdir, 'level3.h5')
+    nvar = len(VARNAMES)
+
+    def write():
+        final = finalize(grid_data, STS_SWITCH, VARNAMES, HISTNAMES, grid_lat, grid_lon)
+        write_level3(out_fname, final, STS_SWITCH, np.arange(-90, 90, gap), np.arange(-180, 180, gap),
+                     ['none'] * nvar, list(VARNAMES), [-9999] * nvar, [0.0001, 0.1, 0.01], [0.0] * nvar)
+    times['write'], _ = best_time(write, repeat)
+    times['output_bytes'] = os.path.getsize(out_fname)
+
+    times['cloud_fraction'], _ = best_time(
+        lambda: [aggregateOneFileData(f1, f2, gap, spl_num) for f1, f2 in zip(fname1, fname2)], repeat)
+
+    return times
+
+
+def git_commit():
+    # Commit of the benchmarked code, None outside of a git checkout
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file, threshold):
+    # Print the ratio of every timing to the baseline run, returns the number of regressions
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    reference = {(r['phase'], r['files'], r['gap'], r['spl_num'], tuple(r['shape'])): r['seconds']
+                 for r in baseline['results']}
+
+    regressions = 0
+    print("{:>15} {:>6} {:>6} {:>4} {:>10} {:>10} {:>7}".format('phase', 'files', 'gap', 'spl', 'baseline', 'now',
+                                                              'ratio'))
+    for r in results:
+        old = reference.get((r['phase'], r['files'], r['gap'], r['spl_num'], tuple(r['shape'])))
+        if old is None:
+            continue
+        ratio = r['seconds'] / old if old > 0 else np.inf
+        flag = ' REGRESSION' if ratio > 1 + threshold else ''
+        regressions += int(ratio > 1 + threshold)
+        print("{:>15} {:>6} {:>6} {:>4} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(
+            r['phase'], r['files'], r['gap'], r['spl_num'], old, r['seconds'], ratio, flag))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the MODIS aggregation phases on synthetic granules.')
+    parser.add_argument('--shape', default='2030,1354', help='pixels along,across track of every granule')
+    parser.add_argument('--files', default='1,4', help='comma separated numbers of granule pairs')
+    parser.add_argument('--gaps', default='1.0,0.5', help='comma separated grid sizes in degrees')
+    parser.add_argument('--spl', default='3,5', help='comma separated sampling rates')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every phase, the best one is kept')
+    parser.add_argument('--data-dir', default=None, help='keep the synthetic granules in this directory')
+    parser.add_argument('--output', default=None, help='JSON result file (benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', default=None, help='JSON result file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    shape = tuple(int(n) for n in args.shape.split(','))
+    file_counts = [int(n) for n in args.files.split(',')]
+    gaps = [float(g) for g in args.gaps.split(',')]
+    spl_nums = [int(n) for n in args.spl.split(',')]
+
+    tmpdir = tempfile.mkdtemp()
+    data_dir = args.data_dir if args.data_dir is not None else tmpdir
+    try:
+        # The granules are written once, the smaller file counts use the first ones
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        fname1, fname2 = write_synthetic_granules(data_dir, datetime(2008, 1, 1), max(file_counts), shape)
+
+        results = []
+        for files in file_counts:
+            for gap in gaps:
+                for spl_num in spl_nums:
+                    times = bench_case(fname1[:files], fname2[:files], gap, spl_num, args.repeat, tmpdir)
+                    output_bytes = times.pop('output_bytes')
+                    for phase, seconds in times.items():
+                        results.append({'phase': phase, 'files': files, 'gap': gap, 'spl_num': spl_num,
+                                        'shape': list(shape), 'seconds': seconds})
+                    print("files={} gap={} spl_num={}: {} (output {} bytes)".format(
+                        files, gap, spl_num, ' '.join('{}={:.4f}s'.format(k, v) for k, v in times.items()),
+                        output_bytes))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = {'meta': {'date': datetime.now().isoformat(), 'commit': git_commit(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'machine': platform.machine(), 'repeat': args.repeat},
+              'results': results}
+    output = args.output
+    if output is None:
+        results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        output = os.path.join(results_dir, datetime.now().strftime('%Y%m%dT%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(output + ' Saved!')
+
+    if args.compare is not None:
+        return 1 if compare(results, args.compare, args.threshold) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import os
 import sys
 import numpy as np
 import pandas as pd
@@ -61,7 +62,7 @@ if __name__ == '__main__':
             var_idx = text_file[:, 2]  # This is the index of the input variable name which is used for 2D histogram
             intervals_2d = text_file[:, 3]
         else:
-            intervals_2d, var_idx = [0], [0]
+            intervals_2d, var_idx, histnames = [0], [0], [0]
 
     # -------------STEP 1: Set up the specific directory --------
     data_path_file = np.array(pd.read_csv(sys.argv[1], header=0, delim_whitespace=True))
@@ -92,64 +93,73 @@ if __name__ == '__main__':
     grid_lon = np.int((NTA_lons[-1] - NTA_lons[0]) / gap_x)
     grid_lat = np.int((NTA_lats[-1] - NTA_lats[0]) / gap_y)
 
-    # --------------STEP 3: Create arrays for level-3 statistics data-------------------------
-    grid_data = {}
-    bin_num1 = np.zeros(len(varnames)).astype(np.int)
-    bin_num2 = np.zeros(len(varnames)).astype(np.int)
-    key_idx = 0
-    for key in varnames:
-        if sts_switch[0] == True:
-            grid_data[key + '_' + sts_name[0]] = np.zeros(grid_lat * grid_lon) + np.inf
-        if sts_switch[1] == True:
-            grid_data[key + '_' + sts_name[1]] = np.zeros(grid_lat * grid_lon) - np.inf
-        if (sts_switch[2] == True) | (sts_switch[3] == True) | (sts_switch[4] == True):
-            grid_data[key + '_' + sts_name[2]] = np.zeros(grid_lat * grid_lon)
-            grid_data[key + '_' + sts_name[3]] = np.zeros(grid_lat * grid_lon)
-            grid_data[key + '_' + sts_name[4]] = np.zeros(grid_lat * grid_lon)
-        if sts_switch[5] == True:
-            bin_interval1 = np.fromstring(intervals_1d[key_idx], dtype=np.float, sep=',')
-            bin_num1[key_idx] = bin_interval1.shape[0] - 1
-            grid_data[key + '_' + sts_name[5]] = np.zeros((grid_lat * grid_lon, bin_num1[key_idx]))
-
-            if sts_switch[6] == True:
-                bin_interval2 = np.fromstring(intervals_2d[key_idx], dtype=np.float, sep=',')
-                bin_num2[key_idx] = bin_interval2.shape[0] - 1
-                grid_data[key + '_' + sts_name[6] + histnames[key_idx]] = np.zeros(
-                    (grid_lat * grid_lon, bin_num1[key_idx], bin_num2[key_idx]))
-
-        key_idx += 1
-
-    # --------------STEP 4: Read the filename list for different time period-------------------
-    fname1, fname2 = [], []
-
+    # --------------STEP 3: Read the filename list for different time period-------------------
     start_date = np.fromstring(sys.argv[2], dtype=np.int, sep='/')
     end_date = np.fromstring(sys.argv[3], dtype=np.int, sep='/')
     start = date(start_date[0], start_date[1], start_date[2])
     until = date(end_date[0], end_date[1], end_date[2])
 
-    for dt in rrule(DAILY, interval=1, dtstart=start, until=until):
-        year = np.int(dt.strftime("%Y"))
-        month = np.int(dt.strftime("%m"))
-        day = np.int(dt.strftime("%d"))
-
-        data = datetime(year, month, day)
-        daynew = data.toordinal()
-        yearstart = datetime(year, 1, 1)
-        day_yearstart = yearstart.toordinal()
-        day_in_year = (daynew - day_yearstart) + 1
+    # Scan each product directory once and pair MYD06 with MYD03 by granule key (A2008001.0000)
+    fname1, fname2, unmatched = pair_granules(MYD06_dir, MYD06_prefix, MYD03_dir, MYD03_prefix, start, until, \
+                                              fileformat)
+    for product in unmatched:
+        if len(unmatched[product]) > 0:
+            print("Unmatched {} granules (skipped): {}".format(product, ' '.join(unmatched[product])))
 
-        yc = '%04i' % year
-        dc = '%03i' % day_in_year
-
-        fname_tmp1 = read_filelist(MYD06_dir, MYD06_prefix, yc, dc, fileformat)
-        fname_tmp2 = read_filelist(MYD03_dir, MYD03_prefix, yc, dc, fileformat)
-        fname1 = np.append(fname1, fname_tmp1)
-        fname2 = np.append(fname2, fname_tmp2)
+    year, month = until.year, until.month
     print(year, month)
 
     filenum = np.arange(len(fname1))
     print(len(fname1))
 
+    # Skip the granules lying entirely outside of the region before opening them when MODIS_GRANULE_INDEX names
+    # the index file of the MYD03 granules; it is built or updated (new files only) by rank 0
+    granule_index = None
+    if 'MODIS_GRANULE_INDEX' in os.environ:
+        comm = get_mpi_comm()
+        if (comm is None) or (comm.Get_rank() == 0):
+            granule_index = build_granule_index(fname2, os.environ['MODIS_GRANULE_INDEX'])
+        if (comm is not None) and (comm.Get_size() > 1):
+            granule_index = comm.bcast(granule_index, root=0)
+
+    # --------------STEP 4: Plan the memory and create arrays for level-3 statistics data------
+    # The moment accumulators (count, mean, M2) give a stable mean & standard deviation, mergeable across runs.
+    # When MODIS_MEMORY_BUDGET gives the memory of the node (in GiB), the run drops the prefetching or uses
+    # sparse accumulators to stay within it, and stops before reading anything when it cannot (or when
+    # MODIS_MEMORY_FALLBACK=0). MODIS_MEMORY_LOSSY=1 also lets it use the float32 'compact' accumulators.
+    # MODIS_ACCUMULATORS chooses the storage of the accumulators, e.g. 'sparse' for daily or regional runs whose
+    # histograms are mostly empty. The storage used is written in the 'accumulators' attribute of the products,
+    # with the pixels counted in their Pixel_Counts and in their Mean and Standard_Deviation (MOMENT_ATTRS).
+    memory_budget = float(os.environ['MODIS_MEMORY_BUDGET']) * 2 ** 30 if 'MODIS_MEMORY_BUDGET' in os.environ \
+        else None
+    # MODIS_PERIODS lists the periods written from the same pass over the granules, e.g. 'daily,monthly'
+    # ('daily', 'pentad', 'monthly', 'yearly' or a number of days, labelled D1, P5, M, Y or <n>D in the file
+    # names); one period of every kind is held at a time
+    periods = [int(p) if p.isdigit() else p for p in os.environ['MODIS_PERIODS'].split(',')] \
+        if 'MODIS_PERIODS' in os.environ else None
+    try:
+        labels = [period_label(kind) for kind in periods] if periods is not None else None
+    except ValueError as err:
+        print(err)
+        sys.exit()
+    if (memory_budget is not None) and (periods is not None):
+        memory_budget /= len(periods)
+    try:
+        plan = plan_run(varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, grid_lon, fname1, \
+                        fname2, spl_num, moments=True, strategy=os.environ.get('MODIS_ACCUMULATORS', 'dict'), \
+                        prefetch=2, granule_index=granule_index, NTA_lats=NTA_lats, NTA_lons=NTA_lons, \
+                        memory_budget=memory_budget, \
+                        fallback=os.environ.get('MODIS_MEMORY_FALLBACK', '1') != '0', \
+                        allow_lossy=os.environ.get('MODIS_MEMORY_LOSSY', '0') == '1')
+    except ValueError as err:
+        print(err)
+        sys.exit()
+    print(format_plan(plan))
+    # With MODIS_PERIODS, every period allocates its own accumulators (see STEP 6)
+    if periods is None:
+        grid_data = allocate_grid_data(plan, varnames, sts_switch, intervals_1d, intervals_2d, histnames, grid_lat, \
+                                       grid_lon, moments=True)
+
     # --------------STEP 5: Read Attributes of each variables----------------------------------
     unit_list = []
     scale_list = []
@@ -166,7 +176,7 @@ if __name__ == '__main__':
             name_idx = tmp_idx
             continue  # Ignoreing Cloud_Fraction from the input file
         else:
-            tmp_data, lonam, unit, fill, scale, offst = readEntry(key, ncfile)
+            tmp_data, lonam, unit, fill, scale, offst = readEntry(key, ncfile, spl_num)
             unit_list = np.append(unit_list, unit)
             scale_list = np.append(scale_list, scale)
             offst_list = np.append(offst_list, offst)
@@ -188,52 +198,91 @@ if __name__ == '__main__':
 
     ncfile.close()
 
+    # Configuration saved with the unfinalized accumulators
+    config = {'varnames': varnames, 'sts_switch': sts_switch, 'intervals_1d': intervals_1d,
+              'intervals_2d': intervals_2d, 'histnames': histnames, 'var_idx': var_idx,
+              'NTA_lats': NTA_lats, 'NTA_lons': NTA_lons, 'gap_x': gap_x, 'gap_y': gap_y, 'grid_lat': grid_lat,
+              'grid_lon': grid_lon, 'spl_num': spl_num,
+              'unit_list': unit_list, 'longname_list': longname_list, 'fillvalue_list': fillvalue_list,
+              'scale_list': scale_list, 'offst_list': offst_list,
+              'start': start.isoformat(), 'end': until.isoformat(), 'granules': len(fname1)}
+
     # --------------STEP 6: Start Aggregation------------------------------------------------
 
-    # Start counting operation time
+    # Start counting operation time, the timers and counters of every phase are saved with the output
     start_time = timeit.default_timer()
+    profile = enable_profile()
+
+    # Checkpoint the accumulators while running, a rerun of an interrupted job resumes from the checkpoint
+    # (it is removed once the HDF5 output is saved)
+    checkpoint_file = 'MYD08_D3' + 'A{:04d}{:02d}'.format(year, month) + '_checkpoint.npz'
+
+    # Reuse the grid index of the MYD03 granules from earlier runs when MODIS_INDEX_CACHE names a cache directory
+    index_cache = GridIndexCache(os.environ['MODIS_INDEX_CACHE']) if 'MODIS_INDEX_CACHE' in os.environ else None
+    # and read the granules preprocessed by modis_preprocess.py when MODIS_GRANULE_CACHE names their directory
+    granule_cache = GranuleCache(os.environ['MODIS_GRANULE_CACHE']) if 'MODIS_GRANULE_CACHE' in os.environ else None
+    # MODIS_ENGINE=fused aggregates with the compiled per-pixel kernel when numba is installed
+    engine = os.environ.get('MODIS_ENGINE', 'vectorized')
+
+    # Split the files across the ranks when launched with "mpirun -n <N>", only rank 0 writes the output
+    comm = get_mpi_comm()
+    if periods is not None:
+        if (comm is not None) and (comm.Get_size() > 1):
+            print("MODIS_PERIODS runs on a single rank")
+            sys.exit()
+
+        def write_period(period):
+            # Keep the accumulators of a complete period, and write its finalized statistics
+            name = 'MYD08_{}_A{}_A{}'.format(labels[periods.index(period.kind)], period.start.strftime('%Y%j'), \
+                                             period.end.strftime('%Y%j'))
+            save_accumulators(name + '_accumulators.h5', period.grid_data,
+                              dict(config, start=period.start.isoformat(), end=period.end.isoformat(),
+                                   granules=len(period.processed)))
+            final = finalize(period.grid_data, sts_switch, varnames, histnames, grid_lat, grid_lon)
+            write_level3(name + '_baseline_v9_5.h5', final, sts_switch, map_lat, map_lon, unit_list, longname_list, \
+                         fillvalue_list, scale_list, offst_list, attrs=dict(MOMENT_ATTRS, accumulators=plan.strategy))
+            print(name + '_baseline_v9_5.h5 Saved!')
+
+        # The accumulators planned above are allocated for every period, and released once it is written
+        run_modis_aggre_periods(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, filenum, \
+                                periods, lambda: allocate_grid_data(plan, varnames, sts_switch, intervals_1d, \
+                                                                    intervals_2d, histnames, grid_lat, grid_lon, \
+                                                                    moments=True), \
+                                write_period, sts_switch, varnames, intervals_1d, intervals_2d, var_idx, \
+                                histnames=histnames, spl_num=spl_num, granule_index=granule_index, \
+                                index_cache=index_cache, prefetch=plan.prefetch, granule_cache=granule_cache, \
+                                engine=engine)
+        print("Operation Time in {:7.2f} seconds".format(timeit.default_timer() - start_time))
+        profile.save('MYD08_A{}_A{}_profile.json'.format(start.strftime('%Y%j'), until.strftime('%Y%j')))
+        sys.exit()
 
-    grid_data = run_modis_aggre(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, filenum, \
-                                grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx)
-
-    # Compute the mean cloud fraction & Statistics (Include Min & Max & Standard deviation)
-
-    # Reference for statstic parameters
-    # sts_name[0]: min
-    # sts_name[1]: max
-    # sts_name[2]: mean / total_value
-    # sts_name[3]: count
-    # sts_name[4]: square
-    # sts_name[5]: histogram
-    # sts_name[6]: joint histogram
-
+    if (comm is not None) and (comm.Get_size() > 1):
+        grid_data = run_modis_aggre_mpi(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, \
+                                        filenum, grid_data, sts_switch, varnames, intervals_1d, intervals_2d, \
+                                        var_idx, histnames=histnames, spl_num=spl_num, \
+                                        granule_index=granule_index, comm=comm, \
+                                        checkpoint_file=checkpoint_file, index_cache=index_cache, \
+                                        granule_cache=granule_cache, engine=engine)
+        checkpoint_files = ['{}.rank{}'.format(checkpoint_file, rank) for rank in range(comm.Get_size())]
+        if comm.Get_rank() != 0:
+            sys.exit()
+    else:
+        grid_data = run_modis_aggre(fname1, fname2, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y, filenum, \
+                                    grid_data, sts_switch, varnames, intervals_1d, intervals_2d, var_idx, \
+                                    histnames=histnames, spl_num=spl_num, granule_index=granule_index, \
+                                    checkpoint_file=checkpoint_file, index_cache=index_cache, \
+                                    prefetch=plan.prefetch, granule_cache=granule_cache, engine=engine)
+        checkpoint_files = [checkpoint_file]
+
+    # Keep the unfinalized accumulators, so longer periods can be merged from them (see examples/modis_rollup.py)
+    accumulator_file = 'MYD08_A{}_A{}_accumulators.h5'.format(start.strftime('%Y%j'), until.strftime('%Y%j'))
+    save_accumulators(accumulator_file, grid_data, config)
+
+    # Compute the mean cloud fraction & Statistics (Include Min & Max & Standard deviation),
+    # grid_data itself is left unfinalized
     sts_idx = np.array(np.where(sts_switch == True))[0]
     print("Index of User-defined Statistics:", sts_idx)
-    key_idx = 0
-    for key in varnames:
-        for i in sts_idx:
-            if i == 0:
-                grid_data[key + '_' + sts_name[0]] = grid_data[key + '_' + sts_name[0]].reshape([grid_lat, grid_lon])
-            elif i == 1:
-                grid_data[key + '_' + sts_name[1]] = grid_data[key + '_' + sts_name[1]].reshape([grid_lat, grid_lon])
-            elif i == 2:
-                grid_data[key + '_' + sts_name[2]] = (
-                        grid_data[key + '_' + sts_name[2]] / grid_data[key + '_' + sts_name[3]])
-                grid_data[key + '_' + sts_name[2]] = grid_data[key + '_' + sts_name[2]].reshape([grid_lat, grid_lon])
-            elif i == 3:
-                grid_data[key + '_' + sts_name[3]] = grid_data[key + '_' + sts_name[3]].reshape([grid_lat, grid_lon])
-            elif i == 4:
-                grid_data[key + '_' + sts_name[4]] = ((grid_data[key + '_' + sts_name[4]] / grid_data[
-                    key + '_' + sts_name[3]].ravel()) - grid_data[key + '_' + sts_name[2]].ravel() ** 2) ** 0.5
-                grid_data[key + '_' + sts_name[4]] = grid_data[key + '_' + sts_name[4]].reshape([grid_lat, grid_lon])
-            elif i == 5:
-                grid_data[key + '_' + sts_name[5]] = grid_data[key + '_' + sts_name[5]].reshape(
-                    [grid_lat, grid_lon, bin_num1[key_idx]])
-            elif i == 6:
-                grid_data[key + '_' + sts_name[6] + histnames[key_idx]] = grid_data[
-                    key + '_' + sts_name[6] + histnames[key_idx]].reshape(
-                    [grid_lat, grid_lon, bin_num1[key_idx], bin_num2[key_idx]])
-        key_idx += 1
+    final = finalize(grid_data, sts_switch, varnames, histnames, grid_lat, grid_lon)
 
     end_time = timeit.default_timer()
 
@@ -245,33 +294,25 @@ if __name__ == '__main__':
     # --------------STEP 7:  Create HDF5 file to store the result------------------------------
     l3name = 'MYD08_D3' + 'A{:04d}{:02d}'.format(year, month)
     subname = '_baseline_daily_v9_5.h5'
-    ff = h5py.File(l3name + subname, 'w')
-
-    PC = ff.create_dataset('lat_bnd', data=map_lat)
-    PC.attrs['units'] = 'degrees'
-    PC.attrs['long_name'] = 'Latitude_boundaries'
-
-    PC = ff.create_dataset('lon_bnd', data=map_lon)
-    PC.attrs['units'] = 'degrees'
-    PC.attrs['long_name'] = 'Longitude_boundaries'
-
-    for i in range(sts_idx.shape[0]):
-        cnt = 0
-        for key in grid_data:
-
-            if key.find("1km") != -1:
-                new_name = key.replace("_1km", "")
-            else:
-                new_name = key
-
-            if (sts_name[sts_idx[i]] in key) == True:
-                # print(sts_name[sts_idx[i]],key,grid_data[key].shape)
-                # print(longname_list[cnt][:20],new_name)
-                addGridEntry(ff, new_name, unit_list[cnt], longname_list[cnt], fillvalue_list[cnt], scale_list[cnt],
-                             offst_list[cnt], grid_data[key])
-                cnt += 1
-
-    ff.close()
+    write_level3(l3name + subname, final, sts_switch, map_lat, map_lon, unit_list, longname_list, fillvalue_list, \
+                 scale_list, offst_list, attrs=dict(MOMENT_ATTRS, accumulators=plan.strategy))
 
     print(l3name + subname + ' Saved!')
+
+    # Coarser grids combined from the same accumulators when MODIS_PYRAMID lists their factors (e.g. 2,4,20)
+    if 'MODIS_PYRAMID' in os.environ:
+        factors = [int(f) for f in os.environ['MODIS_PYRAMID'].split(',')]
+        fnames = {f: l3name + '_{:g}x{:g}deg'.format(gap_y * f, gap_x * f) + subname for f in factors}
+        write_pyramid(fnames, grid_data, sts_switch, varnames, histnames, grid_lat, grid_lon, map_lat, map_lon, \
+                      unit_list, longname_list, fillvalue_list, scale_list, offst_list, \
+                      attrs=dict(MOMENT_ATTRS, accumulators=plan.strategy))
+        for f in factors:
+            print(fnames[f] + ' Saved!')
+
+    profile.save(l3name + '_profile.json')
+    print(l3name + '_profile.json Saved!')
+
+    for fname in checkpoint_files:
+        if os.path.exists(fname):
+            os.remove(fname)
 # ---------------------------COMPLETED------------------------------------------------------
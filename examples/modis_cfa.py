@@ -1,3 +1,4 @@
+import os
 import time
 import glob
 import xarray as xr
@@ -10,8 +11,17 @@ if __name__ == '__main__':
     M03_files = sorted(glob.glob(M03_dir + "MYD03.A2008*"))
     M06_files = sorted(glob.glob(M06_dir + "MYD06_L2.A2008*"))
     t0 = time.time()
+    # MODIS_REGION (lat_min,lat_max,lon_min,lon_max) with MODIS_GRANULE_INDEX (index file of the MYD03 granules)
+    # skips the granules lying entirely outside of the region before opening them
+    granule_index, NTA_lats, NTA_lons = None, None, None
+    if 'MODIS_REGION' in os.environ:
+        region = [float(v) for v in os.environ['MODIS_REGION'].split(',')]
+        NTA_lats, NTA_lons = region[:2], region[2:]
+        if 'MODIS_GRANULE_INDEX' in os.environ:
+            granule_index = build_granule_index(M03_files, os.environ['MODIS_GRANULE_INDEX'])
     # calculate cloud fraction
-    cf = calculateCloudFraction(M03_files, M06_files)
+    cf = calculateCloudFraction(M03_files, M06_files, granule_index=granule_index, NTA_lats=NTA_lats,
+                                NTA_lons=NTA_lons)
     # calculate execution time
     t1 = time.time()
     total = t1 - t0
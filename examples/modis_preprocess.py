@@ -0,0 +1,24 @@
+import sys
+from datetime import datetime
+from MODIS_Aggregation import *
+
+if __name__ == '__main__':
+    # Convert the MYD06 / MYD03 granule pairs of a period into a granule cache, once; modis_bs.py then reads
+    # them from the cache when MODIS_GRANULE_CACHE names its directory (with the same sampling number)
+    if len(sys.argv) < 8:
+        print("Wrong user input")
+        print("usage: python modis_preprocess.py <Cache Directory> <MYD06 Directory> <MYD03 Directory> "
+              "<Start Date YYYY/MM/DD> <End Date YYYY/MM/DD> <Sampling number> <Variable,Variable,...> [<Workers>]")
+        sys.exit()
+
+    start = datetime.strptime(sys.argv[4], '%Y/%m/%d').date()
+    until = datetime.strptime(sys.argv[5], '%Y/%m/%d').date()
+    spl_num = int(sys.argv[6])
+    varnames = sys.argv[7].split(',')
+    workers = int(sys.argv[8]) if len(sys.argv) > 8 else None
+
+    fname1, fname2, unmatched = pair_granules(sys.argv[2], 'MYD06_L2.A', sys.argv[3], 'MYD03.A', start, until)
+    cache = GranuleCache(sys.argv[1])
+    written = preprocess_granules(cache, fname1, fname2, varnames, spl_num, workers)
+    print("{} of {} granule pairs preprocessed, cache size {:.1f} MB".format(written, len(fname1),
+                                                                            cache.nbytes() / 1e6))
@@ -0,0 +1,15 @@
+import sys
+from MODIS_Aggregation import *
+
+if __name__ == '__main__':
+    # Merge the unfinalized accumulators saved by modis_bs.py (e.g. the daily files of a month or the
+    # monthly files of a year) into one level-3 product, without reading the level-2 granules again
+    if len(sys.argv) < 3:
+        print("Wrong user input")
+        print("usage: python modis_rollup.py <Output HDF5 File> <Accumulator File> [<Accumulator File> ...]")
+        sys.exit()
+
+    config = rollup_product(sys.argv[2:], sys.argv[1])
+    print("{} to {} ({} granules, {} files) merged".format(config['start'], config['end'], config['granules'],
+                                                            len(sys.argv) - 2))
+    print(sys.argv[1] + ' Saved!')
@@ -0,0 +1,84 @@
+# Fixtures shared by the tests: small synthetic granules and an aggregation run over them
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from netCDF4 import Dataset
+
+
+def write_granule_pair(directory, idx, shape=(120, 90)):
+    # Write a small MYD06-like file with scaled variables and its MYD03-like geolocation file
+    rng = np.random.RandomState(idx)
+    m06 = os.path.join(directory, 'MYD06_L2.A2008001.{:04d}.nc'.format(idx))
+    m03 = os.path.join(directory, 'MYD03.A2008001.{:04d}.nc'.format(idx))
+
+    with Dataset(m06, 'w') as nc:
+        nc.createDimension('Cell_Along_Swath_1km', shape[0])
+        nc.createDimension('Cell_Across_Swath_1km', shape[1])
+        nc.createDimension('Byte_Segment', 2)
+        dims = ('Cell_Along_Swath_1km', 'Cell_Across_Swath_1km')
+        cm = nc.createVariable('Cloud_Mask_1km', 'i1', dims + ('Byte_Segment',))
+        cm[:] = rng.randint(-128, 128, shape + (2,))
+        for name, scale, offset, low, high in [('Cloud_Top_Pressure', 0.1, 0.0, 1000, 10000),
+                                               ('Cloud_Optical_Thickness', 0.01, 0.0, 0, 10000)]:
+            var = nc.createVariable(name, 'i2', dims, fill_value=-9999)
+            var.set_auto_maskandscale(False)
+            var.units = 'none'
+            var.long_name = name
+            var.scale_factor = scale
+            var.add_offset = offset
+            packed = rng.randint(low, high, shape).astype(np.int16)
+            packed[rng.rand(*shape) < 0.2] = -9999
+            var[:] = packed
+
+    with Dataset(m03, 'w') as nc:
+        nc.createDimension('nscans', shape[0])
+        nc.createDimension('mframes', shape[1])
+        for name, low, high in [('Latitude', -10, 10), ('Longitude', 20, 40)]:
+            var = nc.createVariable(name, 'f4', ('nscans', 'mframes'), fill_value=-999.0)
+            values = rng.uniform(low, high, shape).astype(np.float32)
+            values[:2, :4] = -999.0
+            var.set_auto_maskandscale(False)
+            var[:] = values
+
+    return m06, m03
+
+
+def make_granule(seed, shape=(60, 40)):
+    # Synthetic sampled granule: lat/lon, cloud mask categories and two variables with fill values
+    rng = np.random.RandomState(seed)
+    lat = rng.uniform(-8, 8, shape)
+    lon = rng.uniform(22, 38, shape)
+    data = {'CM': rng.randint(0, 4, shape).astype(float)}
+    data['Cloud_Top_Pressure'] = rng.uniform(100, 1000, shape)
+    data['Cloud_Top_Pressure'][rng.rand(*shape) < 0.2] = np.nan
+    data['Cloud_Optical_Thickness'] = rng.uniform(0, 50, shape)
+    data['Cloud_Optical_Thickness'][rng.rand(*shape) < 0.3] = np.nan
+    lat[0, :5] = np.nan
+    return lat, lon, data
+
+
+class GranuleRunTest(unittest.TestCase):
+    # Writes the granule pairs 0 .. granules - 1 in a temporary directory, with the statistics of
+    # all the variables on a grid_lat x grid_lon grid (the arguments of init_grid_data in args)
+    granules = 3
+    grid_lat, grid_lon = 20, 20
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        pairs = [write_granule_pair(self.tmpdir, i) for i in range(self.granules)]
+        self.fname1 = np.array([p[0] for p in pairs])
+        self.fname2 = np.array([p[1] for p in pairs])
+        self.varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+        self.sts_switch = np.ones(7, dtype=bool)
+        self.intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50,100'])
+        self.intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        self.histnames = np.array(['_COT', '_COT', '_CTP'])
+        self.var_idx = np.array([2, 2, 1])
+        self.args = (self.varnames, self.sts_switch, self.intervals_1d, self.intervals_2d, self.histnames,
+                     self.grid_lat, self.grid_lon)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
@@ -1,5 +1,7 @@
 import unittest
+import numpy as np
 from MODIS_Aggregation import getInputDirectories
+from MODIS_Aggregation import countCloudPixels
 from MODIS_Aggregation import aggregateOneFileData
 from MODIS_Aggregation import displayOutput
 
@@ -10,6 +12,39 @@ class getFilePathTest(unittest.TestCase):
         self.assertIsNotNone(x)
         self.assertIsNotNone(y)
 
+class CountCloudPixelsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.lat = rng.uniform(-90, 90, (60, 45)).astype(np.float32)
+        self.lon = rng.uniform(-180, 180, (60, 45)).astype(np.float32)
+        self.lat[0, :3] = -999.0
+        self.cm = rng.randint(0, 4, (60, 45))
+
+    def test_matches_pixel_loop(self):
+        # Reference: the per-pixel loop of the 1 degree aggregation
+        total_ref = np.zeros((180, 360))
+        cloud_ref = np.zeros((180, 360))
+        lat = (self.lat.ravel() + 89.5).astype(int)
+        lon = (self.lon.ravel() + 179.5).astype(int)
+        lat = np.where(lat > -1, lat, 0)
+        lon = np.where(lon > -1, lon, 0)
+        for i, j in zip(lat, lon):
+            total_ref[i, j] += 1
+        for k in np.nonzero(self.cm.ravel() == 0)[0]:
+            cloud_ref[lat[k], lon[k]] += 1
+
+        cloud_pix, total_pix = countCloudPixels(self.cm, self.lat, self.lon)
+        np.testing.assert_array_equal(cloud_pix, cloud_ref)
+        np.testing.assert_array_equal(total_pix, total_ref)
+
+    def test_grid_resolution(self):
+        cloud_pix, total_pix = countCloudPixels(self.cm, self.lat, self.lon, grid_res=0.5)
+        self.assertEqual(total_pix.shape, (360, 720))
+        self.assertEqual(total_pix.sum(), self.cm.size)
+        self.assertEqual(cloud_pix.sum(), np.sum(self.cm == 0))
+
+
 class TruthTest(unittest.TestCase):
 
     def test_assert_true(self):
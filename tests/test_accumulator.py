@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from MODIS_Aggregation import GridAccumulator, init_grid_data, aggre_granule, merge_granule
+from tests.helpers import make_granule
+
+
+class GridAccumulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+        self.intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50'])
+        self.intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        self.histnames = np.array(['_Cloud_Optical_Thickness', '_Cloud_Optical_Thickness', '_Cloud_Top_Pressure'])
+        self.var_idx = np.array([2, 2, 1])
+        self.sts_switch = np.ones(7, dtype=bool)
+        self.args = (self.varnames, self.sts_switch, self.intervals_1d, self.intervals_2d, self.histnames, 10, 10)
+
+    def test_layout(self):
+        grid_data = init_grid_data(*self.args)
+        accumulator = GridAccumulator(*self.args, count_dtype=np.int32)
+        self.assertEqual(list(accumulator), list(grid_data))
+        for key in grid_data:
+            self.assertEqual(accumulator[key].shape, grid_data[key].shape)
+            np.testing.assert_array_equal(accumulator[key], grid_data[key])
+            self.assertTrue(any(np.shares_memory(accumulator[key], block) for block in accumulator.blocks.values()))
+        self.assertEqual(accumulator['Cloud_Top_Pressure_Pixel_Counts'].dtype, np.int32)
+        self.assertTrue(accumulator.nbytes < sum(v.nbytes for v in grid_data.values()))
+        self.assertEqual(list(accumulator.to_grid_data()), list(grid_data))
+
+    def test_merge_matches_dict(self):
+        NTA_lats, NTA_lons = [-5, 5], [25, 35]
+        grid_data = init_grid_data(*self.args)
+        accumulator = GridAccumulator(*self.args, count_dtype=np.int32)
+        for seed in range(3):
+            lat, lon, data = make_granule(seed)
+            partial = aggre_granule(lat, lon, data, NTA_lats, NTA_lons, 10, 10, 1.0, 1.0, self.sts_switch,
+                                    self.varnames, self.intervals_1d, self.intervals_2d, self.var_idx, self.histnames)
+            grid_data = merge_granule(grid_data, partial)
+            accumulator = merge_granule(accumulator, partial)
+
+        for key in grid_data:
+            np.testing.assert_array_equal(accumulator[key], grid_data[key], err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
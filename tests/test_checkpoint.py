@@ -0,0 +1,102 @@
+import os
+import shutil
+import unittest
+import numpy as np
+from unittest import mock
+from MODIS_Aggregation import baseline_series
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, GridAccumulator, load_checkpoint
+from tests.helpers import GranuleRunTest
+
+
+class CheckpointTest(GranuleRunTest):
+    granules = 4
+
+    def run_aggre(self, hdfs, grid_data, fname1=None, NTA_lats=[-5, 5], spl_num=2, **kwargs):
+        fname1 = self.fname1 if fname1 is None else fname1
+        return run_modis_aggre(fname1, self.fname2, NTA_lats, [25, 35], 20, 20, 0.5, 0.5, hdfs, grid_data,
+                               self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d, self.var_idx,
+                               histnames=self.histnames, spl_num=spl_num, **kwargs)
+
+    def test_resume_matches_full_run(self):
+        full = self.run_aggre(np.arange(4), init_grid_data(*self.args))
+
+        checkpoint_file = os.path.join(self.tmpdir, 'run.npz')
+        self.run_aggre(np.arange(2), init_grid_data(*self.args), checkpoint_file=checkpoint_file, checkpoint_every=1)
+        processed, failed = load_checkpoint(checkpoint_file, init_grid_data(*self.args))
+        self.assertEqual(processed, [os.path.basename(f) for f in self.fname1[:2]])
+
+        for grid_data in [init_grid_data(*self.args), GridAccumulator(*self.args)]:
+            shutil.copy(checkpoint_file, checkpoint_file + '.copy')
+            resumed = self.run_aggre(np.arange(4), grid_data, checkpoint_file=checkpoint_file + '.copy')
+            for key in full:
+                np.testing.assert_array_equal(resumed[key], full[key], err_msg=key)
+
+    def test_failing_granule_is_skipped(self):
+        fname1 = self.fname1.copy()
+        fname1[1] = os.path.join(self.tmpdir, 'MYD06_L2.A2008001.0099.nc')
+        with open(fname1[1], 'w') as f:
+            f.write('corrupt')
+
+        expected = self.run_aggre(np.array([0, 2, 3]), init_grid_data(*self.args))
+        checkpoint_file = os.path.join(self.tmpdir, 'run.npz')
+        for workers in [None, 2]:
+            grid_data = self.run_aggre(np.arange(4), init_grid_data(*self.args), fname1=fname1, workers=workers,
+                                       checkpoint_file=checkpoint_file)
+            for key in expected:
+                np.testing.assert_array_equal(grid_data[key], expected[key], err_msg=key)
+
+            processed, failed = load_checkpoint(checkpoint_file, init_grid_data(*self.args))
+            self.assertEqual(len(processed), 3)
+            self.assertEqual(list(failed), [os.path.basename(fname1[1])])
+            os.remove(checkpoint_file)
+
+    def test_checkpoint_of_other_run_is_refused(self):
+        checkpoint_file = os.path.join(self.tmpdir, 'run.npz')
+        self.run_aggre(np.arange(1), init_grid_data(*self.args), checkpoint_file=checkpoint_file)
+        other = init_grid_data(self.varnames[:2], self.sts_switch, self.intervals_1d, self.intervals_2d,
+                               self.histnames, 20, 20)
+        with self.assertRaises(ValueError):
+            load_checkpoint(checkpoint_file, other)
+
+        # Same statistics on another region or with another sampling rate
+        for kwargs in [{'NTA_lats': [-4, 5]}, {'spl_num': 1}]:
+            with self.assertRaises(ValueError):
+                self.run_aggre(np.arange(2), init_grid_data(*self.args), checkpoint_file=checkpoint_file, **kwargs)
+
+    def test_retried_granule_is_not_failed(self):
+        os.rename(self.fname1[1], self.fname1[1] + '.away')
+        checkpoint_file = os.path.join(self.tmpdir, 'run.npz')
+        self.run_aggre(np.arange(4), init_grid_data(*self.args), checkpoint_file=checkpoint_file)
+        self.assertEqual(len(load_checkpoint(checkpoint_file, init_grid_data(*self.args))[1]), 1)
+
+        # The granule is back: the resumed run aggregates it and forgets its failure
+        os.rename(self.fname1[1] + '.away', self.fname1[1])
+        for engine in ['vectorized', 'legacy']:
+            shutil.copy(checkpoint_file, checkpoint_file + '.copy')
+            self.run_aggre(np.arange(4), init_grid_data(*self.args), checkpoint_file=checkpoint_file + '.copy',
+                           engine=engine)
+            processed, failed = load_checkpoint(checkpoint_file + '.copy', init_grid_data(*self.args))
+            self.assertEqual(len(processed), 4)
+            self.assertEqual(len(failed), 0)
+
+    def test_failing_legacy_granule_leaves_grid_data(self):
+        # The aggregation of the second granule fails after its read: it is skipped, nothing of it is merged
+        expected = self.run_aggre(np.array([0, 2]), init_grid_data(*self.args), engine='legacy')
+        legacy = baseline_series.aggre_granule_legacy
+        calls = []
+
+        def failing(*args):
+            calls.append(None)
+            grid_data = legacy(*args)
+            if len(calls) == 2:
+                raise RuntimeError('aggregation failed')
+            return grid_data
+
+        with mock.patch.object(baseline_series, 'aggre_granule_legacy', failing):
+            grid_data = self.run_aggre(np.arange(3), init_grid_data(*self.args), engine='legacy')
+        for key in expected:
+            np.testing.assert_array_equal(grid_data[key], expected[key], err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import xarray as xr
+from unittest import mock
+from datetime import datetime
+from MODIS_Aggregation import aggregateOneFileData, calculateCloudMaskFractions, decode_cloud_mask, \
+    count_cloud_mask, read_MODIS
+from MODIS_Aggregation import cloud_fraction_aggregate
+from MODIS_Aggregation.cloud_mask import CM_FIELDS, mask_bytes, surface_fractions
+from MODIS_Aggregation.synthetic import write_synthetic_granules
+
+
+class CloudMaskTest(unittest.TestCase):
+
+    def test_lookup_tables_match_bit_fields(self):
+        raw = np.arange(-128, 128, dtype=np.int8).reshape(16, 16)
+        fields, valid = decode_cloud_mask(raw)
+        byte = np.array(raw, dtype='byte')
+        np.testing.assert_array_equal(fields['cloudiness'], (byte & 0b00000110) >> 1)
+        np.testing.assert_array_equal(valid, (byte & 1) == 1)
+        for name, shift, bits in CM_FIELDS[1:]:
+            self.assertEqual(fields[name].dtype, np.uint8)
+            np.testing.assert_array_equal(fields[name], (raw.view(np.uint8) >> shift) & ((1 << bits) - 1))
+
+        # Fill values masked to NaN by xarray decode as not determined
+        np.testing.assert_array_equal(mask_bytes(np.array([np.nan, -1.0, 5.0])), [0, 255, 5])
+
+    def test_counts_in_one_pass(self):
+        rng = np.random.RandomState(0)
+        raw = rng.randint(-128, 128, 5000).astype(np.int8)
+        grid_idx = rng.randint(-1, 12, 5000)
+        counts = count_cloud_mask(raw, grid_idx, 10)
+        self.assertEqual(counts.shape, (10, 4, 4))
+
+        fields, valid = decode_cloud_mask(raw)
+        expected = np.zeros((10, 4, 4), dtype=np.int64)
+        for cell, cat, surface, ok in zip(grid_idx, fields['cloudiness'], fields['surface'], valid):
+            if ok and (0 <= cell < 10):
+                expected[cell, cat, surface] += 1
+        np.testing.assert_array_equal(counts, expected)
+        self.assertEqual(count_cloud_mask(raw, grid_idx, 10, valid_only=False).sum(),
+                         np.sum((grid_idx >= 0) & (grid_idx < 10)))
+
+        fractions = surface_fractions(counts)
+        occupied = counts.sum(axis=1) > 0
+        np.testing.assert_allclose(fractions.sum(axis=2)[occupied], 1.0)
+
+
+class CloudMaskFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname1, self.fname2 = write_synthetic_granules(self.tmpdir, datetime(2008, 1, 1, 0, 0), 2, (203, 136))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_modis_cloudiness_is_compact(self):
+        lat, lon, data = read_MODIS(np.array(['cloud_fraction']), self.fname1[0], self.fname2[0], 3)
+        self.assertEqual(data['CM'].dtype, np.uint8)
+
+    def test_fractions_match_cloud_fraction(self):
+        category, surface = calculateCloudMaskFractions(self.fname2, self.fname1, 1.0, 3, workers=2)
+        self.assertEqual(category.shape, (180, 360, 4))
+        self.assertEqual(surface.shape, (180, 360, 4, 4))
+
+        cloud_pix, total_pix = np.zeros((180, 360)), np.zeros((180, 360))
+        for f06, f03 in zip(self.fname1, self.fname2):
+            cloud, total = aggregateOneFileData(f06, f03, 1.0, 3)
+            cloud_pix += cloud
+            total_pix += total
+
+        # Every synthetic pixel is determined, so the confident cloudy fraction is the cloud fraction
+        occupied = total_pix > 0
+        np.testing.assert_allclose(category[occupied, 0], cloud_pix[occupied] / total_pix[occupied])
+        np.testing.assert_allclose(category[occupied].sum(axis=1), 1.0)
+        self.assertTrue(np.all(np.isnan(category[~occupied])))
+
+    def test_files_opened_once(self):
+        # The eager reader opens the MYD06 and the MYD03 file once each
+        with mock.patch.object(cloud_fraction_aggregate.xr, 'open_dataset', wraps=xr.open_dataset) as opened:
+            cm, lat, lon = cloud_fraction_aggregate.readOneFile(self.fname1[0], self.fname2[0], 3)
+        self.assertEqual(sorted(call[0][0] for call in opened.call_args_list),
+                         sorted([self.fname1[0], self.fname2[0]]))
+        self.assertEqual(cm.shape, lat.shape)
+        self.assertEqual(lat.shape, lon.shape)
+
+    def test_mask_files_closed(self):
+        # The one-pass counter closes the MYD06 and the MYD03 dataset it opens
+        with mock.patch.object(xr.Dataset, 'close', autospec=True, side_effect=xr.Dataset.close) as closed:
+            cloud_fraction_aggregate.aggregateOneFileMask(self.fname1[0], self.fname2[0], 1.0, 3)
+        self.assertEqual(closed.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from MODIS_Aggregation import granule_key, scan_granules, pair_granules
+
+
+class FileDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dir06 = os.path.join(self.tmpdir, 'MYD06_L2')
+        self.dir03 = os.path.join(self.tmpdir, 'MYD03')
+        os.mkdir(self.dir06)
+        os.mkdir(self.dir03)
+        for key in ['A2008001.0000', 'A2008001.0005', 'A2008002.0010', 'A2008003.0000']:
+            self.touch(self.dir06, 'MYD06_L2.{}.061.2018029023000.hdf'.format(key))
+        for key in ['A2008001.0000', 'A2008002.0010', 'A2008002.0015', 'A2008003.0000']:
+            self.touch(self.dir03, 'MYD03.{}.061.2018028234531.hdf'.format(key))
+        self.touch(self.dir03, 'MYD03.A2008001.0000.061.2018028234531.hdf.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, directory, name):
+        open(os.path.join(directory, name), 'w').close()
+
+    def test_granule_key(self):
+        self.assertEqual(granule_key('/data/MYD03.A2008001.0005.061.2018028234531.hdf'), 'A2008001.0005')
+        self.assertIsNone(granule_key('MYD03.hdf'))
+
+    def test_pair_by_key(self):
+        fname1, fname2, unmatched = pair_granules(self.dir06, 'MYD06_L2.A', self.dir03, 'MYD03.A',
+                                                  date(2008, 1, 1), date(2008, 1, 2))
+        self.assertEqual([granule_key(f) for f in fname1], ['A2008001.0000', 'A2008002.0010'])
+        self.assertEqual([granule_key(f) for f in fname2], ['A2008001.0000', 'A2008002.0010'])
+        self.assertTrue(fname2[0].startswith(self.dir03))
+        self.assertEqual(unmatched, {'MYD06': ['A2008001.0005'], 'MYD03': ['A2008002.0015']})
+
+        fname1, fname2, unmatched = pair_granules(self.dir06, 'MYD06_L2.A', self.dir03, 'MYD03.A')
+        self.assertEqual(len(fname1), 3)
+
+    def test_cached_listing(self):
+        cache_file = os.path.join(self.tmpdir, 'listing.json')
+        self.assertEqual(len(scan_granules(self.dir03, 'MYD03.A', cache_file=cache_file)), 4)
+        with open(cache_file) as f:
+            self.assertIn(os.path.abspath(self.dir03), json.load(f))
+
+        self.touch(self.dir03, 'MYD03.A2008004.0000.061.2018028234531.hdf')
+        os.utime(self.dir03, ns=(0, os.stat(self.dir03).st_mtime_ns + 10 ** 9))
+        self.assertEqual(len(scan_granules(self.dir03, 'MYD03.A', cache_file=cache_file)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
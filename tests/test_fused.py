@@ -0,0 +1,112 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from MODIS_Aggregation import fused_aggre_granule, aggre_granule, aggre_file, locate_grid_index, run_modis_aggre, \
+    init_grid_data, merge_granule
+from MODIS_Aggregation.fused import FUSED_COMPILED, locate_pass, histogram_pass
+from MODIS_Aggregation.histograms import compile_histogram_spec
+from tests.helpers import write_granule_pair
+
+
+class FusedKernelTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        shape = (40, 30)
+        self.lat = rng.uniform(-6, 6, shape).astype(np.float32)
+        self.lon = rng.uniform(19, 41, shape).astype(np.float32)
+        # Pixels on the bin edges and the region bounds
+        self.lat[0, :5], self.lon[1, :5] = 5.0, 20.0
+        self.data = {'CM': rng.randint(0, 4, shape).astype(np.int8),
+                     'Cloud_Top_Pressure': rng.uniform(50, 1050, shape),
+                     'Cloud_Optical_Thickness': rng.choice([0.0, 5.0, 10.0, 37.5, 100.0, 120.0], shape)}
+        self.data['Cloud_Top_Pressure'][rng.rand(*shape) < 0.2] = np.nan
+        self.data['Cloud_Top_Pressure'][2, :5] = 1000.0
+        self.varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+        self.intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50,100'])
+        self.intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        self.histnames = np.array(['_COT', '_COT', '_CTP'])
+        self.var_idx = np.array([2, 2, 1])
+
+    def aggre_both(self, sts_switch, **kwargs):
+        args = (self.lat, self.lon, self.data, [-5, 5], [20, 40], 20, 10, 1.0, 1.0, sts_switch, self.varnames,
+                self.intervals_1d, self.intervals_2d, self.var_idx, self.histnames)
+        return aggre_granule(*args, **kwargs), fused_aggre_granule(*args, **kwargs)
+
+    def assert_same_partial(self, expected, partial):
+        self.assertEqual(sorted(partial), sorted(expected))
+        for key in expected:
+            if ('Mean' in key) or ('Standard_Deviation' in key) or ('Moment' in key):
+                np.testing.assert_allclose(partial[key], expected[key], rtol=1e-12, atol=1e-9, err_msg=key)
+            else:
+                np.testing.assert_array_equal(partial[key], expected[key], err_msg=key)
+
+    def test_matches_aggre_granule(self):
+        grid_index = locate_grid_index(self.lat, self.lon, [-5, 5], [20, 40], 20, 1.0, 1.0)
+        for sts_switch in [np.ones(7, dtype=bool), np.array([1, 1, 1, 1, 1, 0, 1], dtype=bool),
+                           np.array([0, 1, 0, 0, 0, 1, 0], dtype=bool)]:
+            for kwargs in [{}, {'moments': True}, {'moments': True, 'grid_index': grid_index}]:
+                expected, partial = self.aggre_both(sts_switch, **kwargs)
+                self.assert_same_partial(expected, partial)
+                self.assertTrue(np.all(np.diff(partial['cells']) > 0))
+
+        # Nothing in the region
+        self.lat[...] = 50.0
+        expected, partial = self.aggre_both(np.ones(7, dtype=bool), moments=True)
+        self.assertEqual(partial['cells'].size, 0)
+        self.assert_same_partial(expected, partial)
+
+    def test_numpy_scalar_region(self):
+        # Region bounds and gaps as numpy scalars (like examples/modis_bs.py), with pixels on the cell edges
+        rng = np.random.RandomState(5)
+        self.lat = (-5 + 0.1 * (rng.randint(0, 99, (40, 30)) + 0.5)).astype(np.float32)
+        self.lon = (20 + 0.1 * (rng.randint(0, 199, (40, 30)) + 0.5)).astype(np.float32)
+        args = (self.lat, self.lon, self.data, np.array([-5, 5]),
+                np.array([20, 40]), np.int64(200), np.int64(100), np.float64(0.1), np.float64(0.1),
+                np.ones(7, dtype=bool), self.varnames, self.intervals_1d, self.intervals_2d, self.var_idx,
+                self.histnames)
+        self.assertIsInstance(args[3][0], np.int64)
+        self.assert_same_partial(aggre_granule(*args, moments=True), fused_aggre_granule(*args, moments=True))
+
+    def test_run_with_fused_tasks(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            pairs = [write_granule_pair(tmpdir, i, shape=(30, 20)) for i in range(2)]
+            fname1, fname2 = np.array([p[0] for p in pairs]), np.array([p[1] for p in pairs])
+            sts_switch = np.ones(7, dtype=bool)
+            spec = compile_histogram_spec(self.varnames, self.intervals_1d, self.intervals_2d, self.var_idx)
+            config = ([-5, 5], [20, 40], 20, 10, 1.0, 1.0, sts_switch, self.varnames, self.intervals_1d,
+                      self.intervals_2d, self.var_idx, self.histnames, spec, True)
+            init_args = (self.varnames, sts_switch, self.intervals_1d, self.intervals_2d, self.histnames, 10, 20)
+
+            # The 8th item of a task selects the aggregation function
+            grid_data = init_grid_data(*init_args, moments=True)
+            for f1, f2 in pairs:
+                partial = aggre_file((f1, f2, 1, config, False, None, None, fused_aggre_granule))
+                grid_data = merge_granule(grid_data, partial)
+
+            expected = run_modis_aggre(fname1, fname2, [-5, 5], [20, 40], 20, 10, 1.0, 1.0, np.arange(2),
+                                       init_grid_data(*init_args, moments=True), sts_switch, self.varnames,
+                                       self.intervals_1d, self.intervals_2d, self.var_idx, histnames=self.histnames,
+                                       spl_num=1)
+            fused = run_modis_aggre(fname1, fname2, [-5, 5], [20, 40], 20, 10, 1.0, 1.0, np.arange(2),
+                                    init_grid_data(*init_args, moments=True), sts_switch, self.varnames,
+                                    self.intervals_1d, self.intervals_2d, self.var_idx, histnames=self.histnames,
+                                    spl_num=1, engine='fused', prefetch=1)
+            for result in [grid_data, fused]:
+                for key in expected:
+                    np.testing.assert_allclose(result[key], expected[key], rtol=1e-12, err_msg=key)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @unittest.skipUnless(FUSED_COMPILED, 'numba is not installed')
+    def test_compiled_kernels(self):
+        # The kernels are compiled and give the same result as their Python version
+        self.assertTrue(hasattr(locate_pass, 'py_func') and hasattr(histogram_pass, 'py_func'))
+        expected, partial = self.aggre_both(np.ones(7, dtype=bool), moments=True)
+        self.assert_same_partial(expected, partial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+import numpy as np
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, read_MODIS, GranuleCache, GridIndexCache, \
+    preprocess_granules, enable_profile, disable_profile
+from tests.helpers import GranuleRunTest
+
+
+class GranuleCacheTest(GranuleRunTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = GranuleCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        disable_profile()
+        super().tearDown()
+
+    def run_aggre(self, **kwargs):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, np.arange(3),
+                               init_grid_data(*self.args), self.sts_switch, self.varnames, self.intervals_1d,
+                               self.intervals_2d, self.var_idx, histnames=self.histnames, spl_num=2, **kwargs)
+
+    def test_entries_match_read_modis(self):
+        self.assertEqual(preprocess_granules(self.cache, self.fname1, self.fname2, self.varnames, 2), 3)
+        self.assertEqual(preprocess_granules(self.cache, self.fname1, self.fname2, self.varnames, 2, workers=2), 0)
+
+        lat, lon, data = read_MODIS(self.varnames, self.fname1[0], self.fname2[0], 2)
+        c_lat, c_lon, c_data = self.cache.load(self.fname1[0], self.fname2[0], self.varnames, 2)
+        self.assertIsInstance(c_lat, np.memmap)
+        self.assertEqual(c_data['CM'].dtype, np.uint8)
+        np.testing.assert_array_equal(c_lat, lat)
+        np.testing.assert_array_equal(c_data['CM'], data['CM'])
+        for key in self.varnames[1:]:
+            self.assertEqual(c_data[key].dtype, np.float32)
+            np.testing.assert_array_equal(c_data[key], data[key].astype(np.float32))
+
+        # Another sampling rate, a variable which was not preprocessed or a modified source is not cached
+        self.assertIsNone(self.cache.load(self.fname1[0], self.fname2[0], self.varnames, 3))
+        self.assertIsNone(self.cache.load(self.fname1[0], self.fname2[0], ['Cloud_Water_Path'], 2))
+        stat = os.stat(self.fname1[0])
+        os.utime(self.fname1[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.cache.load(self.fname1[0], self.fname2[0], self.varnames, 2))
+        self.assertEqual(preprocess_granules(self.cache, self.fname1, self.fname2, self.varnames, 2), 1)
+
+    def test_cached_run_matches_hdf_run(self):
+        expected = self.run_aggre()
+        preprocess_granules(self.cache, self.fname1, self.fname2, self.varnames, 2)
+
+        index_cache = GridIndexCache(os.path.join(self.tmpdir, 'index'))
+        for kwargs in [{}, {'prefetch': 2}, {'workers': 2}, {'index_cache': index_cache}]:
+            profile = enable_profile()
+            grid_data = self.run_aggre(granule_cache=self.cache, **kwargs)
+            disable_profile()
+
+            # No HDF file is opened
+            report = profile.report()
+            self.assertEqual(report['counters']['granule_cache_hits'], 3)
+            self.assertNotIn('read_mod06', report['timers'])
+            self.assertNotIn('read_mod03', report['timers'])
+
+            # The variables are float32, the statistics match to float32 precision
+            for key in expected:
+                np.testing.assert_allclose(grid_data[key], expected[key], rtol=1e-6, err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+from MODIS_Aggregation import parse_granule_time, build_granule_index, load_granule_index
+from MODIS_Aggregation import query_granule_index, prune_granules
+
+
+def write_geolocation(fname, lat_range, lon_range, solar_zenith):
+    with Dataset(fname, 'w') as nc:
+        nc.createDimension('nscans', 20)
+        nc.createDimension('mframes', 10)
+        for name, (low, high) in [('Latitude', lat_range), ('Longitude', lon_range)]:
+            var = nc.createVariable(name, 'f4', ('nscans', 'mframes'), fill_value=-999.0)
+            values = np.linspace(low, high, 200).reshape(20, 10)
+            values[5, 5] = -999.0
+            var[:] = values
+        var = nc.createVariable('SolarZenith', 'f4', ('nscans', 'mframes'))
+        var[:] = solar_zenith
+
+
+class GranuleIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = [os.path.join(self.tmpdir, 'MYD03.A2008001.{}.061.hdf'.format(t)) for t in ['0000', '0005', '1200']]
+        write_geolocation(self.files[0], (-50, -20), (100, 120), 40.0)
+        write_geolocation(self.files[1], (0, 30), (10, 30), 120.0)
+        write_geolocation(self.files[2], (10, 20), (-170, -150), np.linspace(60, 100, 200).reshape(20, 10))
+        self.index_file = os.path.join(self.tmpdir, 'granules.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_granule_time(self):
+        self.assertEqual(parse_granule_time('/data/MYD06_L2.A2008032.1235.061.2018.hdf'), datetime(2008, 2, 1, 12, 35))
+        self.assertIsNone(parse_granule_time('output.h5'))
+
+    def test_build_and_query(self):
+        index = build_granule_index(self.files, self.index_file)
+        self.assertEqual(list(index['daynight']), ['D', 'N', 'M'])
+        self.assertAlmostEqual(index['lat_min'][0], -50, places=4)
+        self.assertAlmostEqual(index['lon_max'][1], 30, places=4)
+
+        index = load_granule_index(self.index_file)
+        self.assertEqual(list(index['files']), [os.path.abspath(f) for f in self.files])
+        np.testing.assert_array_equal(query_granule_index(index, self.files, [-10, 40], [0, 40]), [False, True, False])
+        np.testing.assert_array_equal(query_granule_index(index, self.files, daynight='DM'), [True, False, True])
+        np.testing.assert_array_equal(query_granule_index(index, self.files, start=datetime(2008, 1, 1, 0, 5),
+                                                          end=datetime(2008, 1, 1, 6)), [False, True, False])
+        np.testing.assert_array_equal(prune_granules(np.arange(3), self.files, index, [-60, 15], [-180, 180]), [0, 1, 2])
+        np.testing.assert_array_equal(prune_granules(np.arange(3), self.files, index, [-60, 15], [90, 180]), [0])
+
+    def test_incremental_update(self):
+        build_granule_index(self.files[:2], self.index_file)
+        write_geolocation(self.files[0], (60, 70), (0, 10), 40.0)
+        os.utime(self.files[0], (time.time() + 10, time.time() + 10))
+        index = build_granule_index(self.files[1:], self.index_file)
+        self.assertEqual(index['files'].size, 3)
+        self.assertAlmostEqual(index['lat_min'][0], -50, places=4)
+
+        index = build_granule_index(self.files, self.index_file)
+        self.assertAlmostEqual(index['lat_min'][0], 60, places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from MODIS_Aggregation import init_grid_data, aggre_granule_legacy, aggre_granule, merge_granule
+from MODIS_Aggregation.grid_reduction import group_cells, cell_count, cell_nansum, cell_nanmin, cell_nanmax
+from tests.helpers import make_granule
+
+
+class GridReductionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+        self.intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50'])
+        self.intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        self.histnames = np.array(['_Cloud_Optical_Thickness', '_Cloud_Optical_Thickness', '_Cloud_Top_Pressure'])
+        self.var_idx = np.array([2, 2, 1])
+        self.sts_switch = np.ones(7, dtype=bool)
+        self.region = ([-5, 5], [25, 35], 10, 10, 1.0, 1.0)
+
+    def test_cell_reductions(self):
+        groups = group_cells(np.array([3, 1, 3, 7, -1, 1, 3]), 5)
+        values = np.array([1.0, 2.0, np.nan, 9.0, 9.0, 4.0, 5.0])
+        np.testing.assert_array_equal(groups.cells, [1, 3])
+        np.testing.assert_array_equal(groups.counts, [2, 3])
+        np.testing.assert_array_equal(cell_count(groups, values > 1), [2, 1])
+        np.testing.assert_array_equal(cell_nansum(groups, values), [6.0, 6.0])
+        np.testing.assert_array_equal(cell_nanmin(groups, values), [2.0, 1.0])
+        np.testing.assert_array_equal(cell_nanmax(groups, values), [4.0, 5.0])
+
+    def test_vectorized_matches_legacy(self):
+        NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y = self.region
+        args = (self.varnames, self.sts_switch, self.intervals_1d, self.intervals_2d, self.histnames,
+                grid_lat, grid_lon)
+        legacy = init_grid_data(*args)
+        vectorized = init_grid_data(*args)
+
+        for seed in range(3):
+            lat, lon, data = make_granule(seed)
+            legacy = aggre_granule_legacy(lat, lon, dict(data), NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x,
+                                          gap_y, legacy, self.sts_switch, self.varnames, self.intervals_1d,
+                                          self.intervals_2d, self.var_idx, self.histnames)
+            partial = aggre_granule(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y,
+                                    self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                                    self.var_idx, self.histnames)
+            vectorized = merge_granule(vectorized, partial)
+
+        self.assertEqual(sorted(legacy), sorted(vectorized))
+        for key in legacy:
+            np.testing.assert_allclose(vectorized[key], legacy[key], rtol=1e-12, err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from MODIS_Aggregation.grid_reduction import group_cells
+from MODIS_Aggregation.histograms import compile_histogram_spec, cell_histogram, cell_histogram2d
+
+
+class CellHistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.latlon_index = rng.randint(0, 12, 500)
+        self.values1 = rng.choice([0.0, 0.5, 1.0, 2.0, 3.0, 4.0, 5.0, -1.0, np.nan], 500)
+        self.values2 = rng.uniform(-1, 11, 500)
+        self.values2[::17] = 10.0
+        self.spec = compile_histogram_spec(['a', 'b'], np.array(['0,1,2,2,5', '0,5,10']),
+                                           np.array(['0,2.5,10', '0,1']), [1, 0])
+
+    def test_compile_histogram_spec(self):
+        np.testing.assert_array_equal(self.spec.edges_1d[0], [0, 1, 2, 2, 5])
+        np.testing.assert_array_equal(self.spec.edges_2d[0], [0, 2.5, 10])
+        self.assertEqual(self.spec.jvars, ['b', 'a'])
+
+        spec = compile_histogram_spec(['a'], [0], [0], [0])
+        self.assertIsNone(spec.edges_1d[0])
+        self.assertIsNone(spec.jvars[0])
+
+    def test_matches_numpy_histograms(self):
+        groups = group_cells(self.latlon_index, 12)
+        edges1, edges2 = self.spec.edges_1d[0], self.spec.edges_2d[0]
+        hist = cell_histogram(groups, self.values1, edges1)
+        jhist = cell_histogram2d(groups, self.values1, self.values2, edges1, edges2)
+
+        for i, z in enumerate(groups.cells):
+            in_cell = self.latlon_index == z
+            np.testing.assert_array_equal(hist[i], np.histogram(self.values1[in_cell], bins=edges1)[0])
+            np.testing.assert_array_equal(jhist[i], np.histogram2d(self.values1[in_cell], self.values2[in_cell],
+                                                                   bins=(edges1, edges2))[0])
+
+    def test_cell_mask(self):
+        groups = group_cells(self.latlon_index, 12)
+        mask = np.arange(groups.cells.size) % 2 == 0
+        hist = cell_histogram(groups, self.values1, self.spec.edges_1d[0], mask)
+        self.assertTrue(hist[mask].sum() > 0)
+        self.assertEqual(hist[~mask].sum(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import unittest
+import numpy as np
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, read_MODIS, locate_grid_index, GridIndexCache, \
+    enable_profile, disable_profile
+from tests.helpers import GranuleRunTest
+
+
+class GridIndexCacheTest(GranuleRunTest):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        disable_profile()
+        super().tearDown()
+
+    def run_aggre(self, **kwargs):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, np.arange(3),
+                               init_grid_data(*self.args), self.sts_switch, self.varnames, self.intervals_1d,
+                               self.intervals_2d, self.var_idx, histnames=self.histnames, spl_num=2, **kwargs)
+
+    def test_entry_round_trip(self):
+        cache = GridIndexCache(self.cache_dir)
+        lat, lon, data = read_MODIS(self.varnames, self.fname1[0], self.fname2[0], 2)
+        res_idx, latlon_index = locate_grid_index(lat, lon, [-5, 5], [25, 35], 20, 0.5, 0.5)
+
+        key = cache.key(self.fname2[0], [-5, 5], [25, 35], 20, 0.5, 0.5, 2)
+        self.assertIsNone(cache.load(key))
+        cache.store(key, res_idx, latlon_index, lat.shape)
+        (rows, cols), cached_index, shape = cache.load(key)
+        self.assertEqual(shape, lat.shape)
+        np.testing.assert_array_equal(rows, res_idx[0])
+        np.testing.assert_array_equal(cols, res_idx[1])
+        np.testing.assert_array_equal(cached_index, latlon_index)
+
+        # Another grid or sampling rate, or a modified MYD03 file, is another entry
+        self.assertNotEqual(key, cache.key(self.fname2[0], [-5, 5], [25, 35], 20, 0.5, 0.5, 3))
+        self.assertNotEqual(key, cache.key(self.fname2[0], [-5, 5], [25, 35], 40, 0.25, 0.25, 2))
+        stat = os.stat(self.fname2[0])
+        os.utime(self.fname2[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(key, cache.key(self.fname2[0], [-5, 5], [25, 35], 20, 0.5, 0.5, 2))
+
+    def test_cached_run_matches_and_skips_myd03(self):
+        expected = self.run_aggre()
+
+        for workers in [None, 2]:
+            cache = GridIndexCache(self.cache_dir)
+            profile = enable_profile()
+            grid_data = self.run_aggre(workers=workers, index_cache=cache)
+            disable_profile()
+            for key in expected:
+                np.testing.assert_array_equal(grid_data[key], expected[key], err_msg=key)
+            self.assertEqual(len(cache.entries()), 3)
+
+            # The first run fills the cache, the next one does not read the MYD03 files
+            counters = profile.report()['counters']
+            if workers is None:
+                self.assertEqual(counters['index_cache_misses'], 3)
+            else:
+                self.assertEqual(counters['index_cache_hits'], 3)
+                self.assertNotIn('read_mod03', profile.report()['timers'])
+
+    def test_eviction_keeps_recent_entries(self):
+        cache = GridIndexCache(self.cache_dir)
+        self.run_aggre(index_cache=cache)
+        found = cache.entries()
+        self.assertEqual(len(found), 3)
+
+        # Keep room for two entries, the least recently used one is removed
+        cache.max_bytes = found[0][1] + found[2][1]
+        os.utime(found[0][2], (found[2][0] + 10, found[2][0] + 10))
+        cache.evict()
+        self.assertEqual(sorted(path for mtime, size, path in cache.entries()), sorted([found[0][2], found[2][2]]))
+        self.assertLessEqual(cache.nbytes(), cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
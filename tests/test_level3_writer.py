@@ -0,0 +1,55 @@
+import os
+import h5py
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from MODIS_Aggregation import addGridEntry, write_grid_entry, choose_chunks
+
+
+class Level3WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        mean = rng.uniform(100, 1000, (30, 40))
+        mean[rng.rand(30, 40) < 0.3] = np.nan
+        minimum = mean.copy()
+        minimum[np.isnan(minimum)] = np.inf
+        self.entries = [('CTP_Mean', mean, 0.1), ('CTP_Minimum', minimum, 0.1),
+                        ('CTP_Pixel_Counts', rng.randint(0, 50000, (30, 40)).astype(float), 1.0),
+                        ('CTP_Jhisto_vs__COT', rng.randint(0, 100, (30, 40, 4, 3)).astype(float), 1.0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_addGridEntry(self):
+        fname = os.path.join(self.tmpdir, 'out.h5')
+        with h5py.File(fname, 'w') as f:
+            for name, data, scale in self.entries:
+                addGridEntry(f, 'legacy_' + name, 'hPa', name, -9999, scale, 0.0, data)
+                write_grid_entry(f, name, 'hPa', name, -9999, scale, 0.0, data, chunk_bytes=4000)
+            write_grid_entry(f, 'lzf_CTP_Mean', 'hPa', 'CTP_Mean', -9999, 0.1, 0.0, self.entries[0][1],
+                             compression='lzf', dtype=np.int32)
+
+        with h5py.File(fname, 'r') as f:
+            for name, data, scale in self.entries:
+                np.testing.assert_array_equal(f[name][()], f['legacy_' + name][()], err_msg=name)
+                self.assertEqual(f[name].compression, 'gzip')
+                self.assertEqual(f[name].attrs['scale_factor'], scale)
+                self.assertEqual(f[name].dims[1].label, 'lon_bnd')
+            self.assertEqual(f['CTP_Mean'].dtype, np.int16)
+            self.assertEqual(f['CTP_Pixel_Counts'].dtype, np.int32)
+            self.assertEqual(f['CTP_Jhisto_vs__COT'].dtype, np.int16)
+            self.assertEqual(f['CTP_Jhisto_vs__COT'].chunks[2:], (4, 3))
+            self.assertEqual(f['lzf_CTP_Mean'].compression, 'lzf')
+            np.testing.assert_array_equal(f['lzf_CTP_Mean'][()], f['legacy_CTP_Mean'][()])
+
+    def test_choose_chunks(self):
+        self.assertEqual(choose_chunks((180, 360), 2), (180, 360))
+        self.assertEqual(choose_chunks((1800, 3600), 4, 3600 * 4 * 10), (10, 3600))
+        self.assertEqual(choose_chunks((1800, 3600, 10, 10), 4, 4000), (1, 10, 10, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import numpy as np
+from MODIS_Aggregation import init_grid_data, aggre_granule_legacy, aggre_granule, merge_granule, merge_grid_data, \
+    finalize, GridAccumulator, cell_moments, merge_moments, locate_grid_index
+from MODIS_Aggregation.grid_reduction import group_cells
+from tests.helpers import make_granule
+
+
+class MomentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Optical_Thickness'])
+        self.intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50'])
+        self.intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        self.histnames = np.array(['_COT', '_COT', '_CTP'])
+        self.var_idx = np.array([2, 2, 1])
+        self.sts_switch = np.ones(7, dtype=bool)
+        self.region = ([-5, 5], [25, 35], 10, 10, 1.0, 1.0)
+        self.args = (self.varnames, self.sts_switch, self.intervals_1d, self.intervals_2d, self.histnames, 10, 10)
+
+    def aggregate(self, grid_data, seeds):
+        NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y = self.region
+        for seed in seeds:
+            lat, lon, data = make_granule(seed)
+            partial = aggre_granule(lat, lon, data, NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y,
+                                    self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                                    self.var_idx, self.histnames, moments=True)
+            grid_data = merge_granule(grid_data, partial)
+        return grid_data
+
+    def test_cell_moments_and_merge(self):
+        rng = np.random.RandomState(0)
+        index = rng.randint(0, 6, 500)
+        values = 1e9 + rng.normal(0, 1, 500)
+        values[rng.rand(500) < 0.1] = np.nan
+
+        count, mean, m2 = cell_moments(group_cells(index, 6), values)
+        first = cell_moments(group_cells(index[:200], 6), values[:200])
+        second = cell_moments(group_cells(index[200:], 6), values[200:])
+        merged = merge_moments(*(first + second))
+        for cell in range(6):
+            pixels = values[index == cell]
+            self.assertEqual(count[cell], np.sum(~np.isnan(pixels)))
+            self.assertAlmostEqual(mean[cell], np.nanmean(pixels), places=5)
+            self.assertAlmostEqual(m2[cell] / count[cell], np.nanvar(pixels), places=5)
+            self.assertAlmostEqual(merged[2][cell] / merged[0][cell], np.nanvar(pixels), places=5)
+            self.assertAlmostEqual(merged[1][cell], np.nanmean(pixels), places=5)
+
+    def test_granules_pool_pixels(self):
+        grid_data = self.aggregate(init_grid_data(*self.args, moments=True), range(3))
+        final = finalize(grid_data, self.sts_switch, self.varnames, self.histnames, 10, 10)
+
+        # Reference: mean and std of all the pixels of a grid box, whatever their granule
+        NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y = self.region
+        cells, values, cloudy = [], [], []
+        for seed in range(3):
+            lat, lon, data = make_granule(seed)
+            res_idx, latlon_index = locate_grid_index(lat, lon, NTA_lats, NTA_lons, grid_lon, gap_x, gap_y)
+            cells.append(latlon_index)
+            values.append(data['Cloud_Top_Pressure'][res_idx].ravel())
+            cloudy.append(data['CM'][res_idx].ravel() <= 1)
+        cells, values, cloudy = np.concatenate(cells), np.concatenate(values), np.concatenate(cloudy)
+
+        mean = final['Cloud_Top_Pressure_Mean'].ravel()
+        std = final['Cloud_Top_Pressure_Standard_Deviation'].ravel()
+        cf_std = final['cloud_fraction_Standard_Deviation'].ravel()
+        for cell in np.unique(cells[(cells >= 0) & (cells < 100)]):
+            self.assertAlmostEqual(mean[cell], np.nanmean(values[cells == cell]), places=9)
+            self.assertAlmostEqual(std[cell], np.nanstd(values[cells == cell]), places=9)
+            self.assertAlmostEqual(cf_std[cell], np.std(cloudy[cells == cell]), places=9)
+
+    def test_legacy_and_merges_agree(self):
+        NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x, gap_y = self.region
+        legacy = init_grid_data(*self.args, moments=True)
+        for seed in range(3):
+            lat, lon, data = make_granule(seed)
+            legacy = aggre_granule_legacy(lat, lon, dict(data), NTA_lats, NTA_lons, grid_lon, grid_lat, gap_x,
+                                          gap_y, legacy, self.sts_switch, self.varnames, self.intervals_1d,
+                                          self.intervals_2d, self.var_idx, self.histnames)
+        vectorized = self.aggregate(init_grid_data(*self.args, moments=True), range(3))
+        accumulator = self.aggregate(GridAccumulator(*self.args, moments=True, count_dtype=np.int32), range(3))
+        days = merge_grid_data(self.aggregate(init_grid_data(*self.args, moments=True), [0]),
+                               self.aggregate(init_grid_data(*self.args, moments=True), [1, 2]))
+
+        self.assertIn('Cloud_Top_Pressure_Moment_M2', vectorized)
+        # The moments replace the sum of squares accumulator
+        for grid_data in [legacy, vectorized, accumulator]:
+            self.assertNotIn('Cloud_Top_Pressure_Standard_Deviation', grid_data)
+        self.assertEqual(sorted(legacy), sorted(accumulator))
+        for key in vectorized:
+            np.testing.assert_allclose(legacy[key], vectorized[key], rtol=1e-10, err_msg=key)
+            np.testing.assert_allclose(accumulator[key], vectorized[key], rtol=1e-12, err_msg=key)
+            np.testing.assert_allclose(days[key], vectorized[key], rtol=1e-10, err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
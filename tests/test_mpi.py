@@ -0,0 +1,85 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import numpy as np
+from MODIS_Aggregation.mpi_aggregation import get_mpi_comm, split_files
+
+# Every rank fills its own grid_data, rank 0 checks the reduced result
+REDUCE_SCRIPT = """
+import numpy as np
+from MODIS_Aggregation import get_mpi_comm, reduce_grid_data, GridAccumulator
+
+comm = get_mpi_comm()
+rank, size = comm.Get_rank(), comm.Get_size()
+grid_data = {'cloud_fraction_Minimum': np.zeros(6) + rank,
+             'cloud_fraction_Maximum': np.zeros(6) - rank,
+             'cloud_fraction_Pixel_Counts': np.ones(6),
+             'cloud_fraction_Histogram_Counts': np.ones((6, 3)) * rank}
+grid_data = reduce_grid_data(grid_data, comm)
+if rank == 0:
+    assert np.all(grid_data['cloud_fraction_Minimum'] == 0)
+    assert np.all(grid_data['cloud_fraction_Maximum'] == 0)
+    assert np.all(grid_data['cloud_fraction_Pixel_Counts'] == size)
+    assert np.all(grid_data['cloud_fraction_Histogram_Counts'] == size * (size - 1) / 2)
+else:
+    assert grid_data is None
+
+accumulator = GridAccumulator(['cloud_fraction'], np.ones(7, dtype=bool), ['0,0.5,1'], ['0,1,2'], ['_CF'], 2, 3)
+accumulator['cloud_fraction_Pixel_Counts'][:] = 1
+accumulator['cloud_fraction_Minimum'][:] = rank
+accumulator['cloud_fraction_Jhisto_vs__CF'][:] = rank
+accumulator = reduce_grid_data(accumulator, comm)
+
+sparse = GridAccumulator(['cloud_fraction'], np.ones(7, dtype=bool), ['0,0.5,1'], ['0,1,2'], ['_CF'], 2, 3, sparse=True)
+sparse['cloud_fraction_Jhisto_vs__CF'].add([rank % 6], np.ones((1, 2, 2)) * (rank + 1))
+sparse = reduce_grid_data(sparse, comm)
+
+moments = {'X_Moment_Count': np.zeros(6) + rank + 1, 'X_Moment_Mean': np.zeros(6) + rank, 'X_Moment_M2': np.ones(6)}
+moments = reduce_grid_data(moments, comm)
+if rank == 0:
+    ranks = np.arange(size)
+    mean = np.sum((ranks + 1) * ranks) / np.sum(ranks + 1)
+    assert np.all(moments['X_Moment_Count'] == np.sum(ranks + 1))
+    assert np.allclose(moments['X_Moment_Mean'], mean)
+    assert np.allclose(moments['X_Moment_M2'], np.sum(1 + (ranks + 1) * (ranks - mean) ** 2))
+    assert np.all(accumulator['cloud_fraction_Pixel_Counts'] == size)
+    assert np.all(accumulator['cloud_fraction_Minimum'] == 0)
+    assert np.all(accumulator['cloud_fraction_Jhisto_vs__CF'] == size * (size - 1) / 2)
+    expected = np.zeros((6, 2, 2))
+    np.add.at(expected, np.arange(size) % 6, np.arange(1, size + 1)[:, None, None])
+    assert np.all(np.asarray(sparse['cloud_fraction_Jhisto_vs__CF']) == expected)
+    print('REDUCED', size)
+"""
+
+
+class SplitFilesTest(unittest.TestCase):
+
+    def test_split_covers_all_files(self):
+        parts = [split_files(np.arange(10), rank, 4) for rank in range(4)]
+        self.assertEqual(sorted(np.concatenate(parts).tolist()), list(range(10)))
+        np.testing.assert_array_equal(parts[1], [1, 5, 9])
+
+
+@unittest.skipIf((get_mpi_comm() is None) or (shutil.which('mpirun') is None), 'mpi4py or mpirun is not available')
+class ReduceGridDataTest(unittest.TestCase):
+
+    def test_mpirun_reduce(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            script = os.path.join(tmpdir, 'reduce.py')
+            with open(script, 'w') as f:
+                f.write(REDUCE_SCRIPT)
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            result = subprocess.run(['mpirun', '-n', '4', sys.executable, script], env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+            self.assertEqual(result.returncode, 0, result.stderr.decode())
+            self.assertIn('REDUCED 4', result.stdout.decode())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
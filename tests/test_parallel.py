@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from netCDF4 import Dataset
+from MODIS_Aggregation import calculateCloudFraction, calculateCloudFractionLazy, build_granule_index
+from MODIS_Aggregation.parallel import map_granules, prefetch_map
+
+
+def square(x):
+    return x * x
+
+
+def write_cloud_mask_pair(directory, idx, shape=(90, 60)):
+    # Write a small MYD06-like cloud mask file and its MYD03-like geolocation file
+    rng = np.random.RandomState(idx)
+    m06 = os.path.join(directory, 'MYD06_L2.A2008001.{:04d}.nc'.format(idx))
+    m03 = os.path.join(directory, 'MYD03.A2008001.{:04d}.nc'.format(idx))
+
+    with Dataset(m06, 'w') as nc:
+        nc.createDimension('Cell_Along_Swath_1km', shape[0])
+        nc.createDimension('Cell_Across_Swath_1km', shape[1])
+        nc.createDimension('Byte_Segment', 2)
+        var = nc.createVariable('Cloud_Mask_1km', 'i1', ('Cell_Along_Swath_1km', 'Cell_Across_Swath_1km', 'Byte_Segment'))
+        var[:] = rng.randint(-128, 128, shape + (2,))
+
+    with Dataset(m03, 'w') as nc:
+        nc.createDimension('nscans', shape[0])
+        nc.createDimension('mframes', shape[1])
+        lat = nc.createVariable('Latitude', 'f4', ('nscans', 'mframes'))
+        lon = nc.createVariable('Longitude', 'f4', ('nscans', 'mframes'))
+        lat[:] = rng.uniform(-30, 30, shape)
+        lon[:] = rng.uniform(-60, 60, shape)
+
+    return m06, m03
+
+
+class ParallelAggregationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        pairs = [write_cloud_mask_pair(self.tmpdir, i) for i in range(5)]
+        self.M06_files = [p[0] for p in pairs]
+        self.M03_files = [p[1] for p in pairs]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_map_granules_keeps_order(self):
+        self.assertEqual(list(map_granules(square, range(10), workers=3, max_pending=2)),
+                         [x * x for x in range(10)])
+        self.assertEqual(list(map_granules(square, range(4))), [0, 1, 4, 9])
+
+    def test_prefetch_is_ordered_and_bounded(self):
+        started = []
+
+        def record(x):
+            started.append(x)
+            return x * x
+
+        for depth in [0, 1, 3]:
+            del started[:]
+            for i, result in enumerate(prefetch_map(record, range(10), depth)):
+                self.assertEqual(result, i * i)
+                # The reader never runs more than depth tasks ahead of the consumer
+                self.assertLessEqual(max(started), i + depth)
+        with self.assertRaises(ZeroDivisionError):
+            list(prefetch_map(lambda x: 1 // x, [1, 0, 2], 2))
+
+    def test_parallel_matches_serial(self):
+        serial = calculateCloudFraction(self.M03_files, self.M06_files, grid_res=2.0, stride=2)
+        parallel = calculateCloudFraction(self.M03_files, self.M06_files, grid_res=2.0, stride=2, workers=3)
+        self.assertEqual(serial.shape, (90, 180))
+        self.assertTrue(serial.sum() > 0)
+        np.testing.assert_array_equal(parallel, serial)
+        prefetched = calculateCloudFraction(self.M03_files, self.M06_files, grid_res=2.0, stride=2, prefetch=2)
+        np.testing.assert_array_equal(prefetched, serial)
+
+    def test_lazy_matches_serial(self):
+        serial = calculateCloudFraction(self.M03_files, self.M06_files, grid_res=2.0, stride=2)
+        lazy = calculateCloudFractionLazy(self.M03_files, self.M06_files, grid_res=2.0, stride=2, chunk_rows=10)
+        np.testing.assert_array_equal(lazy, serial)
+        lazy = calculateCloudFractionLazy(self.M03_files, self.M06_files, grid_res=2.0, stride=2,
+                                          scheduler='synchronous')
+        np.testing.assert_array_equal(lazy, serial)
+
+    def test_granule_index_prunes_files(self):
+        # Move the first granule north of the region, the index skips it without opening its files
+        with Dataset(self.M03_files[0], 'a') as nc:
+            nc.variables['Latitude'][:] = np.random.RandomState(0).uniform(50, 60, (90, 60))
+        index = build_granule_index(self.M03_files)
+        os.remove(self.M06_files[0])
+
+        pruned = calculateCloudFraction(self.M03_files, self.M06_files, grid_res=2.0, stride=2, workers=2,
+                                        granule_index=index, NTA_lats=[-40, 40], NTA_lons=[-70, 70])
+        expected = calculateCloudFraction(self.M03_files[1:], self.M06_files[1:], grid_res=2.0, stride=2)
+        np.testing.assert_array_equal(pruned, expected)
+        with self.assertRaises(ValueError):
+            calculateCloudFraction(self.M03_files, self.M06_files, granule_index=index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import unittest
+import numpy as np
+from datetime import date
+from MODIS_Aggregation import run_modis_aggre_periods, run_modis_aggre, period_bounds, period_label, \
+    init_grid_data, allocate_grid_data
+from tests.helpers import GranuleRunTest
+
+
+class PeriodBoundsTest(unittest.TestCase):
+
+    def test_periods(self):
+        self.assertEqual(period_bounds(date(2008, 2, 29), 'daily'), (date(2008, 2, 29), date(2008, 2, 29)))
+        self.assertEqual(period_bounds(date(2008, 2, 29), 'monthly'), (date(2008, 2, 1), date(2008, 2, 29)))
+        self.assertEqual(period_bounds(date(2008, 12, 31), 'monthly'), (date(2008, 12, 1), date(2008, 12, 31)))
+        self.assertEqual(period_bounds(date(2008, 1, 7), 'pentad'), (date(2008, 1, 6), date(2008, 1, 10)))
+        # The last pentad of a leap year has 6 days, the last 8-day period is cut at Dec 31
+        self.assertEqual(period_bounds(date(2008, 12, 31), 'pentad'), (date(2008, 12, 26), date(2008, 12, 31)))
+        self.assertEqual(period_bounds(date(2009, 12, 31), 8), (date(2009, 12, 27), date(2009, 12, 31)))
+        self.assertEqual(period_bounds(date(2009, 1, 9), 8), (date(2009, 1, 9), date(2009, 1, 16)))
+        self.assertEqual(period_bounds(date(2009, 5, 5), lambda day: (day, day)),
+                         (date(2009, 5, 5), date(2009, 5, 5)))
+        for kind in ['weekly', 0, 2.5]:
+            with self.assertRaises(ValueError):
+                period_bounds(date(2009, 1, 1), kind)
+
+    def test_labels(self):
+        self.assertEqual([period_label(kind) for kind in ['daily', 'pentad', 'monthly', 'yearly', 8, 1]],
+                         ['D1', 'P5', 'M', 'Y', '8D', '1D'])
+        for kind in ['weekly', 0, lambda day: (day, day)]:
+            with self.assertRaises(ValueError):
+                period_label(kind)
+
+
+class PeriodAggregationTest(GranuleRunTest):
+    granules = 4
+    grid_lat, grid_lon = 10, 20
+
+    def setUp(self):
+        super().setUp()
+        # Two granules on Jan 1, one on Jan 2 and one on Feb 1, listed out of time order
+        for i, day in enumerate(['2008032', '2008001', '2008002', '2008001']):
+            for names in [self.fname1, self.fname2]:
+                os.rename(names[i], names[i].replace('A2008001', 'A' + day))
+                names[i] = names[i].replace('A2008001', 'A' + day)
+
+    def run_aggre(self, hdfs, grid_data):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [20, 40], 20, 10, 1.0, 1.0, np.array(hdfs),
+                               grid_data, self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                               self.var_idx, histnames=self.histnames, spl_num=2)
+
+    def test_matches_separate_runs(self):
+        for new_grid_data, kwargs in [(lambda: init_grid_data(*self.args, moments=True), {}),
+                                      (lambda: allocate_grid_data('sparse', *self.args, moments=True),
+                                       {'workers': 2})]:
+            results = []
+            closed = run_modis_aggre_periods(self.fname1, self.fname2, [-5, 5], [20, 40], 20, 10, 1.0, 1.0,
+                                             np.arange(4), ['daily', 'monthly'], new_grid_data, results.append,
+                                             self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                                             self.var_idx, histnames=self.histnames, spl_num=2, **kwargs)
+
+            # Every period is closed as soon as a later granule comes
+            self.assertEqual([(p.kind, p.start, p.end) for p in closed],
+                             [('daily', date(2008, 1, 1), date(2008, 1, 1)),
+                              ('daily', date(2008, 1, 2), date(2008, 1, 2)),
+                              ('monthly', date(2008, 1, 1), date(2008, 1, 31)),
+                              ('daily', date(2008, 2, 1), date(2008, 2, 1)),
+                              ('monthly', date(2008, 2, 1), date(2008, 2, 29))])
+            self.assertTrue(all(p.grid_data is None for p in closed))
+            self.assertEqual(len(results[2].processed), 3)
+
+            for period, hdfs in zip(results, [[1, 3], [2], [1, 3, 2], [0], [0]]):
+                expected = self.run_aggre(hdfs, init_grid_data(*self.args, moments=True))
+                for key in expected:
+                    np.testing.assert_allclose(np.asarray(period.grid_data[key]), expected[key], rtol=1e-12,
+                                               err_msg=key)
+
+    def test_failed_granules(self):
+        os.remove(self.fname1[2])
+        closed = run_modis_aggre_periods(self.fname1, self.fname2, [-5, 5], [20, 40], 20, 10, 1.0, 1.0,
+                                         np.arange(4), ['pentad'], lambda: init_grid_data(*self.args),
+                                         lambda period: None, self.sts_switch, self.varnames, self.intervals_1d,
+                                         self.intervals_2d, self.var_idx, histnames=self.histnames, spl_num=2)
+        self.assertEqual([len(p.processed) for p in closed], [2, 1])
+        self.assertEqual([len(p.failed) for p in closed], [1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
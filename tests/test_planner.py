@@ -0,0 +1,73 @@
+import os
+import unittest
+import numpy as np
+from MODIS_Aggregation import plan_run, allocate_grid_data, finalize, run_modis_aggre, enable_profile, \
+    disable_profile
+from MODIS_Aggregation.planner import STRATEGIES, SPARSE_STRATEGIES, accumulator_layout
+from tests.helpers import GranuleRunTest
+
+
+class PlannerTest(GranuleRunTest):
+
+    def tearDown(self):
+        disable_profile()
+        super().tearDown()
+
+    def test_accumulator_bytes_are_exact(self):
+        for strategy in [name for name in STRATEGIES if name not in SPARSE_STRATEGIES]:
+            plan = plan_run(*self.args, moments=True, strategy=strategy)
+            grid_data = allocate_grid_data(plan, *self.args, moments=True)
+            layout = accumulator_layout(*self.args, moments=True)
+            self.assertEqual(list(layout), list(grid_data))
+            for key in grid_data:
+                self.assertEqual(layout[key][1], grid_data[key].shape, msg=key)
+                self.assertEqual(np.dtype(STRATEGIES[strategy][layout[key][2] == 'count']), grid_data[key].dtype)
+            self.assertEqual(plan.accumulator_bytes, sum(grid_data[key].nbytes for key in grid_data))
+            self.assertEqual(plan.statistics['Jhisto_vs_'], 400 * (2 * 2 + 4 * 3 + 5 * 2) *
+                             np.dtype(STRATEGIES[strategy][1]).itemsize)
+
+            final = finalize(grid_data, self.sts_switch, self.varnames, self.histnames, 20, 20)
+            self.assertEqual(plan.final_bytes, sum(final[key].nbytes for key in final))
+
+    def test_input_estimates_match_run(self):
+        plan = plan_run(*self.args, fname1=self.fname1, fname2=self.fname2, spl_num=2, granule_shape=(120, 90))
+        self.assertEqual(plan.files, 3)
+        self.assertEqual(plan.file_bytes, sum(os.path.getsize(f) for f in list(self.fname1) + list(self.fname2)))
+
+        profile = enable_profile()
+        run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, np.arange(3),
+                        allocate_grid_data(plan, *self.args), self.sts_switch, self.varnames, self.intervals_1d,
+                        self.intervals_2d, self.var_idx, histnames=self.histnames, spl_num=2)
+        self.assertEqual(plan.decoded_bytes, profile.report()['counters']['bytes_read'])
+
+    def test_memory_budget(self):
+        # A 0.1 degree global grid
+        big = self.args[:5] + (1800, 3600)
+        plan = plan_run(*big, moments=True, workers=8)
+        self.assertEqual(plan.strategy, 'dict')
+
+        # Refused, or run serially (same results) within the budget
+        budget = plan.peak_bytes - 1
+        with self.assertRaises(ValueError):
+            plan_run(*big, moments=True, workers=8, memory_budget=budget)
+        serial = plan_run(*big, moments=True, workers=8, memory_budget=budget, fallback=True)
+        self.assertEqual((serial.strategy, serial.workers), ('dict', None))
+        self.assertEqual(serial.accumulator_bytes, plan.accumulator_bytes)
+        self.assertLess(serial.peak_bytes, plan.peak_bytes)
+
+        # Then with the compact accumulators, only when lossy ones are allowed
+        with self.assertRaises(ValueError):
+            plan_run(*big, moments=True, workers=8, memory_budget=serial.peak_bytes - 1, fallback=True)
+        with self.assertWarns(UserWarning):
+            compact = plan_run(*big, moments=True, workers=8, memory_budget=serial.peak_bytes - 1, fallback=True,
+                               allow_lossy=True)
+        self.assertEqual(compact.strategy, 'compact')
+        self.assertLessEqual(compact.peak_bytes, serial.peak_bytes - 1)
+        self.assertLess(compact.accumulator_bytes, plan.accumulator_bytes / 1.9)
+
+        with self.assertRaises(ValueError):
+            plan_run(*big, moments=True, memory_budget=2 ** 20, fallback=True, allow_lossy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import json
+import unittest
+import numpy as np
+import h5py
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, finalize, write_level3, Profile, get_profile, \
+    enable_profile, disable_profile
+from MODIS_Aggregation.profiling import NULL_PROFILE
+from tests.helpers import GranuleRunTest
+
+
+class ProfilingTest(GranuleRunTest):
+
+    def tearDown(self):
+        disable_profile()
+        super().tearDown()
+
+    def run_aggre(self, fname1=None, **kwargs):
+        fname1 = self.fname1 if fname1 is None else fname1
+        return run_modis_aggre(fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, np.arange(3),
+                               init_grid_data(*self.args), self.sts_switch, self.varnames, self.intervals_1d,
+                               self.intervals_2d, self.var_idx, histnames=self.histnames, spl_num=2, **kwargs)
+
+    def test_disabled_by_default(self):
+        self.assertIs(get_profile(), NULL_PROFILE)
+        with get_profile().timer('read'):
+            get_profile().count('pixels_read', 10)
+        self.assertIsNone(get_profile().end_granule())
+
+        profile = enable_profile()
+        self.assertIs(get_profile(), profile)
+        self.assertIs(disable_profile(), profile)
+        self.assertIs(get_profile(), NULL_PROFILE)
+
+    def test_report_serial_and_workers(self):
+        reports = []
+        for workers, prefetch in [(None, None), (2, None), (None, 2)]:
+            profile = enable_profile()
+            grid_data = self.run_aggre(workers=workers, prefetch=prefetch)
+            final = finalize(grid_data, self.sts_switch, self.varnames, self.histnames, 20, 20)
+            out_fname = os.path.join(self.tmpdir, 'level3.h5')
+            write_level3(out_fname, final, self.sts_switch, np.arange(-5, 5, 0.5), np.arange(25, 35, 0.5),
+                         ['none'] * 3, list(self.varnames), [-9999] * 3, [0.0001, 0.1, 0.01], [0.0] * 3)
+            disable_profile()
+
+            report = profile.report()
+            reports.append(report)
+            self.assertEqual(report['granules'], 3)
+            self.assertEqual(report['granules_failed'], 0)
+            self.assertEqual([g['name'] for g in report['per_granule']],
+                             [os.path.basename(f) for f in self.fname1])
+            for phase in ['read_mod06', 'read_mod03', 'region_filter', 'group_cells', 'cell_stats', 'histograms',
+                          'merge', 'write']:
+                self.assertIn(phase, report['timers'])
+            self.assertEqual(report['timers']['decode_cm']['calls'], 3)
+
+            # The run counters are the sums of the granule counters, and every pixel is kept or dropped
+            counters = report['counters']
+            for name in ['bytes_read', 'pixels_read', 'pixels_kept', 'cells_touched']:
+                self.assertEqual(counters[name], sum(g['counters'][name] for g in report['per_granule']))
+            self.assertEqual(counters['pixels_kept'] + counters['pixels_dropped'], counters['pixels_read'])
+            with h5py.File(out_fname, 'r') as f:
+                self.assertEqual(counters['bytes_written'], sum(f[name].id.get_storage_size() for name in f
+                                                                if name not in ['lat_bnd', 'lon_bnd']))
+
+            profile.save(os.path.join(self.tmpdir, 'profile.json'))
+            with open(os.path.join(self.tmpdir, 'profile.json')) as f:
+                self.assertEqual(json.load(f)['counters'], dict(counters))
+
+        serial = reports[0]
+        for other in reports[1:]:
+            for name in ['pixels_read', 'pixels_kept', 'pixels_dropped', 'cells_touched']:
+                self.assertEqual(serial['counters'][name], other['counters'][name])
+
+    def test_failed_granule_record(self):
+        fname1 = self.fname1.copy()
+        fname1[1] = os.path.join(self.tmpdir, 'MYD06_L2.A2008001.0099.nc')
+        with open(fname1[1], 'w') as f:
+            f.write('corrupt')
+
+        for engine, prefetch in [('legacy', None), ('vectorized', None), ('vectorized', 1)]:
+            profile = enable_profile(Profile())
+            self.run_aggre(fname1=fname1, engine=engine, prefetch=prefetch)
+            report = profile.report()
+            self.assertEqual(report['granules_failed'], 1)
+            self.assertEqual([g['status'] for g in report['per_granule']], ['ok', 'failed', 'ok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import unittest
+import numpy as np
+import h5py
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, read_MODIS, locate_grid_index, GridAccumulator, \
+    coarsen_grid_data, build_pyramid, write_pyramid, finalize
+from tests.helpers import GranuleRunTest
+
+
+class PyramidTest(GranuleRunTest):
+
+    def run_aggre(self, grid_data):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, np.arange(3),
+                               grid_data, self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                               self.var_idx, histnames=self.histnames, spl_num=2)
+
+    def pixels(self, key, factor):
+        # Values of every valid pixel with its block of factor x factor grid boxes
+        values, blocks = [], []
+        for f1, f2 in zip(self.fname1, self.fname2):
+            lat, lon, data = read_MODIS(self.varnames, f1, f2, 2)
+            res_idx, latlon_index = locate_grid_index(lat, lon, [-5, 5], [25, 35], 20, 0.5, 0.5)
+            inside = (latlon_index >= 0) & (latlon_index < 400)
+            cells = latlon_index[inside]
+            values.append(data[key][res_idx].ravel()[inside])
+            blocks.append((cells // 20 // factor) * (20 // factor) + (cells % 20) // factor)
+        values, blocks = np.concatenate(values), np.concatenate(blocks)
+        valid = ~np.isnan(values)
+        return values[valid], blocks[valid]
+
+    def test_levels_match_pixels(self):
+        grid_data = self.run_aggre(init_grid_data(*self.args, moments=True))
+        levels = build_pyramid(grid_data, 20, 20, [2, 4])
+        self.assertEqual([(f, lat, lon) for f, level, lat, lon in levels], [(2, 10, 10), (4, 5, 5)])
+
+        # The 4x level is combined from the 2x one, it is the same as from the finest grid
+        direct = coarsen_grid_data(grid_data, 20, 20, 4)
+        for key in direct:
+            np.testing.assert_allclose(levels[1][1][key], direct[key], rtol=1e-12, atol=1e-9, err_msg=key)
+
+        for factor, level, level_lat, level_lon in levels:
+            final = finalize(level, self.sts_switch, self.varnames, self.histnames, level_lat, level_lon)
+            for key in ['Cloud_Top_Pressure', 'Cloud_Optical_Thickness']:
+                values, blocks = self.pixels(key, factor)
+                size = level_lat * level_lon
+                count = np.bincount(blocks, minlength=size)
+                mean = np.bincount(blocks, values, minlength=size) / np.maximum(count, 1)
+                std = np.sqrt(np.bincount(blocks, (values - mean[blocks]) ** 2, minlength=size) /
+                              np.maximum(count, 1))
+                minimum = np.full(size, np.inf)
+                np.minimum.at(minimum, blocks, values)
+
+                occupied = count > 0
+                np.testing.assert_array_equal(level[key + '_Pixel_Counts'] > 0, occupied)
+                np.testing.assert_array_equal(level[key + '_Moment_Count'], count)
+                np.testing.assert_allclose(final[key + '_Mean'].ravel()[occupied], mean[occupied], rtol=1e-10)
+                np.testing.assert_allclose(final[key + '_Standard_Deviation'].ravel()[occupied], std[occupied],
+                                           rtol=1e-8)
+                np.testing.assert_array_equal(level[key + '_Minimum'], minimum)
+                self.assertEqual(level[key + '_Histogram_Counts'].sum(), grid_data[key + '_Histogram_Counts'].sum())
+
+    def test_accumulator_and_errors(self):
+        expected = coarsen_grid_data(self.run_aggre(init_grid_data(*self.args)), 20, 20, 5)
+        coarse = coarsen_grid_data(self.run_aggre(GridAccumulator(*self.args)), 20, 20, 5)
+        self.assertEqual(list(coarse), list(expected))
+        for key in expected:
+            np.testing.assert_array_equal(coarse[key], expected[key], err_msg=key)
+        self.assertTrue(np.issubdtype(coarse['Cloud_Top_Pressure_Pixel_Counts'].dtype, np.integer))
+
+        with self.assertRaises(ValueError):
+            coarsen_grid_data(init_grid_data(*self.args), 20, 20, 3)
+
+    def test_write_pyramid(self):
+        grid_data = self.run_aggre(init_grid_data(*self.args))
+        map_lat, map_lon = np.arange(-5, 5, 0.5), np.arange(25, 35, 0.5)
+        fnames = {f: os.path.join(self.tmpdir, 'level3_x{}.h5'.format(f)) for f in [1, 2, 10]}
+        written = write_pyramid(fnames, grid_data, self.sts_switch, self.varnames, self.histnames, 20, 20, map_lat,
+                                map_lon, ['none'] * 3, list(self.varnames), [-9999] * 3, [0.0001, 0.1, 0.01],
+                                [0.0] * 3)
+        self.assertEqual(written, [(1, 20, 20), (2, 10, 10), (10, 2, 2)])
+
+        for factor, level_lat, level_lon in written:
+            with h5py.File(fnames[factor], 'r') as f:
+                self.assertEqual(f['Cloud_Top_Pressure_Mean'].shape, (level_lat, level_lon))
+                self.assertEqual(f['Cloud_Top_Pressure_Histogram_Counts'].shape, (level_lat, level_lon, 4))
+                np.testing.assert_array_equal(f['lat_bnd'][:], map_lat[::factor])
+                np.testing.assert_array_equal(f['lon_bnd'][:], map_lon[::factor])
+
+
+if __name__ == '__main__':
+    unittest.main()
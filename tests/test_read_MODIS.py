@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from netCDF4 import Dataset
+from MODIS_Aggregation import read_MODIS, readEntry, run_modis_aggre, init_grid_data
+from tests.helpers import GranuleRunTest
+
+
+class ReadMODISTest(GranuleRunTest):
+    granules = 4
+
+    def test_strided_read_matches_full_read(self):
+        for spl_num in [1, 3, 5]:
+            lat, lon, data = read_MODIS(self.varnames, self.fname1[0], self.fname2[0], spl_num)
+            with Dataset(self.fname1[0]) as nc:
+                full = np.array(nc.variables['Cloud_Top_Pressure']).astype(float)
+                full[full == -9999] = np.nan
+                np.testing.assert_array_equal(readEntry('Cloud_Top_Pressure', nc, spl_num)[0],
+                                              full[2::spl_num, 3::spl_num])
+                cm = (np.array(nc.variables['Cloud_Mask_1km'][:, :, 0], dtype='byte') & 0b00000110) >> 1
+            with Dataset(self.fname2[0]) as nc:
+                full_lat = np.array(nc.variables['Latitude'][:, :])[2::spl_num, 3::spl_num]
+            full_lat[full_lat == -999.0] = np.nan
+
+            self.assertEqual(lat.shape, full_lat.shape)
+            np.testing.assert_array_equal(lat, full_lat)
+            np.testing.assert_array_equal(data['CM'][~np.isnan(lat)], cm[2::spl_num, 3::spl_num][~np.isnan(lat)])
+
+    def test_run_modis_aggre_engines(self):
+        sts_switch = np.ones(7, dtype=bool)
+        intervals_1d = np.array(['0,0.5,1', '100,300,500,700,1000', '0,5,10,20,50,100'])
+        intervals_2d = np.array(['0,10,50', '0,10,20,50', '100,500,1000'])
+        histnames = np.array(['_COT', '_COT', '_CTP'])
+        var_idx = np.array([2, 2, 1])
+        args = (self.varnames, sts_switch, intervals_1d, intervals_2d, histnames, 20, 20)
+
+        results = []
+        for engine, workers, prefetch in [('legacy', None, None), ('vectorized', None, None),
+                                          ('vectorized', 2, None), ('vectorized', None, 2)]:
+            grid_data = run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5,
+                                        np.arange(4), init_grid_data(*args), sts_switch, self.varnames,
+                                        intervals_1d, intervals_2d, var_idx, histnames=histnames,
+                                        engine=engine, workers=workers, spl_num=2, prefetch=prefetch)
+            results.append(grid_data)
+
+        legacy, serial, parallel, prefetched = results
+        self.assertTrue(serial['Cloud_Top_Pressure_Histogram_Counts'].sum() > 0)
+        for key in legacy:
+            np.testing.assert_allclose(serial[key], legacy[key], rtol=1e-12, err_msg=key)
+            np.testing.assert_array_equal(parallel[key], serial[key], err_msg=key)
+            np.testing.assert_array_equal(prefetched[key], serial[key], err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import h5py
+import unittest
+import numpy as np
+from unittest import mock
+from MODIS_Aggregation import SparseHistogram, MOMENT_ATTRS
+from MODIS_Aggregation import run_modis_aggre, init_grid_data, GridAccumulator, finalize, \
+    save_accumulators, load_accumulators, merge_accumulators, rollup_product
+from tests.helpers import GranuleRunTest
+
+
+class RollupTest(GranuleRunTest):
+    granules = 4
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'varnames': self.varnames, 'sts_switch': self.sts_switch, 'histnames': self.histnames,
+                       'NTA_lats': [-5, 5], 'NTA_lons': [25, 35], 'gap_x': 0.5, 'gap_y': 0.5,
+                       'grid_lat': 20, 'grid_lon': 20, 'unit_list': ['none'] * 3,
+                       'longname_list': ['CF', 'CTP', 'COT'], 'fillvalue_list': [-9999] * 3,
+                       'scale_list': [0.0001, 0.1, 0.01], 'offst_list': [0.0] * 3}
+
+    def run_aggre(self, hdfs, grid_data):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [25, 35], 20, 20, 0.5, 0.5, hdfs, grid_data,
+                               self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d, self.var_idx,
+                               histnames=self.histnames, spl_num=2)
+
+    def save_day(self, day, hdfs, grid_data):
+        fname = os.path.join(self.tmpdir, 'day{}.h5'.format(day))
+        config = dict(self.config, start='2008-01-0{}'.format(day), end='2008-01-0{}'.format(day), granules=len(hdfs))
+        save_accumulators(fname, self.run_aggre(hdfs, grid_data), config)
+        return fname
+
+    def test_finalize_leaves_accumulators(self):
+        grid_data = self.run_aggre(np.arange(2), init_grid_data(*self.args))
+        before = {key: grid_data[key].copy() for key in grid_data}
+        final = finalize(grid_data, self.sts_switch, self.varnames, self.histnames, 20, 20)
+
+        for key in grid_data:
+            np.testing.assert_array_equal(grid_data[key], before[key])
+        key = 'Cloud_Top_Pressure'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = before[key + '_Mean'] / before[key + '_Pixel_Counts']
+            std = (before[key + '_Standard_Deviation'] / before[key + '_Pixel_Counts'] - mean ** 2) ** 0.5
+        np.testing.assert_array_equal(final[key + '_Mean'], mean.reshape(20, 20))
+        np.testing.assert_array_equal(final[key + '_Standard_Deviation'], std.reshape(20, 20))
+        self.assertEqual(final[key + '_Jhisto_vs__COT'].shape, (20, 20, 4, 3))
+        self.assertEqual(list(final), list(grid_data))
+
+    def test_daily_files_merge_into_period(self):
+        period = self.run_aggre(np.arange(4), init_grid_data(*self.args))
+        fnames = [self.save_day(1, np.arange(2), init_grid_data(*self.args)),
+                  self.save_day(2, np.arange(2, 4), GridAccumulator(*self.args))]
+
+        day, config = load_accumulators(fnames[0])
+        self.assertEqual(list(day), list(period))
+        self.assertEqual(config['varnames'], self.varnames.tolist())
+
+        merged, config = merge_accumulators(fnames)
+        self.assertEqual((config['start'], config['end'], config['granules']), ('2008-01-01', '2008-01-02', 4))
+        for key in period:
+            np.testing.assert_allclose(merged[key], period[key], rtol=1e-12, err_msg=key)
+
+        out_fname = os.path.join(self.tmpdir, 'month.h5')
+        rollup_product(fnames, out_fname)
+        with h5py.File(out_fname, 'r') as f:
+            self.assertEqual(f['Cloud_Top_Pressure_Pixel_Counts'].shape, (20, 20))
+            np.testing.assert_array_equal(f['Cloud_Top_Pressure_Pixel_Counts'][()],
+                                          period['Cloud_Top_Pressure_Pixel_Counts'].reshape(20, 20))
+
+    def test_moment_attributes(self):
+        grid_data = self.run_aggre(np.arange(2), init_grid_data(*self.args, moments=True))
+        fname = os.path.join(self.tmpdir, 'day1.h5')
+        save_accumulators(fname, grid_data, self.config)
+        out_fname = os.path.join(self.tmpdir, 'month.h5')
+        rollup_product([fname], out_fname)
+        with h5py.File(out_fname, 'r') as f:
+            self.assertEqual(dict(f.attrs), MOMENT_ATTRS)
+            self.assertIn('Cloud_Top_Pressure_Standard_Deviation', f)
+
+    def test_sparse_accumulators_stay_sparse(self):
+        period = self.run_aggre(np.arange(4), init_grid_data(*self.args))
+        with mock.patch.object(SparseHistogram, 'toarray', side_effect=AssertionError('densified')):
+            fnames = [self.save_day(1, np.arange(2), GridAccumulator(*self.args, sparse=True)),
+                      self.save_day(2, np.arange(2, 4), GridAccumulator(*self.args, sparse=True))]
+            with h5py.File(fnames[0], 'r') as f:
+                self.assertIsInstance(f['Cloud_Top_Pressure_Jhisto_vs__COT'], h5py.Group)
+            day, config = load_accumulators(fnames[0])
+            self.assertIsInstance(day['Cloud_Top_Pressure_Jhisto_vs__COT'], SparseHistogram)
+            merged, config = merge_accumulators(fnames)
+            self.assertIsInstance(merged['Cloud_Top_Pressure_Jhisto_vs__COT'], SparseHistogram)
+            # Added to the dense histograms of another run without densifying them either
+            dense, config = merge_accumulators([self.save_day(3, np.arange(0), init_grid_data(*self.args))] + fnames)
+        for grid_data in [merged, dense]:
+            for key in period:
+                np.testing.assert_allclose(np.asarray(grid_data[key]), period[key], rtol=1e-12, err_msg=key)
+
+    def test_different_grids_are_refused(self):
+        fname = self.save_day(1, np.arange(1), init_grid_data(*self.args))
+        self.config['gap_x'] = 1.0
+        other = self.save_day(2, np.arange(1), init_grid_data(*self.args))
+        with self.assertRaises(ValueError):
+            merge_accumulators([fname, other])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import unittest
+import numpy as np
+import h5py
+from MODIS_Aggregation import SparseHistogram, run_modis_aggre, init_grid_data, allocate_grid_data, plan_run, \
+    finalize, write_level3, read_sparse_entry, merge_grid_data, save_checkpoint, load_checkpoint
+from tests.helpers import GranuleRunTest
+
+
+class SparseHistogramTest(unittest.TestCase):
+
+    def test_matches_dense_accumulation(self):
+        rng = np.random.RandomState(0)
+        dense = np.zeros((50, 4, 3), dtype=np.int64)
+        hist = SparseHistogram((50, 4, 3))
+        for i in range(20):
+            cells = rng.choice(50, 8, replace=False)
+            partial = rng.randint(0, 3, (8, 4, 3)) * (rng.rand(8, 4, 3) < 0.2)
+            dense[cells] += partial
+            hist.add(cells, partial)
+
+        np.testing.assert_array_equal(hist.toarray(), dense)
+        np.testing.assert_array_equal(np.asarray(hist), dense)
+        self.assertEqual(hist.nnz, np.count_nonzero(dense))
+        self.assertTrue(np.all(np.diff(hist.index) > 0))
+
+        # Blocks densify only the selected entries
+        for item in [np.s_[10:20], np.s_[3:7, 1:3], np.s_[..., 2], np.s_[:, :, 1:], np.s_[48:60, 2:, :1], 5]:
+            np.testing.assert_array_equal(hist[item], dense[item], err_msg=str(item))
+
+        reshaped = hist.reshape((5, 10, 4, 3))
+        np.testing.assert_array_equal(reshaped[1:3, 2:5], dense.reshape(5, 10, 4, 3)[1:3, 2:5])
+
+        copy = hist.copy()
+        copy.add_sparse(hist)
+        np.testing.assert_array_equal(copy.toarray(), 2 * dense)
+        np.testing.assert_array_equal(hist.toarray(), dense)
+
+        copy[...] = dense
+        np.testing.assert_array_equal(copy.toarray(), dense)
+        with self.assertRaises(ValueError):
+            copy.add_sparse(SparseHistogram((50, 12)))
+
+
+class SparseAccumulatorTest(GranuleRunTest):
+    # A 0.1 degree grid, mostly not covered by the granules
+    grid_lat, grid_lon = 100, 200
+
+    def run_aggre(self, grid_data, **kwargs):
+        return run_modis_aggre(self.fname1, self.fname2, [-5, 5], [20, 40], 200, 100, 0.1, 0.1, np.arange(3),
+                               grid_data, self.sts_switch, self.varnames, self.intervals_1d, self.intervals_2d,
+                               self.var_idx, histnames=self.histnames, spl_num=2, **kwargs)
+
+    def test_run_matches_dense(self):
+        expected = self.run_aggre(init_grid_data(*self.args, moments=True))
+        plan = plan_run(*self.args, fname1=self.fname1, fname2=self.fname2, spl_num=2, moments=True,
+                        strategy='sparse', granule_shape=(120, 90))
+        for kwargs in [{}, {'workers': 2}]:
+            grid_data = self.run_aggre(allocate_grid_data(plan, *self.args, moments=True), **kwargs)
+            self.assertIsInstance(grid_data['Cloud_Top_Pressure_Jhisto_vs__COT'], SparseHistogram)
+            for key in expected:
+                np.testing.assert_array_equal(np.asarray(grid_data[key]), expected[key], err_msg=key)
+            self.assertLessEqual(grid_data.nbytes, plan.accumulator_bytes)
+
+        # Far less memory than the dense histograms, also to save them
+        dense = sum(expected[key].nbytes for key in expected if 'Histogram' in key or 'Jhisto' in key)
+        self.assertGreater(plan.saved_bytes, 0)
+        self.assertGreaterEqual(plan.peak_bytes, plan.accumulator_bytes + plan.saved_bytes)
+        self.assertLess(plan.saved_bytes, dense / 10)
+        self.assertEqual(plan_run(*self.args, moments=True).saved_bytes, 0)
+        self.assertLess(sum(hist.nbytes for hist in grid_data.sparse.values()), dense / 10)
+
+        # Merged with the accumulators of another run, sparse or dense
+        merged = merge_grid_data(allocate_grid_data('sparse', *self.args, moments=True), grid_data)
+        merged = merge_grid_data(merged, expected)
+        dense = merge_grid_data(init_grid_data(*self.args, moments=True), grid_data)
+        for key in expected:
+            if key in grid_data.sparse:
+                np.testing.assert_array_equal(np.asarray(merged[key]), 2 * expected[key], err_msg=key)
+            np.testing.assert_array_equal(dense[key], expected[key], err_msg=key)
+
+    def test_write_and_checkpoint(self):
+        expected = self.run_aggre(init_grid_data(*self.args))
+        grid_data = self.run_aggre(allocate_grid_data('sparse', *self.args))
+        map_lat, map_lon = np.arange(-5, 5, 0.1), np.arange(20, 40, 0.1)
+        attrs = (['none'] * 3, list(self.varnames), [-9999] * 3, [0.0001, 0.1, 0.01], [0.0] * 3)
+        dense_file, chunked_file, sparse_file = [os.path.join(self.tmpdir, name) for name in
+                                                 ['dense.h5', 'chunked.h5', 'sparse.h5']]
+        write_level3(dense_file, finalize(expected, self.sts_switch, self.varnames, self.histnames, 100, 200),
+                     self.sts_switch, map_lat, map_lon, *attrs)
+        final = finalize(grid_data, self.sts_switch, self.varnames, self.histnames, 100, 200)
+        write_level3(chunked_file, final, self.sts_switch, map_lat, map_lon, *attrs)
+        write_level3(sparse_file, final, self.sts_switch, map_lat, map_lon, *attrs, sparse=True,
+                     attrs={'accumulators': 'sparse'})
+
+        with h5py.File(dense_file, 'r') as fd, h5py.File(chunked_file, 'r') as fc, h5py.File(sparse_file, 'r') as fs:
+            self.assertEqual(sorted(fd), sorted(fc))
+            self.assertEqual(sorted(fd), sorted(fs))
+            self.assertEqual(fs.attrs['accumulators'], 'sparse')
+            for key in fd:
+                np.testing.assert_array_equal(fc[key][...], fd[key][...], err_msg=key)
+                if isinstance(fs[key], h5py.Group):
+                    self.assertEqual(fs[key].attrs['long_name'], fd[key].attrs['long_name'])
+                    np.testing.assert_array_equal(read_sparse_entry(fs[key]).toarray(), fd[key][...], err_msg=key)
+                else:
+                    np.testing.assert_array_equal(fs[key][...], fd[key][...], err_msg=key)
+            self.assertIsInstance(fs['Cloud_Top_Pressure_Jhisto_vs__COT'], h5py.Group)
+
+        # Checkpoints keep the sparse form, and restore into sparse or dense accumulators
+        checkpoint_file = os.path.join(self.tmpdir, 'checkpoint.npz')
+        save_checkpoint(checkpoint_file, grid_data, ['a'], {})
+        for restored in [allocate_grid_data('sparse', *self.args), init_grid_data(*self.args)]:
+            self.assertEqual(load_checkpoint(checkpoint_file, restored)[0], ['a'])
+            for key in expected:
+                np.testing.assert_array_equal(np.asarray(restored[key]), expected[key], err_msg=key)
+
+
+if __name__ == '__main__':
+    unittest.main()
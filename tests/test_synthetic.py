@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+from MODIS_Aggregation import read_MODIS, pair_granules, build_granule_index, aggregateOneFileData
+from MODIS_Aggregation.synthetic import write_synthetic_granules, swath_geolocation
+
+
+class SyntheticGranuleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname1, self.fname2 = write_synthetic_granules(self.tmpdir, datetime(2008, 1, 1, 0, 0), 2, (203, 136))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_swath_geometry(self):
+        lat, lon, sza = swath_geolocation(datetime(2008, 1, 1, 0, 0))
+        self.assertEqual(lat.shape, (2030, 1354))
+        # About 18 degrees along track and 2330 km (21 degrees of great circle) across track
+        self.assertAlmostEqual(lat[-1, 677] - lat[0, 677], 18.1, delta=0.5)
+        self.assertTrue(np.all(np.abs(lat) <= 90) & np.all(np.abs(lon) <= 180))
+        self.assertTrue(np.all((sza >= 0) & (sza <= 180)))
+
+    def test_files_read_like_modis(self):
+        varnames = np.array(['cloud_fraction', 'Cloud_Top_Pressure', 'Cloud_Top_Temperature'])
+        lat, lon, data = read_MODIS(varnames, self.fname1[0], self.fname2[0], 3)
+        self.assertEqual(lat.shape, (67, 45))
+        self.assertEqual(sorted(np.unique(data['CM'])), [0, 1, 2, 3])
+
+        # Cloud variables are filled over the (probably) clear pixels and within their physical range
+        cloudy = data['CM'] <= 1
+        self.assertTrue(np.all(np.isnan(data['Cloud_Top_Pressure'][~cloudy])))
+        self.assertTrue(np.all((data['Cloud_Top_Pressure'][cloudy] >= 100) &
+                               (data['Cloud_Top_Pressure'][cloudy] <= 1050)))
+        self.assertTrue(np.all((data['Cloud_Top_Temperature'][cloudy] >= 180) &
+                               (data['Cloud_Top_Temperature'][cloudy] <= 310)))
+
+        with Dataset(self.fname1[0]) as nc:
+            byte0 = np.array(nc.variables['Cloud_Mask_1km'][:, :, 0]).view(np.uint8)
+        self.assertTrue(np.all(byte0 & 1))
+
+        cloud_pix, total_pix = aggregateOneFileData(self.fname1[0], self.fname2[0])
+        self.assertEqual(total_pix.sum(), 68 * 46)
+
+    def test_discovery_and_index(self):
+        fname1, fname2, unmatched = pair_granules(self.tmpdir, 'MYD06_L2.A', self.tmpdir, 'MYD03.A', fileformat='nc')
+        self.assertEqual(list(fname1), list(self.fname1))
+        index = build_granule_index(fname2)
+        self.assertTrue(set(index['daynight']) <= set(['D', 'N', 'M']))
+        self.assertTrue(np.all(index['lat_max'] - index['lat_min'] > 15))
+
+    def test_benchmark_suite(self):
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks',
+                              'run_benchmarks.py')
+        output = os.path.join(self.tmpdir, 'bench.json')
+        args = [sys.executable, script, '--shape', '60,40', '--files', '1', '--gaps', '2.0', '--spl', '3',
+                '--repeat', '1', '--output', output]
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(sorted(r['phase'] for r in report['results']),
+                         ['cloud_fraction', 'grid', 'read', 'stats', 'write'])
+
+        result = subprocess.run(args + ['--compare', output, '--threshold', '1000'], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+
+
+if __name__ == '__main__':
+    unittest.main()